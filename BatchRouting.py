@@ -0,0 +1,262 @@
+import argparse
+import csv
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+import ComputePool
+import EdgeSnapping
+import RoutingGraph
+import SharedGraph
+
+# OD pairs grouped together; pairs from the same origin point within a chunk share one search
+CHUNK_SIZE = 50_000
+# Roughly this many pairs per pool task (an origin's pairs are never split)
+TASK_SIZE = 256
+
+# Graphs attached by this worker process, keyed by directory (one at a time)
+_worker_graphs = {}
+
+
+def parse_pairs(lines):
+    """OD pairs from NDJSON or CSV lines; yields (id, source, target, error).
+
+    NDJSON lines look like {"id": 7, "source": [lon, lat], "target": [lon, lat]};
+    CSV lines are id,source_lon,source_lat,target_lon,target_lat with an
+    optional header. Malformed lines yield an error message instead of
+    stopping the batch.
+    """
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line:
+            continue
+        pair_id = number
+        try:
+            if line.startswith("{"):
+                record = json.loads(line)
+                pair_id = record.get("id", number)
+                source, target = record["source"], record["target"]
+                source = (float(source[0]), float(source[1]))
+                target = (float(target[0]), float(target[1]))
+            else:
+                row = next(csv.reader([line]))
+                if number == 1 and row and row[0].strip().lower() == "id":
+                    continue
+                pair_id = row[0]
+                source = (float(row[1]), float(row[2]))
+                target = (float(row[3]), float(row[4]))
+            if not all(np.isfinite(source + target)):
+                raise ValueError("coordinates must be finite")
+            yield pair_id, source, target, None
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            yield pair_id, None, None, f"{type(e).__name__}: {e}"
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def group_by_origin(pairs):
+    """Split parsed pairs into tasks of (source point, [(id, target point), ...]) groups."""
+    groups = defaultdict(list)
+    for pair_id, source, target, _ in pairs:
+        groups[source].append((pair_id, target))
+
+    tasks, task, size = [], [], 0
+    for source, items in groups.items():
+        task.append((source, items))
+        size += len(items)
+        if size >= TASK_SIZE:
+            tasks.append(task)
+            task, size = [], 0
+    if task:
+        tasks.append(task)
+    return tasks
+
+
+def route_group(graph, source, items, metric, include_path=False):
+    """One search from `source` answering every (id, target) pair of the group.
+
+    Points are snapped onto the nearest road segment like /shortest-path/
+    snaps them, and the partial edges at either end are charged the same way.
+    """
+    weights = graph.weights(metric)
+    try:
+        origin = EdgeSnapping.snap(graph, *source)
+    except ValueError as e:
+        return [{"id": pair_id, "status": "invalid", "error": str(e)} for pair_id, _ in items]
+    snaps = {}
+    for _, target in items:
+        if target not in snaps:
+            try:
+                snaps[target] = EdgeSnapping.snap(graph, *target)
+            except ValueError:
+                snaps[target] = None
+
+    # Targets in other components would make the search exhaust the source's component
+    entries = {target: EdgeSnapping.target_entries(graph, weights, snap) for target, snap in snaps.items()
+               if snap is not None and EdgeSnapping.may_connect(graph, origin, snap)}
+    wanted = {node for nodes in entries.values() for node in nodes}
+    dist, parent = RoutingGraph.one_to_many(graph, EdgeSnapping.source_exits(graph, weights, origin), wanted, metric)
+
+    results = []
+    for pair_id, target in items:
+        snap = snaps[target]
+        if snap is None:
+            results.append({"id": pair_id, "status": "invalid", "error": "No road near the target."})
+            continue
+        best, nodes = EdgeSnapping.along_segment(weights, origin, snap), []
+        for node, arrive in entries.get(target, {}).items():
+            if node in dist and dist[node] + arrive < best:
+                best, nodes = dist[node] + arrive, RoutingGraph.path_to(parent, node)
+        snapped = {"snapped_source": [origin.lat, origin.lon], "snapped_target": [snap.lat, snap.lon]}
+        if best == math.inf:
+            results.append({"id": pair_id, "status": "no_path", **snapped})
+            continue
+        result = {"id": pair_id, "status": "ok", "cost": best, **snapped}
+        if include_path:
+            result["path"] = [[lat, lon] for lon, lat in EdgeSnapping.route_coords(graph, origin, snap, nodes, metric)]
+        results.append(result)
+    return results
+
+
+def route_task(graph_dir, task, metric, include_path, closures=None, limits=(None, None)):
+    """Pool entry point: attach the graph at `graph_dir` (memory-mapped, cached) and route a task.
+
+    `closures` is the Closures.Overlay of the request, if any, and `limits`
+    the batch's SearchBudget.remaining(). Returns (results, nodes settled).
+    """
+    graph = _worker_graphs.get(graph_dir)
+    if graph is None:
+        # A new generation replaces the old mapping instead of piling up
+        _worker_graphs.clear()
+        graph = _worker_graphs[graph_dir] = SharedGraph.load_generation(graph_dir)
+    graph = graph.with_closures(closures)
+    results = []
+    with ComputePool.limited(*limits) as budget:
+        for source, items in task:
+            results.extend(route_group(graph, source, items, metric, include_path))
+    return results, budget.settled
+
+
+def _finished(in_flight, budget):
+    """Wait for at least one task, charging its settled nodes to `budget`; returns (results, still running)."""
+    _, seconds = budget.remaining()
+    done, in_flight = wait(in_flight, timeout=seconds, return_when=FIRST_COMPLETED)
+    budget.check_deadline()
+    results = []
+    for future in done:
+        task_results, settled = future.result()
+        budget.settle(settled)
+        results.extend(task_results)
+    return results, in_flight
+
+
+def make_pool(workers):
+    """Process pool for route_batch; spawned so forking a threaded server is never an issue."""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def route_batch(graph, pairs, metric="distance", graph_dir=None, pool=None, include_path=False,
+                chunk_size=CHUNK_SIZE):
+    """Route an iterable of parsed OD pairs, yielding one result dict per pair as they finish.
+
+    Pairs are grouped by origin point and snapped onto road segments where
+    they are routed. With a pool (and the saved graph directory for workers to
+    memory-map) tasks run in parallel and results arrive out of order, so
+    every result carries the pair's id and a status of "ok", "no_path" or
+    "invalid". Searches are charged to the current ComputePool budget; pool
+    workers get what is left of it with each task.
+    """
+    graph.weights(metric)  # fail fast on an unknown metric
+    parallel = pool is not None and graph_dir is not None
+    in_flight = set()
+    max_in_flight = 4 * (os.cpu_count() or 1)
+
+    try:
+        for chunk in _chunks(pairs, chunk_size):
+            valid = [pair for pair in chunk if pair[3] is None]
+            for pair_id, _, _, error in chunk:
+                if error is not None:
+                    yield {"id": pair_id, "status": "invalid", "error": error}
+            if not valid:
+                continue
+
+            tasks = group_by_origin(valid)
+
+            if not parallel:
+                for task in tasks:
+                    for source, items in task:
+                        yield from route_group(graph, source, items, metric, include_path)
+                continue
+
+            for task in tasks:
+                # Bound the queue so a huge input never piles up results in memory
+                while len(in_flight) >= max_in_flight:
+                    results, in_flight = _finished(in_flight, ComputePool.budget())
+                    yield from results
+                in_flight.add(pool.submit(route_task, graph_dir, task, metric, include_path, graph.closures,
+                                          ComputePool.budget().remaining()))
+
+        while in_flight:
+            results, in_flight = _finished(in_flight, ComputePool.budget())
+            yield from results
+    finally:
+        # Stopped early (deadline, budget, client gone): drop the tasks that have not started
+        for future in in_flight:
+            future.cancel()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Route many origin/destination pairs and write NDJSON results.")
+    parser.add_argument("pairs", help="CSV or NDJSON file of OD pairs ('-' for stdin)")
+    parser.add_argument("--out", default="-", help="NDJSON output file ('-' for stdout)")
+    parser.add_argument("--store", default=os.environ.get("ROUTE_GRAPH_STORE", SharedGraph.DEFAULT_ROOT),
+                        help="graph store to attach (uses its current generation)")
+    parser.add_argument("--metric", default="distance")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--paths", action="store_true", help="include the [lat, lon] path of every route")
+    args = parser.parse_args()
+
+    store = SharedGraph.GraphStore(args.store)
+    generation = store.current_generation()
+    if generation is None:
+        sys.exit(f"No graph published in {args.store}; run SharedGraph.py publish first.")
+    graph = store.attach(generation)
+
+    source_file = sys.stdin if args.pairs == "-" else open(args.pairs, "r", encoding="utf-8")
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    pool = make_pool(args.workers) if args.workers > 1 else None
+    start = time.perf_counter()
+    counts = defaultdict(int)
+    try:
+        results = route_batch(graph, parse_pairs(source_file), args.metric, store.generation_dir(generation),
+                              pool, args.paths)
+        for result in results:
+            counts[result["status"]] += 1
+            out.write(json.dumps(result) + "\n")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    print(f"Routed {total} pairs in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f}/s): "
+          + ", ".join(f"{status}={count}" for status, count in sorted(counts.items())), file=sys.stderr)
@@ -0,0 +1,141 @@
+import io
+import os
+
+import networkx as nx
+import psycopg2
+from geopy.distance import geodesic
+
+import SearchEngine
+from Experiment.graphTraversing import dijkstra_manual, networkx_shortest_path
+
+# Database connection parameters (only used by the pgr_dijkstra engine)
+DB_CONFIG = {
+    "dbname": os.environ.get("BENCH_DB_NAME", "routedb"),
+    "user": os.environ.get("BENCH_DB_USER", "postgres"),
+    "password": os.environ.get("BENCH_DB_PASSWORD", "admin"),
+    "host": os.environ.get("BENCH_DB_HOST", "localhost"),
+    "port": os.environ.get("BENCH_DB_PORT", "5432"),
+}
+
+
+class Engine:
+    """A routing engine under benchmark.
+
+    `prepare` does the one-off work (graph build, table load) and returns a context;
+    `query` answers one source/target pair and returns (cost, nodes_settled).
+    `nodes_settled` is None when the engine cannot report it.
+    """
+    name = None
+
+    def prepare(self, network):
+        return network
+
+    def query(self, context, source, target):
+        raise NotImplementedError
+
+    def close(self, context):
+        pass
+
+
+class DijkstraManualEngine(Engine):
+    """`dijkstra_manual` from graphTraversing, with its SearchEngine built once in `prepare`."""
+    name = "dijkstra_manual"
+
+    def prepare(self, network):
+        return dict(network, engine=SearchEngine.SearchEngine.from_edges(network["nodes"], network["edges"]))
+
+    def query(self, context, source, target):
+        stats = {}
+        result = dijkstra_manual(context["nodes"], context["edges"], source, target, stats=stats,
+                                 engine=context["engine"])
+        return result["cost"], stats.get("settled", 0)
+
+
+class NetworkxShortestPathEngine(Engine):
+    """`networkx_shortest_path` from graphTraversing; rebuilds its nx.Graph on every call."""
+    name = "networkx_shortest_path"
+
+    def query(self, context, source, target):
+        stats = {}
+        result = networkx_shortest_path(context["nodes"], context["edges"], source, target, stats=stats)
+        return result["cost"], stats.get("settled", 0)
+
+
+class AstarGeodesicEngine(Engine):
+    """`nx.astar_path` on a prebuilt DiGraph with the geodesic heuristic used in MultPathFinding."""
+    name = "astar_geodesic"
+
+    def prepare(self, network):
+        G = nx.DiGraph()
+        for node_id, coord in network["coords"].items():
+            G.add_node(node_id, pos=coord)
+        for source, target, cost in network["edges"]:
+            G.add_edge(source, target, weight=cost)
+        return G
+
+    def query(self, G, source, target):
+        pos = G.nodes
+        settled = set()
+
+        def heuristic(u, v):
+            (lon1, lat1), (lon2, lat2) = pos[u]["pos"], pos[v]["pos"]
+            return geodesic((lat1, lon1), (lat2, lon2)).meters
+
+        def weight(u, v, data):
+            settled.add(u)
+            return data["weight"]
+
+        try:
+            path = nx.astar_path(G, source, target, heuristic=heuristic, weight=weight)
+        except nx.NetworkXNoPath:
+            return float("inf"), len(settled)
+        cost = sum(G[path[i]][path[i + 1]]["weight"] for i in range(len(path) - 1))
+        return cost, len(settled)
+
+
+class PgrDijkstraEngine(Engine):
+    """`pgr_dijkstra` over a temporary edge table loaded with COPY."""
+    name = "pgr_dijkstra"
+
+    def prepare(self, network):
+        conn = psycopg2.connect(**DB_CONFIG)
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TEMP TABLE bench_edges (
+                id SERIAL PRIMARY KEY,
+                source INT NOT NULL,
+                target INT NOT NULL,
+                cost DOUBLE PRECISION NOT NULL
+            );
+        """)
+        buffer = io.StringIO()
+        for source, target, cost in network["edges"]:
+            buffer.write(f"{source}\t{target}\t{cost!r}\n")
+        buffer.seek(0)
+        cur.copy_expert("COPY bench_edges (source, target, cost) FROM STDIN", buffer)
+        cur.execute("ANALYZE bench_edges;")
+        conn.commit()
+        return conn
+
+    def query(self, conn, source, target):
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT agg_cost FROM pgr_dijkstra(
+                    'SELECT id, source, target, cost FROM bench_edges', %s, %s, directed := true
+                )
+                ORDER BY path_seq DESC LIMIT 1;
+            """, (source, target))
+            row = cur.fetchone()
+        return (float(row[0]) if row else float("inf")), None
+
+    def close(self, conn):
+        conn.close()
+
+
+ENGINES = {
+    engine.name: engine
+    for engine in (DijkstraManualEngine, NetworkxShortestPathEngine, AstarGeodesicEngine, PgrDijkstraEngine)
+}
+
+# pgr_dijkstra needs a live PostGIS/pgRouting database, so it only runs when asked for
+DEFAULT_ENGINES = ["dijkstra_manual", "networkx_shortest_path", "astar_geodesic"]
@@ -0,0 +1,281 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from Benchmark.RunBenchmark import NOISE_FLOOR, summarize
+
+REPORT_SCHEMA = 1
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Endpoint name -> (method, path); names are what --mix refers to
+ENDPOINTS = {
+    "shortest-path": ("POST", "/shortest-path/"),
+    "fetch-geojson": ("GET", "/fetch-geojson/"),
+    "insert-geojson": ("POST", "/insert-geojson/"),
+}
+DEFAULT_MIX = "shortest-path=90,fetch-geojson=8,insert-geojson=2"
+# Answers that are part of normal operation (no route between two random points), not errors
+EXPECTED_STATUS = {"shortest-path": {404}}
+# A drop in throughput or a rise in error rate larger than these is never noise
+THROUGHPUT_FLOOR_RPS = 0.5
+ERROR_RATE_FLOOR = 0.01
+
+
+def parse_mix(text):
+    """"name=weight,..." -> {name: weight}."""
+    mix = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {name!r} in the mix; use one of {list(ENDPOINTS)}.")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("The mix needs at least one endpoint with a positive weight.")
+    return mix
+
+
+def road_points(path):
+    """Every LineString vertex in a GeoJSON file, as (lon, lat); route requests are drawn from these."""
+    with open(path, "r", encoding="utf-8") as f:
+        features = json.load(f)["features"]
+    points = []
+    for feature in features:
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "LineString":
+            points.extend((lon, lat) for lon, lat in (c[:2] for c in geometry["coordinates"]))
+    if not points:
+        raise ValueError(f"{path} has no LineString features to route on.")
+    return points
+
+
+def make_request(name, points, rng):
+    """(method, path, json body) for one request to the named endpoint."""
+    method, path = ENDPOINTS[name]
+    if name == "shortest-path":
+        source, target = rng.sample(points, 2)
+        return method, path, {"source": list(source), "target": list(target)}
+    if name == "insert-geojson":
+        # A short spur off an existing vertex, so the network stays connected as it grows
+        lon, lat = rng.choice(points)
+        spur = [[lon, lat], [lon + rng.uniform(-2e-4, 2e-4), lat + rng.uniform(-2e-4, 2e-4)]]
+        feature = {"type": "Feature", "properties": {"name": "load-test spur"},
+                   "geometry": {"type": "LineString", "coordinates": spur}}
+        return method, path, {"type": "FeatureCollection", "features": [feature]}
+    return method, path, None
+
+
+async def replay(base_url, mix, points, rps, duration, concurrency, timeout, seed):
+    """Send requests on a fixed open-loop schedule and return one record per request.
+
+    Request i is due at i / rps seconds whether or not earlier ones finished,
+    and latency is measured from that due time, so a server that falls behind
+    shows up as queueing delay rather than as a slower send rate.
+    """
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    total = int(rps * duration)
+    records = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        async def send(name, method, path, body, due):
+            record = {"endpoint": name, "status": None}
+            try:
+                response = await client.request(method, path, json=body)
+                record["status"] = response.status_code
+            except httpx.HTTPError as e:
+                record["error"] = type(e).__name__
+            record["latency_ms"] = (time.perf_counter() - due) * 1000
+            records.append(record)
+
+        start = time.perf_counter()
+        tasks = []
+        for i in range(total):
+            due = start + i / rps
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            name = rng.choices(names, weights)[0]
+            tasks.append(asyncio.create_task(send(name, *make_request(name, points, rng), due)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    return records, elapsed
+
+
+def endpoint_report(records, elapsed):
+    """Throughput, latency distribution and error counts for a set of requests."""
+    statuses = {}
+    errors = 0
+    for record in records:
+        key = str(record["status"]) if record["status"] is not None else record["error"]
+        statuses[key] = statuses.get(key, 0) + 1
+        status = record["status"]
+        if status is None or (status >= 400 and status not in EXPECTED_STATUS.get(record["endpoint"], ())):
+            errors += 1
+    ok = [r["latency_ms"] for r in records if r["status"] is not None and r["status"] < 400]
+    return {
+        "requests": len(records),
+        "throughput_rps": (len(records) - errors) / elapsed if elapsed else 0.0,
+        "error_rate": errors / len(records) if records else 0.0,
+        "statuses": statuses,
+        "latency_ms": summarize([r["latency_ms"] for r in records]),
+        "ok_latency_ms": summarize(ok),
+    }
+
+
+def wait_until_ready(base_url, server, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The server exited with code {server.returncode} before it was ready.")
+        try:
+            if httpx.get(base_url + "/metrics", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"The server did not answer on {base_url} within {timeout:.0f}s.")
+
+
+def start_server(data, port, workers, workdir):
+    """Run RouteApi under uvicorn on a private copy of the data file and a private graph store."""
+    data_file = os.path.join(workdir, "routes.geojson")
+    shutil.copyfile(data, data_file)
+    env = dict(os.environ, ROUTE_DATA_FILE=data_file, ROUTE_GRAPH_STORE=os.path.join(workdir, "store"))
+    command = [sys.executable, "-m", "uvicorn", "RouteApi:app", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(workers), "--log-level", "warning"]
+    # RouteApi serves static/ and templates/ relative to the working directory
+    return subprocess.Popen(command, cwd=REPO_ROOT, env=env)
+
+
+def run(args):
+    mix = parse_mix(args.mix)
+    points = road_points(args.data)
+    workdir = server = None
+    base_url = args.url
+    try:
+        if base_url is None:
+            workdir = tempfile.mkdtemp(prefix="loadtest-")
+            server = start_server(args.data, args.port, args.workers, workdir)
+            base_url = f"http://127.0.0.1:{args.port}"
+            wait_until_ready(base_url, server)
+        # The first route builds and publishes the graph; keep that out of the measurement
+        method, path, body = make_request("shortest-path", points, random.Random(args.seed))
+        httpx.request(method, base_url + path, json=body, timeout=600.0)
+
+        records, elapsed = asyncio.run(replay(base_url, mix, points, args.rps, args.duration,
+                                              args.concurrency, args.timeout, args.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "schema": REPORT_SCHEMA,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "data": os.path.basename(args.data),
+        "target": args.url or f"local, {args.workers} worker(s)",
+        "mix": mix,
+        "target_rps": args.rps,
+        "duration_s": elapsed,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+        "overall": endpoint_report(records, elapsed),
+        "endpoints": {
+            name: endpoint_report([r for r in records if r["endpoint"] == name], elapsed) for name in mix
+        },
+    }
+    for name, result in [("overall", report["overall"])] + list(report["endpoints"].items()):
+        latency = result["latency_ms"] or {}
+        print(f"{name:<16} {result['requests']:>6} req {result['throughput_rps']:>8.1f} rps  "
+              f"p50 {latency.get('p50', math.nan):>8.1f}  p95 {latency.get('p95', math.nan):>8.1f}  "
+              f"p99 {latency.get('p99', math.nan):>8.1f} ms  errors {result['error_rate']:.1%}", file=sys.stderr)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Load test report saved to {args.out}", file=sys.stderr)
+    return 1 if report["overall"]["error_rate"] > args.max_error_rate else 0
+
+
+def compare(args):
+    """Compare two load test reports and flag lost capacity per endpoint."""
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, "r", encoding="utf-8") as f:
+        candidate = json.load(f)
+    if baseline["target_rps"] != candidate["target_rps"] or baseline["mix"] != candidate["mix"]:
+        print("warning: the reports were run with different rates or mixes", file=sys.stderr)
+
+    regressions = 0
+    for name, result in [("overall", candidate["overall"])] + list(candidate["endpoints"].items()):
+        before = baseline["overall"] if name == "overall" else baseline["endpoints"].get(name)
+        if before is None:
+            continue
+        rows = [("throughput_rps", before["throughput_rps"], result["throughput_rps"], -1, THROUGHPUT_FLOOR_RPS),
+                ("error_rate", before["error_rate"], result["error_rate"], 1, ERROR_RATE_FLOOR)]
+        if before["latency_ms"] and result["latency_ms"]:
+            for pct in ("p50", "p95", "p99"):
+                rows.append((f"{pct}_ms", before["latency_ms"][pct], result["latency_ms"][pct], 1, NOISE_FLOOR["ms"]))
+
+        for metric, old, new, worse, floor in rows:
+            # worse = 1: higher is worse (latency, errors); -1: lower is worse (throughput)
+            change = (new - old) * worse
+            ratio = new / old if old else math.inf
+            flag = ""
+            if change > floor and (old == 0 or change / old > args.threshold):
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{name:<16} {metric:<16} {old:>12.3f} {new:>12.3f} {ratio:>7.2f}x{flag}")
+
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a request mix against RouteApi and report capacity.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="run a load test and write a JSON report")
+    run_parser.add_argument("--data", default=os.path.join(REPO_ROOT, "data", "map.geojson"),
+                            help="GeoJSON routes served by the local app (copied; inserts never touch it)")
+    run_parser.add_argument("--url", help="load an already running server instead of starting one")
+    run_parser.add_argument("--port", type=int, default=2100)
+    run_parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the local app")
+    run_parser.add_argument("--mix", default=DEFAULT_MIX, help=f"endpoint=weight, from {', '.join(ENDPOINTS)}")
+    run_parser.add_argument("--rps", type=float, default=20.0, help="target requests per second")
+    run_parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    run_parser.add_argument("--concurrency", type=int, default=64, help="maximum open connections")
+    run_parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    run_parser.add_argument("--max-error-rate", type=float, default=0.01, help="exit 1 above this error rate")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--out", default="loadtest.json")
+
+    compare_parser = sub.add_parser("compare", help="compare two reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.2,
+                                help="relative change that counts as a regression")
+
+    args = parser.parse_args(argv)
+    return run(args) if args.command == "run" else compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+import math
+import random
+
+# Trip classes as fractions of the network's bounding-box diagonal (straight-line distance)
+TRIP_CLASSES = {
+    "short": (0.0, 0.15),
+    "medium": (0.15, 0.45),
+    "long": (0.45, math.inf),
+}
+
+
+def straight_line(coord1, coord2):
+    """Planar distance in degrees, good enough for bucketing trips by length."""
+    scale = math.cos(math.radians((coord1[1] + coord2[1]) / 2))
+    return math.hypot((coord1[0] - coord2[0]) * scale, coord1[1] - coord2[1])
+
+
+def make_queries(network, per_class=50, seed=0, max_attempts=1_000_000):
+    """Fixed, seeded source/target pairs split into short, medium and long trips.
+
+    The same network and seed always produce the same query set, so reports from
+    different runs compare like with like.
+    """
+    rng = random.Random(seed)
+    coords = network["coords"]
+    node_ids = sorted(coords)
+
+    lons = [coords[n][0] for n in node_ids]
+    lats = [coords[n][1] for n in node_ids]
+    diagonal = straight_line((min(lons), min(lats)), (max(lons), max(lats)))
+
+    queries = {name: [] for name in TRIP_CLASSES}
+    for _ in range(max_attempts):
+        if all(len(pairs) >= per_class for pairs in queries.values()):
+            break
+        source, target = rng.choice(node_ids), rng.choice(node_ids)
+        if source == target:
+            continue
+        ratio = straight_line(coords[source], coords[target]) / diagonal
+        for name, (low, high) in TRIP_CLASSES.items():
+            if low <= ratio < high and len(queries[name]) < per_class:
+                queries[name].append((source, target))
+                break
+
+    return queries
@@ -0,0 +1,205 @@
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from Benchmark.Engines import DEFAULT_ENGINES, ENGINES
+from Benchmark.QuerySets import make_queries
+from Benchmark.SyntheticGraphs import SIZES, generate_networks
+
+REPORT_SCHEMA = 1
+# Costs from different engines must agree within this relative tolerance
+COST_TOLERANCE = 1e-6
+# Differences below these absolute amounts are noise and never count as regressions
+NOISE_FLOOR = {"build_s": 0.01, "peak_memory_bytes": 64 * 1024, "ms": 0.05}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values):
+    """Distribution summary used for latencies and settled counts."""
+    if not values:
+        return None
+    return {
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def run_engine(engine, network, queries, memory_queries=5):
+    """Benchmark one engine on one network.
+
+    Timings come from an untraced pass; peak memory from a second pass under
+    tracemalloc (build plus a few queries), since tracing slows Python code down.
+    """
+    start = time.perf_counter()
+    context = engine.prepare(network)
+    build_s = time.perf_counter() - start
+
+    results = {}
+    try:
+        for trip_class, pairs in queries.items():
+            latencies, settled, costs = [], [], []
+            for source, target in pairs:
+                start = time.perf_counter()
+                cost, nodes_settled = engine.query(context, source, target)
+                latencies.append((time.perf_counter() - start) * 1000)
+                costs.append(cost)
+                if nodes_settled is not None:
+                    settled.append(nodes_settled)
+            results[trip_class] = {
+                "queries": len(pairs),
+                "latency_ms": summarize(latencies),
+                "nodes_settled": summarize(settled),
+                "costs": costs,
+            }
+    finally:
+        engine.close(context)
+
+    tracemalloc.start()
+    try:
+        context = engine.prepare(network)
+        try:
+            sample = [pair for pairs in queries.values() for pair in pairs[:memory_queries]]
+            for source, target in sample:
+                engine.query(context, source, target)
+        finally:
+            engine.close(context)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {"build_s": build_s, "peak_memory_bytes": peak_bytes, "trips": results}
+
+
+def check_agreement(reference, other):
+    """Indices of queries whose cost differs from the reference engine."""
+    mismatches = {}
+    for trip_class, ref in reference["trips"].items():
+        bad = [
+            i for i, (a, b) in enumerate(zip(ref["costs"], other["trips"][trip_class]["costs"]))
+            if not (a == b or abs(a - b) <= COST_TOLERANCE * max(abs(a), abs(b)))
+        ]
+        if bad:
+            mismatches[trip_class] = bad
+    return mismatches
+
+
+def run(args):
+    sizes = [s for s in args.sizes.split(",") if s]
+    engine_names = [e for e in args.engines.split(",") if e]
+    networks = generate_networks(sizes, seed=args.seed, geojson_path=args.geojson)
+
+    report = {
+        "schema": REPORT_SCHEMA,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "queries_per_class": args.queries,
+        "networks": {},
+        "results": [],
+    }
+
+    for network in networks:
+        queries = make_queries(network, per_class=args.queries, seed=args.seed)
+        report["networks"][network["name"]] = {
+            "nodes": len(network["nodes"]),
+            "edges": len(network["edges"]),
+            "queries": queries,
+        }
+        print(f"{network['name']}: {len(network['nodes'])} nodes, {len(network['edges'])} edges", file=sys.stderr)
+
+        reference = None
+        for name in engine_names:
+            result = run_engine(ENGINES[name](), network, queries)
+            result.update({"network": network["name"], "engine": name})
+            if reference is None:
+                reference = result
+            else:
+                result["cost_mismatches"] = check_agreement(reference, result)
+            report["results"].append(result)
+            p50 = {c: round(t["latency_ms"]["p50"], 2) for c, t in result["trips"].items() if t["latency_ms"]}
+            print(f"  {name}: build {result['build_s']:.2f}s, p50 ms {p50}", file=sys.stderr)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark report saved to {args.out}", file=sys.stderr)
+
+    return 1 if any(r.get("cost_mismatches") for r in report["results"]) else 0
+
+
+def compare(args):
+    """Compare two reports and flag engines that got slower than the threshold."""
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, "r", encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    old = {(r["network"], r["engine"]): r for r in baseline["results"]}
+    regressions = 0
+    for result in candidate["results"]:
+        key = (result["network"], result["engine"])
+        if key not in old:
+            continue
+        rows = [("build_s", old[key]["build_s"], result["build_s"]),
+                ("peak_memory_bytes", old[key]["peak_memory_bytes"], result["peak_memory_bytes"])]
+        for trip_class, trip in result["trips"].items():
+            before = old[key]["trips"].get(trip_class)
+            if before and before["latency_ms"] and trip["latency_ms"]:
+                for pct in ("p50", "p95", "p99"):
+                    rows.append((f"{trip_class}.{pct}_ms", before["latency_ms"][pct], trip["latency_ms"][pct]))
+
+        for metric, before, after in rows:
+            ratio = after / before if before else math.inf
+            floor = NOISE_FLOOR.get(metric, NOISE_FLOOR["ms"])
+            flag = ""
+            if ratio > 1 + args.threshold and after - before > floor:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{key[0]:<20} {key[1]:<24} {metric:<20} {before:>14.3f} {after:>14.3f} {ratio:>7.2f}x{flag}")
+        if result.get("cost_mismatches"):
+            print(f"{key[0]:<20} {key[1]:<24} cost mismatches: {result['cost_mismatches']}  REGRESSION")
+            regressions += 1
+
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the routing engines on synthetic and real networks.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="run the benchmark and write a JSON report")
+    run_parser.add_argument("--sizes", default="small", help=f"comma separated, from {', '.join(SIZES)}")
+    run_parser.add_argument("--engines", default=",".join(DEFAULT_ENGINES),
+                            help=f"comma separated, from {', '.join(ENGINES)}")
+    run_parser.add_argument("--geojson", help="also benchmark the network in this GeoJSON file (e.g. data/map.geojson)")
+    run_parser.add_argument("--queries", type=int, default=30, help="queries per trip class")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--out", default="bench.json")
+
+    compare_parser = sub.add_parser("compare", help="compare two reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.2,
+                                help="relative slowdown that counts as a regression")
+
+    args = parser.parse_args(argv)
+    return run(args) if args.command == "run" else compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import json
+import math
+import random
+
+import networkx as nx
+from geopy.distance import geodesic
+from scipy.spatial import cKDTree
+
+# Synthetic networks are laid out around the BIIT campus so coordinates look like our data
+ORIGIN = (73.05, 33.60)  # (longitude, latitude)
+METERS_PER_DEG_LAT = 111_320.0
+
+# Number of nodes (roughly) per named size
+SIZES = {
+    "small": 1_000,
+    "medium": 10_000,
+    "large": 50_000,
+}
+
+
+def edge_length(coord1, coord2):
+    """Geodesic length in meters between two (lon, lat) coordinates."""
+    return geodesic((coord1[1], coord1[0]), (coord2[1], coord2[0])).meters
+
+
+def offset(origin, dx_m, dy_m):
+    """Move a (lon, lat) coordinate by dx/dy meters."""
+    lon, lat = origin
+    meters_per_deg_lon = METERS_PER_DEG_LAT * math.cos(math.radians(lat))
+    return (lon + dx_m / meters_per_deg_lon, lat + dy_m / METERS_PER_DEG_LAT)
+
+
+def make_network(name, coords, undirected_edges):
+    """Keep the largest connected component and return a benchmark network.
+
+    The network uses the same shape as `fetch_graph_data` in graphTraversing:
+    `nodes` is a list of (id, name) and `edges` a list of directed (source, target, cost).
+    """
+    G = nx.Graph()
+    G.add_edges_from(undirected_edges)
+    largest = max(nx.connected_components(G), key=len)
+
+    ids = {old: new for new, old in enumerate(sorted(largest))}
+    edges = []
+    for u, v in G.subgraph(largest).edges():
+        cost = edge_length(coords[u], coords[v])
+        edges.append((ids[u], ids[v], cost))
+        edges.append((ids[v], ids[u], cost))
+
+    return {
+        "name": name,
+        "coords": {ids[old]: coords[old] for old in largest},
+        "nodes": [(node_id, str(node_id)) for node_id in range(len(ids))],
+        "edges": edges,
+    }
+
+
+def grid_with_noise(num_nodes, seed=0, spacing_m=120.0, jitter=0.3, drop_rate=0.1):
+    """Jittered street grid with a fraction of blocks removed."""
+    rng = random.Random(seed)
+    side = max(2, int(math.sqrt(num_nodes)))
+
+    coords = {}
+    for row in range(side):
+        for col in range(side):
+            dx = (col + rng.uniform(-jitter, jitter)) * spacing_m
+            dy = (row + rng.uniform(-jitter, jitter)) * spacing_m
+            coords[row * side + col] = offset(ORIGIN, dx, dy)
+
+    edges = []
+    for row in range(side):
+        for col in range(side):
+            node = row * side + col
+            if col + 1 < side and rng.random() >= drop_rate:
+                edges.append((node, node + 1))
+            if row + 1 < side and rng.random() >= drop_rate:
+                edges.append((node, node + side))
+
+    return make_network(f"grid-{num_nodes}", coords, edges)
+
+
+def random_geometric(num_nodes, seed=0, mean_degree=6.0, density_per_km2=400.0):
+    """Random geometric graph: points connected to every neighbour within a radius."""
+    rng = random.Random(seed)
+    side_m = math.sqrt(num_nodes / density_per_km2) * 1000.0
+    radius_m = math.sqrt(mean_degree / (math.pi * density_per_km2)) * 1000.0
+
+    points = [(rng.uniform(0, side_m), rng.uniform(0, side_m)) for _ in range(num_nodes)]
+    coords = {i: offset(ORIGIN, x, y) for i, (x, y) in enumerate(points)}
+    edges = cKDTree(points).query_pairs(radius_m)
+
+    return make_network(f"geometric-{num_nodes}", coords, edges)
+
+
+def load_geojson_network(path="data/map.geojson"):
+    """Benchmark network from the LineStrings of a GeoJSON file."""
+    with open(path, "r", encoding="utf-8") as f:
+        geojson_data = json.load(f)
+
+    node_ids = {}
+    coords = {}
+    edges = []
+    for feature in geojson_data['features']:
+        if feature['geometry']['type'] != 'LineString':
+            continue
+        line = [tuple(coord[:2]) for coord in feature['geometry']['coordinates']]
+        for coord in line:
+            if coord not in node_ids:
+                node_ids[coord] = len(node_ids)
+                coords[node_ids[coord]] = coord
+        for i in range(len(line) - 1):
+            if line[i] != line[i + 1]:
+                edges.append((node_ids[line[i]], node_ids[line[i + 1]]))
+
+    return make_network("geojson", coords, edges)
+
+
+def generate_networks(sizes, seed=0, geojson_path=None):
+    """Generate every synthetic network for the requested sizes (plus GeoJSON if given)."""
+    networks = []
+    for size in sizes:
+        networks.append(grid_with_noise(SIZES[size], seed=seed))
+        networks.append(random_geometric(SIZES[size], seed=seed))
+    if geojson_path:
+        networks.append(load_geojson_network(geojson_path))
+    return networks
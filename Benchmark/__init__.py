@@ -0,0 +1,12 @@
+"""Routing benchmark suite.
+
+Run from the repository root:
+
+    python -m Benchmark.RunBenchmark run --sizes small,medium --out bench.json
+    python -m Benchmark.RunBenchmark compare baseline.json bench.json
+
+Load test the HTTP service (starts RouteApi on a copy of the GeoJSON file):
+
+    python -m Benchmark.LoadTest run --data data/map.geojson --rps 50 --duration 60 --out load.json
+    python -m Benchmark.LoadTest compare baseline-load.json load.json
+"""
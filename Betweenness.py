@@ -0,0 +1,247 @@
+import argparse
+import heapq
+import json
+import math
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+import Closures
+import SharedGraph
+
+# Pivots per pool task; the checkpoint is rewritten as each batch finishes
+BATCH_SIZE = 16
+CHECKPOINT_FILE = "checkpoint.npz"
+
+# Graph adjacency of this worker process as Python lists, keyed by (directory, metric); one at a time
+_worker_adjacency = {}
+
+
+def result_dir(graph_dir, metric):
+    """Where the betweenness of one metric of a published generation lives."""
+    return os.path.join(graph_dir, f"betweenness_{metric}")
+
+
+def adjacency(graph, metric):
+    """(indptr, targets, edge sources, weights) as Python lists, the fastest form for a pure-Python search."""
+    return (np.asarray(graph.indptr).tolist(), np.asarray(graph.targets).tolist(),
+            graph.edge_sources().tolist(), np.asarray(graph.weights(metric)).tolist())
+
+
+def brandes(lists, pivots):
+    """Summed Brandes dependencies of the shortest-path trees grown from `pivots`.
+
+    `lists` comes from adjacency(). Every shortest path from a pivot (ties
+    included, split by their path counts) credits each edge and inner node
+    it runs through. Returns (node, edge) score arrays.
+    """
+    indptr, targets, sources, weights = lists
+    node_score = np.zeros(len(indptr) - 1)
+    edge_score = np.zeros(len(targets))
+    for source in pivots:
+        dist = {source: 0.0}
+        paths = {source: 1.0}
+        via = {source: []}  # node -> the edges reaching it on a shortest path
+        order = []
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            order.append(u)
+            for e in range(indptr[u], indptr[u + 1]):
+                v, nd = targets[e], d + weights[e]
+                known = dist.get(v, math.inf)
+                if nd < known:
+                    dist[v], paths[v], via[v] = nd, paths[u], [e]
+                    heapq.heappush(heap, (nd, v))
+                elif nd == known and v != source:
+                    paths[v] += paths[u]
+                    via[v].append(e)
+
+        # Farthest first, so a node's dependency is complete before it is passed on
+        delta = dict.fromkeys(order, 0.0)
+        for w in reversed(order):
+            share = (1.0 + delta[w]) / paths[w]
+            for e in via[w]:
+                v = sources[e]
+                credit = paths[v] * share
+                edge_score[e] += credit
+                delta[v] += credit
+            if w != source:
+                node_score[w] += delta[w]
+    return node_score, edge_score
+
+
+def batch_task(graph_dir, metric, pivots):
+    """Pool entry point: attach the graph at `graph_dir` (memory-mapped, cached) and score a pivot batch."""
+    key = (graph_dir, metric)
+    lists = _worker_adjacency.get(key)
+    if lists is None:
+        # A new generation replaces the old one instead of piling up
+        _worker_adjacency.clear()
+        lists = _worker_adjacency[key] = adjacency(SharedGraph.load_generation(graph_dir), metric)
+    return brandes(lists, pivots)
+
+
+def make_pool(workers):
+    """Process pool for run(); spawned like BatchRouting's so it is safe from threaded callers."""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def pick_pivots(num_nodes, pivots, seed):
+    """`pivots` distinct source nodes drawn with `seed` (every node when pivots >= num_nodes)."""
+    if pivots >= num_nodes:
+        return np.arange(num_nodes)
+    return np.sort(np.random.default_rng(seed).choice(num_nodes, size=pivots, replace=False))
+
+
+def _save_npz(path, **arrays):
+    handle, staging = tempfile.mkstemp(prefix="staging-", suffix=".npz", dir=os.path.dirname(path))
+    with os.fdopen(handle, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(staging, path)
+
+
+def _load_checkpoint(path, settings):
+    """(done mask, node, edge) sums of a checkpoint written with the same settings, or None."""
+    try:
+        with np.load(path) as saved:
+            if json.loads(str(saved["settings"])) != settings:
+                return None
+            return saved["done"].copy(), saved["node"].copy(), saved["edge"].copy()
+    except FileNotFoundError:
+        return None
+
+
+def run(graph, graph_dir, metric="distance", pivots=256, seed=1, workers=1, batch_size=BATCH_SIZE, progress=None):
+    """Sampled node and edge betweenness of a published graph, saved next to its generation.
+
+    Brandes' algorithm from `pivots` random source nodes, scaled by
+    num_nodes / pivots to estimate the betweenness over every source. Pivot
+    batches run in a process pool (with workers > 1) that memory-maps the
+    generation's arrays. A checkpoint of the finished batches is kept in the
+    result directory, so an interrupted run with the same settings resumes
+    where it stopped. Returns (node, edge) score arrays.
+    """
+    out = result_dir(graph_dir, metric)
+    os.makedirs(out, exist_ok=True)
+    chosen = pick_pivots(graph.num_nodes, pivots, seed)
+    batches = [chosen[i:i + batch_size].tolist() for i in range(0, len(chosen), batch_size)]
+    settings = {"generation": graph.meta.get("generation"), "metric": metric, "pivots": len(chosen), "seed": seed,
+                "batch_size": batch_size}
+    checkpoint = os.path.join(out, CHECKPOINT_FILE)
+
+    resumed = _load_checkpoint(checkpoint, settings)
+    if resumed is None:
+        done, node_score, edge_score = np.zeros(len(batches), dtype=bool), np.zeros(graph.num_nodes), \
+            np.zeros(graph.num_edges)
+    else:
+        done, node_score, edge_score = resumed
+    todo = np.flatnonzero(~done).tolist()
+
+    def finish(index, result):
+        node_score[:] += result[0]
+        edge_score[:] += result[1]
+        done[index] = True
+        _save_npz(checkpoint, settings=json.dumps(settings), done=done, node=node_score, edge=edge_score)
+        if progress is not None:
+            progress(int(done.sum()), len(batches))
+
+    if workers > 1:
+        with make_pool(workers) as pool:
+            running = {pool.submit(batch_task, graph_dir, metric, batches[i]): i for i in todo}
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    finish(running.pop(future), future.result())
+    else:
+        lists = adjacency(graph, metric) if todo else None
+        for i in todo:
+            finish(i, brandes(lists, batches[i]))
+
+    scale = graph.num_nodes / max(len(chosen), 1)
+    node_score, edge_score = node_score * scale, edge_score * scale
+    np.save(os.path.join(out, "node_betweenness.npy"), node_score)
+    np.save(os.path.join(out, "edge_betweenness.npy"), edge_score)
+    with open(os.path.join(out, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({**settings, "scale": scale, "created": time.time()}, f)
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return node_score, edge_score
+
+
+def load(graph_dir, metric="distance"):
+    """Saved (node, edge) betweenness of a generation, memory-mapped; None when not computed."""
+    out = result_dir(graph_dir, metric)
+    if not os.path.isfile(os.path.join(out, "meta.json")):
+        return None
+    return (np.load(os.path.join(out, "node_betweenness.npy"), mmap_mode="r"),
+            np.load(os.path.join(out, "edge_betweenness.npy"), mmap_mode="r"))
+
+
+def importance(edge_score):
+    """Edge betweenness mapped to 0..1 on a log scale (heavy-tailed scores make a linear scale all 0)."""
+    logs = np.log1p(np.asarray(edge_score, dtype=np.float64))
+    top = logs.max() if len(logs) else 0.0
+    return logs / top if top > 0 else logs
+
+
+def export_geojson(graph, edge_score, path):
+    """Write every edge as a LineString feature with its betweenness and importance, for map tiles."""
+    level = importance(edge_score)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"type": "FeatureCollection", "features": [\n')
+        for edge in range(graph.num_edges):
+            feature = {"type": "Feature",
+                       "properties": {"edge": edge, "way": int(graph.edge_way[edge]),
+                                      "betweenness": float(edge_score[edge]), "importance": float(level[edge])},
+                       "geometry": {"type": "LineString", "coordinates": Closures.edge_path(graph, edge)}}
+            f.write(("" if edge == 0 else ",\n") + json.dumps(feature))
+        f.write("\n]}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sampled road betweenness of the published graph.")
+    parser.add_argument("--store", default=os.environ.get("ROUTE_GRAPH_STORE", SharedGraph.DEFAULT_ROOT))
+    parser.add_argument("--metric", default="distance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="score the current generation (resumes an interrupted run)")
+    run_parser.add_argument("--pivots", type=int, default=256, help="sampled source nodes")
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    run_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    export_parser = sub.add_parser("export", help="write the saved edge scores as GeoJSON")
+    export_parser.add_argument("--out", default="betweenness.geojson")
+    args = parser.parse_args()
+
+    store = SharedGraph.GraphStore(args.store)
+    generation = store.current_generation()
+    if generation is None:
+        raise SystemExit(f"No graph published in {args.store}; run SharedGraph.py publish first.")
+    graph = store.attach(generation)
+    graph_dir = store.generation_dir(generation)
+
+    if args.command == "run":
+        start = time.perf_counter()
+
+        def report(done, total):
+            print(f"\r{done}/{total} batches, {time.perf_counter() - start:.0f}s", end="", file=sys.stderr)
+
+        node_score, edge_score = run(graph, graph_dir, args.metric, args.pivots, args.seed, args.workers,
+                                     args.batch_size, report)
+        print(file=sys.stderr)
+        top = np.argsort(-edge_score)[:10]
+        print(f"Scored {graph.num_edges} edges from {min(args.pivots, graph.num_nodes)} pivots in "
+              f"{time.perf_counter() - start:.1f}s; busiest edges: {', '.join(str(e) for e in top.tolist())}")
+    else:
+        saved = load(graph_dir, args.metric)
+        if saved is None:
+            raise SystemExit(f"No betweenness for metric {args.metric!r}; run the run command first.")
+        export_geojson(graph, saved[1], args.out)
+        print(f"Wrote {graph.num_edges} edges to {args.out}")
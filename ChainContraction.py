@@ -0,0 +1,129 @@
+import numpy as np
+
+import RoutingGraph
+
+# Per-edge arrays carried over to contracted edges (weight_* arrays are summed instead)
+EDGE_ARRAYS = ("edge_way", "edge_profile")
+# Arrays that do not depend on nodes or edges and are copied as they are
+SHARED_ARRAYS = ("td_profiles",)
+
+
+def removable_nodes(graph):
+    """Mask of the nodes in the middle of a degree-2 chain.
+
+    A node is removable when it only continues one road: one edge in and one
+    edge out (a one-way road), or edges to and from the same two neighbours
+    (a two-way road). All its edges must come from the same GeoJSON feature,
+    so oneway, speeds and every other attribute are unchanged across it.
+    """
+    n = graph.num_nodes
+    sources = graph.edge_sources().astype(np.int64)
+    targets = np.asarray(graph.targets, dtype=np.int64)
+    way = np.asarray(graph.edge_way, dtype=np.int64)
+
+    def extremes(nodes, values):
+        low, high = np.full(n, np.iinfo(np.int64).max), np.full(n, -1)
+        np.minimum.at(low, nodes, values)
+        np.maximum.at(high, nodes, values)
+        return low, high
+
+    out_degree, in_degree = np.bincount(sources, minlength=n), np.bincount(targets, minlength=n)
+    out_low, out_high = extremes(sources, targets)
+    in_low, in_high = extremes(targets, sources)
+    way_low, way_high = extremes(np.concatenate([sources, targets]), np.concatenate([way, way]))
+
+    one_way = (out_degree == 1) & (in_degree == 1) & (out_low != in_low)
+    two_way = ((out_degree == 2) & (in_degree == 2) & (out_low != out_high)
+               & (in_low == out_low) & (in_high == out_high))
+    return (one_way | two_way) & (way_low == way_high)
+
+
+def _ranges(starts, counts):
+    """Concatenated aranges starts[i]:starts[i] + counts[i]."""
+    starts, counts = np.asarray(starts, dtype=np.int64), np.asarray(counts, dtype=np.int64)
+    return np.arange(int(counts.sum()), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+
+
+def _chains(graph, keep, following):
+    """Edge chains starting at kept nodes; returns (chain_ptr, chain_edges) in CSR form."""
+    following = following.tolist()
+    edges, ptr = [], [0]
+    for edge in np.flatnonzero(keep[graph.edge_sources()]).tolist():
+        while edge >= 0:
+            edges.append(edge)
+            edge = following[edge]
+        ptr.append(len(edges))
+    return np.array(ptr, dtype=np.int64), np.array(edges, dtype=np.int64)
+
+
+def contract(graph):
+    """Collapse every degree-2 chain into one edge; returns a new RoutingGraph over the junctions.
+
+    Weights are summed along each chain and the removed nodes' coordinates
+    are kept per edge in `geom_ptr`/`geom_coords`, so routes can still be
+    drawn in full. EDGE_ARRAYS take the value of a chain's first edge, which
+    is the same for the whole chain. Indexes, turn tables and overlays are
+    not carried over: build them on the contracted graph.
+    """
+    indptr = np.asarray(graph.indptr)
+    sources, targets = graph.edge_sources().astype(np.int64), np.asarray(graph.targets, dtype=np.int64)
+    keep = ~removable_nodes(graph)
+
+    while True:
+        # Next edge of the chain after every edge ending at a removable node; a
+        # two-way road continues with the out edge that does not turn back
+        following = np.full(graph.num_edges, -1, dtype=np.int64)
+        ending = np.flatnonzero(~keep[targets])
+        first_out = indptr[targets[ending]]
+        following[ending] = np.where(targets[first_out] == sources[ending], first_out + 1, first_out)
+        chain_ptr, chain_edges = _chains(graph, keep, following)
+
+        # A chain that returns to its own start would be a self-loop: keep its middle node too
+        lengths = np.diff(chain_ptr)
+        loops = np.flatnonzero(sources[chain_edges[chain_ptr[:-1]]] == targets[chain_edges[chain_ptr[1:] - 1]])
+        split = targets[chain_edges[chain_ptr[loops] + lengths[loops] // 2 - 1]].tolist()
+        # Closed rings without any junction are never reached: keep one node of each
+        covered = np.zeros(graph.num_edges, dtype=bool)
+        covered[chain_edges] = True
+        for edge in np.flatnonzero(~covered).tolist():
+            if not covered[edge]:
+                split.append(int(sources[edge]))
+                while not covered[edge]:
+                    covered[edge] = True
+                    edge = int(following[edge])
+        if not split:
+            break
+        keep[split] = True
+
+    first, last = chain_edges[chain_ptr[:-1]], chain_edges[chain_ptr[1:] - 1]
+    node_id = np.cumsum(keep) - 1
+    new_sources = node_id[sources[first]]
+    order = np.argsort(new_sources, kind="stable")
+    lengths = np.diff(chain_ptr)[order]
+    chain_edges = chain_edges[_ranges(chain_ptr[:-1][order], lengths)]
+    chain_ptr = np.concatenate([[0], np.cumsum(lengths)])
+    first, last = first[order], last[order]
+
+    coords = np.asarray(graph.coords)
+    inner = np.ones(len(chain_edges), dtype=bool)
+    inner[chain_ptr[1:] - 1] = False
+    arrays = {
+        "coords": np.ascontiguousarray(coords[keep]),
+        "indptr": np.concatenate([[0], np.cumsum(np.bincount(new_sources, minlength=int(keep.sum())))]),
+        "targets": node_id[targets[last]].astype(np.int32),
+        # The nodes passed inside each chain, in travel order
+        "geom_ptr": (chain_ptr - np.arange(len(chain_ptr))).astype(np.int64),
+        "geom_coords": np.ascontiguousarray(coords[targets[chain_edges[inner]]]),
+    }
+    for name in EDGE_ARRAYS:
+        if name in graph.arrays:
+            arrays[name] = np.asarray(graph.arrays[name])[first]
+    for name in SHARED_ARRAYS:
+        if name in graph.arrays:
+            arrays[name] = graph.arrays[name]
+    for metric in graph.meta["metrics"]:
+        weights = np.asarray(graph.weights(metric))[chain_edges]
+        arrays[f"weight_{metric}"] = np.add.reduceat(weights, chain_ptr[:-1]) if len(weights) else weights
+
+    meta = {**graph.meta, "chains": {"nodes_before": graph.num_nodes, "edges_before": graph.num_edges}}
+    return RoutingGraph.RoutingGraph(arrays, meta)
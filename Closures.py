@@ -0,0 +1,287 @@
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import EdgeSnapping
+import SpatialIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock (run a single worker)
+    fcntl = None
+
+# Closures live next to the graph generations, so every worker process sees the same set
+CLOSURES_FILE = "closures.json"
+# A closure path is sampled every SAMPLE_M meters, except within MATCH_RADIUS_M of its ends where
+# the next road begins; edges within MATCH_RADIUS_M of a sample that run along the path (within
+# ALIGN_DEGREES) are closed
+SAMPLE_M = 10.0
+MATCH_RADIUS_M = 8.0
+ALIGN_DEGREES = 30.0
+# Closest points this close to an edge's end count as its end (fractions run 0..1)
+END_FRACTION = 1e-6
+
+
+def edge_path(graph, edge):
+    """[[lon, lat], ...] of an edge from its source through its bends to its target."""
+    coords = graph.coords
+    start, end = coords[int(graph.edge_sources()[edge])], coords[int(graph.targets[edge])]
+    return [[float(start[0]), float(start[1])]] + graph.edge_geometry(edge).tolist() + \
+        [[float(end[0]), float(end[1])]]
+
+
+def graph_key(graph):
+    """[region, generation] of a graph, which edge ids given by a client refer to."""
+    return [graph.meta.get("region"), graph.meta.get("generation")]
+
+
+def with_twins(graph, edges, directed=True):
+    """Sorted unique ids of `edges`, plus the reverse of each (EdgeSnapping.find_twin) unless directed."""
+    found = set(int(edge) for edge in edges)
+    if not directed:
+        found |= {EdgeSnapping.find_twin(graph, edge) for edge in found} - {-1}
+    return np.array(sorted(found), dtype=np.int64)
+
+
+def _distance_to_path(xs, ys, x, y):
+    """Meters from the projected point (x, y) to the polyline through xs, ys."""
+    dx, dy = np.diff(xs), np.diff(ys)
+    length2 = dx * dx + dy * dy
+    t = np.clip(((x - xs[:-1]) * dx + (y - ys[:-1]) * dy) / np.where(length2 > 0, length2, 1.0), 0.0, 1.0)
+    return float(np.min(np.hypot(xs[:-1] + t * dx - x, ys[:-1] + t * dy - y)))
+
+
+def resolve(graph, paths, directed=True):
+    """Sorted edge ids running along any of the [[lon, lat], ...] paths.
+
+    Directed paths only close edges travelling the same way; otherwise both
+    directions of a road are closed. Crossing roads are left open since they
+    do not run along the path, and so are the roads continuing past either
+    end: an edge only counts where a sample's closest point is inside it, or
+    when all of it lies within MATCH_RADIUS_M of the path.
+    """
+    index = SpatialIndex.SegmentIndex.for_graph(graph)
+    align = math.cos(math.radians(ALIGN_DEGREES))
+    found = set()
+    for path in paths:
+        xs, ys = index.projection.project(*np.asarray(path, dtype=float)[:, :2].T)
+        along = np.concatenate([[0.0], np.cumsum(np.hypot(np.diff(xs), np.diff(ys)))])
+        total = float(along[-1])
+        if total == 0:
+            continue
+        samples = max(1, math.ceil(total / SAMPLE_M))
+        positions = (np.arange(samples) + 0.5) * total / samples
+        positions = positions[(positions >= MATCH_RADIUS_M) & (positions <= total - MATCH_RADIUS_M)]
+        if len(positions) == 0:
+            # Shorter than the two end margins: the middle only
+            positions = np.array([total / 2])
+        segments = np.clip(np.searchsorted(along, positions, side="right") - 1, 0, len(xs) - 2)
+
+        at_end = set()
+        for position, segment in zip(positions.tolist(), segments.tolist()):
+            length = along[segment + 1] - along[segment]
+            if length == 0:
+                continue
+            ux, uy = (xs[segment + 1] - xs[segment]) / length, (ys[segment + 1] - ys[segment]) / length
+            t = (position - along[segment]) / length
+            lon, lat = index.projection.unproject(xs[segment] + t * (xs[segment + 1] - xs[segment]),
+                                                  ys[segment] + t * (ys[segment + 1] - ys[segment]))
+            edges, _, fractions = index.query(float(lon), float(lat), MATCH_RADIUS_M)
+            for edge, fraction in zip(edges.tolist(), fractions.tolist()):
+                dx, dy = index.direction_at(edge, fraction)
+                cos = dx * ux + dy * uy
+                if cos >= align or (not directed and cos <= -align):
+                    if END_FRACTION < fraction < 1 - END_FRACTION:
+                        found.add(edge)
+                    else:
+                        at_end.add(edge)
+
+        # Closest at an end: an edge shorter than the sample spacing, or the road continuing past the path
+        for edge in at_end - found:
+            ex, ey = index.projection.project(*np.asarray(edge_path(graph, edge)).T)
+            # Its points and the middles of its pieces, so a chord between two path nodes does not count
+            points = zip(np.concatenate([ex, (ex[:-1] + ex[1:]) / 2]), np.concatenate([ey, (ey[:-1] + ey[1:]) / 2]))
+            if all(_distance_to_path(xs, ys, x, y) <= MATCH_RADIUS_M for x, y in points):
+                found.add(edge)
+    return np.array(sorted(found), dtype=np.int64)
+
+
+class Overlay:
+    """Cost factors of closed edges on top of a graph's weights; a factor of inf blocks the edge.
+
+    Only the closed edges are stored. The effective weight array of a metric
+    is made once per overlay on first use, so searches read it exactly like
+    the plain weights.
+    """
+
+    def __init__(self, edges, factors, version=None):
+        self.edges = np.asarray(edges, dtype=np.int64)
+        self.factors = np.asarray(factors, dtype=np.float64)
+        self.version = version
+        self._weights = {}
+        self._open = None
+
+    def __bool__(self):
+        return len(self.edges) > 0
+
+    def __reduce__(self):
+        # Sent to batch workers without the derived weight arrays
+        return Overlay, (self.edges, self.factors, self.version)
+
+    def weights(self, graph, metric):
+        if metric not in self._weights:
+            weights = np.array(graph.arrays[f"weight_{metric}"])
+            weights[self.edges] = weights[self.edges] * self.factors
+            self._weights[metric] = weights
+        return self._weights[metric]
+
+    def open_edges(self, num_edges):
+        """Boolean mask over edges, False where an edge is blocked."""
+        if self._open is None:
+            self._open = np.ones(num_edges, dtype=bool)
+            self._open[self.edges[np.isinf(self.factors)]] = False
+        return self._open
+
+    def is_blocked(self, edge):
+        found = int(np.searchsorted(self.edges, edge))
+        return found < len(self.edges) and self.edges[found] == edge and math.isinf(self.factors[found])
+
+
+class ClosureStore:
+    """Closures saved in `<root>/closures.json`, re-read whenever the file changes.
+
+    A closure has an id, the paths it covers, whether it is directed, a cost
+    factor (None blocks the roads) and an optional expiry (epoch seconds);
+    expired closures stop applying at once and are dropped at the next write.
+    Closures given by edge id also keep the ids and the graph_key they refer to.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, CLOSURES_FILE)
+        os.makedirs(root, exist_ok=True)
+        self._stamp = None
+        self._state = {"next_id": 1, "closures": []}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _write_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.root, "closures.lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read(self):
+        """{"next_id": ..., "closures": [...]} as last written; a stat per call, a parse per change."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return {"next_id": 1, "closures": []}
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if stamp != self._stamp:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._state = json.load(f)
+                self._stamp = stamp
+            return self._state
+
+    def _write(self, next_id, closures):
+        handle, staging = tempfile.mkstemp(prefix="closures-", dir=self.root)
+        with os.fdopen(handle, "w", encoding="utf-8") as f:
+            json.dump({"next_id": next_id, "closures": closures}, f)
+        os.replace(staging, self.path)
+
+    def closures(self, now=None):
+        """Closures in force at `now` (default: the current time)."""
+        now = time.time() if now is None else now
+        return [c for c in self._read()["closures"] if c["expires"] is None or c["expires"] > now]
+
+    def add(self, paths, directed=True, factor=None, expires=None, reason="", edges=None, key=None):
+        """Store a closure and return it; factor None blocks the roads, a factor > 1 slows them.
+
+        `edges` are the ids the paths were taken from, on the graph with graph_key `key`.
+        """
+        if factor is not None and not factor >= 1:
+            raise ValueError("A closure factor must be at least 1 (or omitted to block the road).")
+        if not paths or any(len(path) < 2 for path in paths):
+            raise ValueError("Every closure path needs at least two points.")
+        with self._write_lock():
+            now = time.time()
+            state = self._read()
+            closure = {
+                "id": state["next_id"],
+                "paths": [[[float(lon), float(lat)] for lon, lat, *_ in path] for path in paths],
+                "directed": bool(directed),
+                "factor": None if factor is None else float(factor),
+                "expires": None if expires is None else float(expires),
+                "reason": reason,
+                "created": now,
+                "edges": None if edges is None else sorted(int(edge) for edge in edges),
+                "graph": key,
+            }
+            self._write(state["next_id"] + 1, self.closures(now) + [closure])
+        return closure
+
+    def remove(self, closure_id):
+        """Drop a closure; False when there is no such closure."""
+        with self._write_lock():
+            state = self._read()
+            kept = [c for c in state["closures"] if c["id"] != closure_id]
+            if len(kept) == len(state["closures"]):
+                return False
+            self._write(state["next_id"], kept)
+        return True
+
+    def edges(self, graph, closure):
+        """Edge ids of the graph a closure covers, matched once per graph.
+
+        Ids given by the client are exact on the graph they were given for;
+        other generations number edges differently, so there the paths are matched.
+        """
+        resolved = graph._cache.setdefault("closure_edges", {})
+        if closure["id"] not in resolved:
+            if closure.get("edges") is not None and closure.get("graph") == graph_key(graph):
+                resolved[closure["id"]] = with_twins(graph, closure["edges"], closure["directed"])
+            else:
+                resolved[closure["id"]] = resolve(graph, closure["paths"], closure["directed"])
+        return resolved[closure["id"]]
+
+    def overlay(self, graph, now=None):
+        """Overlay of the closures in force for this graph, or None when there are none.
+
+        Each closure is matched to the graph's edges once per graph, so adding
+        or removing one only resolves that closure; the overlay itself is
+        rebuilt from the cached edge lists.
+        """
+        active = self.closures(now)
+        if not active:
+            return None
+        key = tuple(c["id"] for c in active)
+        cached = graph._cache.get("closure_overlay")
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        resolved = graph._cache.setdefault("closure_edges", {})
+        for gone in set(resolved) - set(key):
+            del resolved[gone]
+        factors = {}
+        for closure in active:
+            factor = math.inf if closure["factor"] is None else closure["factor"]
+            for edge in self.edges(graph, closure).tolist():
+                # Overlapping closures: the strongest applies
+                factors[edge] = max(factors.get(edge, 1.0), factor)
+        edges = sorted(factors)
+        overlay = Overlay(edges, [factors[e] for e in edges], version=key)
+        graph._cache["closure_overlay"] = (key, overlay)
+        return overlay
@@ -0,0 +1,88 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+def _topological_order(count, tails, heads):
+    """Kahn's algorithm over `count` vertices and the edges tails[i] -> heads[i] (a DAG)."""
+    order = np.argsort(tails, kind="stable")
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(tails, minlength=count))]).tolist()
+    heads = heads[order].tolist()
+    indegree = np.bincount(np.asarray(heads, dtype=np.int64), minlength=count).tolist()
+    ready = [v for v in range(count) if indegree[v] == 0]
+    result = []
+    while ready:
+        u = ready.pop()
+        result.append(u)
+        for v in heads[indptr[u]:indptr[u + 1]]:
+            indegree[v] -= 1
+            if indegree[v] == 0:
+                ready.append(v)
+    return np.array(result, dtype=np.int64)
+
+
+def component_labels(graph):
+    """Strongly and weakly connected component labels of every node, as int32 arrays.
+
+    Strong components are numbered in topological order of the graph they
+    form, so no edge leads from a higher label to a lower one. Returns
+    (strong, weak, meta) where meta has the counts and the largest of each.
+    """
+    n = graph.num_nodes
+    matrix = csr_matrix((np.ones(graph.num_edges, dtype=np.int8), np.asarray(graph.targets), np.asarray(graph.indptr)),
+                        shape=(n, n))
+    weak_count, weak = connected_components(matrix, directed=True, connection="weak")
+    strong_count, strong = connected_components(matrix, directed=True, connection="strong")
+
+    tails, heads = strong[graph.edge_sources()], strong[np.asarray(graph.targets)]
+    between = np.unique(np.stack([tails, heads])[:, tails != heads], axis=1)
+    rank = np.empty(strong_count, dtype=np.int64)
+    rank[_topological_order(strong_count, between[0], between[1])] = np.arange(strong_count)
+    strong = rank[strong]
+
+    meta = {"strong": int(strong_count), "weak": int(weak_count),
+            "largest_strong": int(np.argmax(np.bincount(strong))) if n else -1,
+            "largest_weak": int(np.argmax(np.bincount(weak))) if n else -1}
+    return strong.astype(np.int32), weak.astype(np.int32), meta
+
+
+def add_component_labels(graph):
+    """Store the labels in the graph (and so in its snapshot)."""
+    strong, weak, meta = component_labels(graph)
+    graph.arrays["scc_label"] = strong
+    graph.arrays["wcc_label"] = weak
+    graph.meta["components"] = meta
+
+
+def labels(graph):
+    """(strong, weak, meta) from the snapshot, or computed once per process for older snapshots."""
+    if "scc_label" in graph.arrays:
+        return graph.arrays["scc_label"], graph.arrays["wcc_label"], graph.meta["components"]
+    if "components" not in graph._cache:
+        graph._cache["components"] = component_labels(graph)
+    return graph._cache["components"]
+
+
+def may_reach(graph, source, target):
+    """False when no path from source to target can exist; O(1).
+
+    True is not a guarantee: two strong components of one weak component
+    may still be unconnected in the direction asked.
+    """
+    strong, weak, _ = labels(graph)
+    return bool(weak[source] == weak[target] and strong[source] <= strong[target])
+
+
+def may_reach_any(graph, sources, targets):
+    """Whether any source may reach any target (see may_reach)."""
+    return any(may_reach(graph, source, target) for source in sources for target in targets)
+
+
+def largest_component_edges(graph):
+    """Mask of the edges inside the largest strong component, cached per process."""
+    if "largest_component_edges" not in graph._cache:
+        strong, _, meta = labels(graph)
+        largest = meta["largest_strong"]
+        graph._cache["largest_component_edges"] = ((strong[graph.edge_sources()] == largest)
+                                                   & (strong[np.asarray(graph.targets)] == largest))
+    return graph._cache["largest_component_edges"]
@@ -0,0 +1,219 @@
+import asyncio
+import contextlib
+import contextvars
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import Metrics
+
+# Checking the clock on every settled node would cost more than the check is worth
+DEADLINE_CHECK_EVERY = 1024
+# Service-time smoothing for the Retry-After estimate
+SERVICE_TIME_ALPHA = 0.2
+
+POOL_REJECTED = Metrics.REGISTRY.counter(
+    "routeapi_compute_rejected_total", "Jobs turned away because the compute pool was full.", ("pool",))
+POOL_ABORTED = Metrics.REGISTRY.counter(
+    "routeapi_compute_aborted_total", "Jobs ended by their deadline or search budget.", ("pool", "reason"))
+POOL_ADMITTED = Metrics.REGISTRY.gauge(
+    "routeapi_compute_admitted", "Jobs running or waiting in the compute pool.", ("pool",))
+POOL_WAIT = Metrics.REGISTRY.histogram(
+    "routeapi_compute_queue_wait_seconds", "Time jobs waited for a compute thread.", ("pool",))
+
+
+class Saturated(Exception):
+    """The pool already holds as many jobs as it may; retry after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time before its computation finished."""
+
+
+class BudgetExceeded(Exception):
+    """A search settled more nodes than the request's budget allows."""
+
+
+class SearchBudget:
+    """Nodes settled and wall-clock time a request may spend; searches call `settle` per settled node."""
+
+    def __init__(self, max_settled=None, deadline=None):
+        self.max_settled = max_settled or math.inf
+        self.deadline = deadline  # time.monotonic() value, or None
+        self.settled = 0
+        self._next_check = DEADLINE_CHECK_EVERY
+
+    def check_deadline(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise DeadlineExceeded("The request deadline passed before the route was found.")
+
+    def settle(self, count=1):
+        self.settled += count
+        if self.settled > self.max_settled:
+            raise BudgetExceeded(f"The search gave up after settling {self.max_settled} nodes.")
+        if self.settled >= self._next_check:
+            self._next_check = self.settled + DEADLINE_CHECK_EVERY
+            self.check_deadline()
+
+    def remaining(self):
+        """(nodes, seconds) left, or None for no limit; monotonic deadlines do not carry over to other processes."""
+        nodes = None if self.max_settled == math.inf else self.max_settled - self.settled
+        seconds = None if self.deadline is None else self.deadline - time.monotonic()
+        return nodes, seconds
+
+
+# Budget of the computation running in the current thread (set by ComputePool for each job)
+UNLIMITED = SearchBudget()
+_budget = contextvars.ContextVar("search_budget", default=UNLIMITED)
+
+
+def budget():
+    """The current job's SearchBudget; unlimited outside a ComputePool job."""
+    return _budget.get()
+
+
+@contextlib.contextmanager
+def limited(max_settled=None, seconds=None):
+    """Charge searches in this thread to a new budget, e.g. in a worker process given SearchBudget.remaining()."""
+    # SearchBudget treats 0 as no limit
+    max_settled = max(max_settled, 1) if max_settled is not None else None
+    job_budget = SearchBudget(max_settled, time.monotonic() + seconds if seconds is not None else None)
+    token = _budget.set(job_budget)
+    try:
+        yield job_budget
+    finally:
+        _budget.reset(token)
+
+
+class Job:
+    """A pool slot held by a long job that runs in steps, such as a streamed batch (see ComputePool.admit)."""
+
+    def __init__(self, pool, job_budget):
+        self.pool = pool
+        self.budget = job_budget
+        self.closed = False
+
+    async def step(self, fn, *args):
+        """Await fn(*args) on a pool thread, charging its searches to the job's budget."""
+        self.budget.check_deadline()
+        context = contextvars.copy_context()
+        context.run(_budget.set, self.budget)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.pool.executor, context.run, fn, *args)
+        except (DeadlineExceeded, BudgetExceeded) as e:
+            reason = "deadline" if isinstance(e, DeadlineExceeded) else "budget"
+            POOL_ABORTED.inc(pool=self.pool.name, reason=reason)
+            raise
+
+    def close(self):
+        """Give the slot back; safe to call more than once."""
+        if not self.closed:
+            self.closed = True
+            self.pool._release(None)
+
+
+class ComputePool:
+    """Bounded thread pool for CPU-bound request work, with admission control.
+
+    At most `workers` jobs run and `queue_depth` more wait; beyond that `run`
+    raises Saturated at once instead of queueing without limit. Every job gets
+    a SearchBudget built from its deadline and max_settled, which the routing
+    searches charge as they settle nodes, so a runaway search ends itself
+    rather than holding a thread after its caller has given up.
+    """
+
+    def __init__(self, name, workers, queue_depth, deadline_s=None, max_settled=None):
+        self.name = name
+        self.workers = workers
+        self.capacity = workers + queue_depth
+        self.deadline_s = deadline_s
+        self.max_settled = max_settled
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"compute-{name}")
+        self.admitted = 0
+        self.service_time = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name, prefix="ROUTE_COMPUTE"):
+        """Pool configured by <prefix>_WORKERS, _QUEUE, _DEADLINE_S and _MAX_SETTLED (0 disables the last two)."""
+        workers = int(os.environ.get(f"{prefix}_WORKERS", str(os.cpu_count() or 1)))
+        queue_depth = int(os.environ.get(f"{prefix}_QUEUE", str(16 * workers)))
+        deadline_s = float(os.environ.get(f"{prefix}_DEADLINE_S", "30"))
+        max_settled = int(os.environ.get(f"{prefix}_MAX_SETTLED", "5000000"))
+        return cls(name, workers, queue_depth, deadline_s or None, max_settled or None)
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up, from the smoothed service time."""
+        return max(1, math.ceil(self.service_time * self.admitted / self.workers))
+
+    def _admit(self):
+        with self._lock:
+            if self.admitted >= self.capacity:
+                POOL_REJECTED.inc(pool=self.name)
+                raise Saturated(f"The {self.name} pool is full ({self.capacity} jobs).", self.retry_after())
+            self.admitted += 1
+            POOL_ADMITTED.set(self.admitted, pool=self.name)
+
+    def _release(self, elapsed):
+        with self._lock:
+            self.admitted -= 1
+            # Long jobs (elapsed None) would skew the Retry-After estimate for ordinary requests
+            if elapsed is not None:
+                self.service_time += SERVICE_TIME_ALPHA * (elapsed - self.service_time)
+            POOL_ADMITTED.set(self.admitted, pool=self.name)
+
+    def _call(self, job_budget, queued, fn, args):
+        POOL_WAIT.observe(time.monotonic() - queued, pool=self.name)
+        start = time.monotonic()
+        try:
+            # Waited past the deadline in the queue: do not start at all
+            job_budget.check_deadline()
+            _budget.set(job_budget)
+            return fn(*args)
+        except (DeadlineExceeded, BudgetExceeded) as e:
+            reason = "deadline" if isinstance(e, DeadlineExceeded) else "budget"
+            POOL_ABORTED.inc(pool=self.name, reason=reason)
+            raise
+        finally:
+            self._release(time.monotonic() - start)
+
+    def admit(self, deadline_s=..., max_settled=...):
+        """Hold a slot for a Job whose steps all run under one budget; close() the job when done.
+
+        Limits default to the pool's as in `run`. Raises Saturated when the
+        pool is full. A job only holds a thread while one of its steps runs.
+        """
+        deadline_s = self.deadline_s if deadline_s is ... else deadline_s
+        max_settled = self.max_settled if max_settled is ... else max_settled
+        self._admit()
+        return Job(self, SearchBudget(max_settled, time.monotonic() + deadline_s if deadline_s else None))
+
+    async def run(self, fn, *args, deadline_s=..., max_settled=...):
+        """Await fn(*args) on a pool thread.
+
+        deadline_s and max_settled default to the pool's; pass None for no
+        limit (e.g. graph rebuilds). Raises Saturated when the pool is full,
+        DeadlineExceeded or BudgetExceeded when the job is cut short.
+        """
+        deadline_s = self.deadline_s if deadline_s is ... else deadline_s
+        max_settled = self.max_settled if max_settled is ... else max_settled
+        self._admit()
+        queued = time.monotonic()
+        job_budget = SearchBudget(max_settled, queued + deadline_s if deadline_s else None)
+        # A copied context keeps the request's Metrics spans and isolates the budget to this job
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, context.run, self._call, job_budget, queued, fn, args)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), deadline_s)
+        except asyncio.TimeoutError:
+            # The job notices the deadline at its next check and frees its thread
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+            raise DeadlineExceeded("The request deadline passed before the route was found.")
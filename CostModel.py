@@ -0,0 +1,187 @@
+import re
+
+import numpy as np
+
+# Mean Earth radius (IUGG) and the WGS84 ellipsoid
+EARTH_RADIUS_M = 6_371_008.8
+WGS84_A = 6_378_137.0
+WGS84_E2 = 6.69437999014e-3  # first eccentricity squared
+
+# Edge weight arrays every graph carries; pick one per query
+METRICS = ("distance", "time", "cost")
+
+# Free-flow speed defaults (km/h) when a road has no usable maxspeed tag
+HIGHWAY_SPEEDS_KMH = {
+    "motorway": 100, "motorway_link": 60,
+    "trunk": 80, "trunk_link": 50,
+    "primary": 60, "primary_link": 40,
+    "secondary": 50, "secondary_link": 35,
+    "tertiary": 40, "tertiary_link": 30,
+    "unclassified": 30, "residential": 30, "road": 30,
+    "living_street": 10, "service": 20, "track": 15,
+    "pedestrian": 5, "footway": 5, "path": 5, "steps": 3, "cycleway": 15,
+    "custom": 30,
+}
+DEFAULT_SPEED_KMH = 30.0
+
+# Time-of-day profiles: share of free-flow speed in 15-minute buckets, midnight first
+PROFILE_BUCKETS = 96
+BUCKET_SECONDS = 24 * 3600 // PROFILE_BUCKETS
+# Hourly defaults by road class (a feature's 'speed_profile' property, 24 or 96 factors, overrides them)
+HOURLY_SPEED_FACTORS = {
+    "arterial": [1.0, 1.0, 1.0, 1.0, 1.0, 0.95, 0.8, 0.55, 0.45, 0.6, 0.75, 0.75,
+                 0.7, 0.7, 0.75, 0.7, 0.6, 0.45, 0.5, 0.65, 0.8, 0.9, 0.95, 1.0],
+    "local": [1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.9, 0.75, 0.7, 0.8, 0.85, 0.85,
+              0.85, 0.85, 0.85, 0.8, 0.75, 0.7, 0.7, 0.8, 0.9, 0.95, 1.0, 1.0],
+}
+ARTERIAL_HIGHWAYS = {"motorway", "motorway_link", "trunk", "trunk_link", "primary", "primary_link",
+                     "secondary", "secondary_link"}
+# Never model a road as (almost) stopped, so travel times stay finite
+MIN_SPEED_FACTOR = 0.05
+
+_SPEED_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(mph|km/h|kmh|kph|knots)?\s*$")
+_UNIT_TO_KMH = {None: 1.0, "km/h": 1.0, "kmh": 1.0, "kph": 1.0, "mph": 1.609344, "knots": 1.852}
+
+
+def haversine_m(lon1, lat1, lon2, lat2):
+    """Great-circle distance in meters; all arguments are arrays of degrees."""
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def ellipsoidal_m(lon1, lat1, lon2, lat2):
+    """Distance in meters on the WGS84 ellipsoid for short segments.
+
+    Uses the meridional and prime-vertical radii of curvature at the mid
+    latitude, which is within a few millimetres of geopy's geodesic for
+    road segments (up to a few kilometres) at a fraction of the cost.
+    """
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lon1, lat1, lon2, lat2))
+    mid = (lat1 + lat2) / 2
+    w2 = 1 - WGS84_E2 * np.sin(mid) ** 2
+    meridional = WGS84_A * (1 - WGS84_E2) / w2 ** 1.5
+    prime_vertical = WGS84_A / np.sqrt(w2)
+    dy = (lat2 - lat1) * meridional
+    dlon = (lon2 - lon1 + np.pi) % (2 * np.pi) - np.pi
+    dx = dlon * prime_vertical * np.cos(mid)
+    return np.hypot(dx, dy)
+
+
+def parse_maxspeed(value):
+    """OSM maxspeed tag to km/h, or None when it is missing or not numeric ("signals", "none")."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value > 0 else None
+    speeds = []
+    for part in str(value).split(";"):
+        match = _SPEED_PATTERN.match(part.lower())
+        if match:
+            speeds.append(float(match.group(1)) * _UNIT_TO_KMH[match.group(2)])
+    speeds = [s for s in speeds if s > 0]
+    return min(speeds) if speeds else None
+
+
+def speed_kmh(properties):
+    """Travel speed of a road from its maxspeed tag, falling back to the highway default."""
+    speed = parse_maxspeed(properties.get("maxspeed"))
+    if speed is not None:
+        return speed
+    highway = properties.get("highway")
+    if isinstance(highway, list):
+        highway = highway[0] if highway else None
+    return float(HIGHWAY_SPEEDS_KMH.get(highway, DEFAULT_SPEED_KMH))
+
+
+def feature_lines(feature):
+    """Coordinate rings/lines of a feature that become graph edges."""
+    geometry = feature['geometry']
+    if geometry['type'] == 'LineString':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'Polygon':
+        # Exterior ring only, as in build_graph_from_geojson
+        return [geometry['coordinates'][0]]
+    return []
+
+
+def segment_arrays(features):
+    """Every consecutive coordinate pair of every line as arrays.
+
+    Returns (src, dst, owner): src/dst are (K, 2) lon/lat arrays and owner is
+    the index of the feature each segment came from.
+    """
+    lines = []
+    owners = []
+    for index, feature in enumerate(features):
+        for coords in feature_lines(feature):
+            if len(coords) >= 2:
+                lines.append(np.asarray(coords, dtype=np.float64)[:, :2])
+                owners.append(index)
+
+    if not lines:
+        empty = np.empty((0, 2), dtype=np.float64)
+        return empty, empty.copy(), np.empty(0, dtype=np.int64)
+
+    counts = np.array([len(line) for line in lines])
+    points = np.concatenate(lines)
+    # A segment starts at every point except the last point of each line
+    starts = np.ones(len(points), dtype=bool)
+    starts[np.cumsum(counts) - 1] = False
+    src_index = np.flatnonzero(starts)
+    owner = np.repeat(np.asarray(owners, dtype=np.int64), counts - 1)
+    return points[src_index], points[src_index + 1], owner
+
+
+def edge_weights(src, dst, speeds_kmh, legacy_cost=None):
+    """All weight arrays for segments src -> dst, computed in one pass.
+
+    `speeds_kmh` and `legacy_cost` are per-segment arrays; the result maps each
+    name in METRICS to an array: distance (m), time (s) and cost (the old
+    `properties['cost']`, 1 when absent).
+    """
+    distance = ellipsoidal_m(src[:, 0], src[:, 1], dst[:, 0], dst[:, 1])
+    speeds_ms = np.asarray(speeds_kmh, dtype=np.float64) / 3.6
+    cost = np.ones(len(distance)) if legacy_cost is None else np.asarray(legacy_cost, dtype=np.float64)
+    return {
+        "distance": distance,
+        "time": distance / speeds_ms,
+        "cost": cost,
+    }
+
+
+def geojson_edge_weights(features):
+    """Segments of a feature list with their weight arrays: (src, dst, owner, weights)."""
+    src, dst, owner = segment_arrays(features)
+    speeds = np.array([speed_kmh(f.get('properties') or {}) for f in features], dtype=np.float64)
+    legacy = np.array([(f.get('properties') or {}).get('cost', 1) for f in features], dtype=np.float64)
+    return src, dst, owner, edge_weights(src, dst, speeds[owner], legacy[owner])
+
+
+def speed_profile(properties):
+    """Speed factors of a road for every time bucket of the day (PROFILE_BUCKETS values)."""
+    factors = properties.get("speed_profile")
+    if factors is None:
+        highway = properties.get("highway")
+        if isinstance(highway, list):
+            highway = highway[0] if highway else None
+        factors = HOURLY_SPEED_FACTORS["arterial" if highway in ARTERIAL_HIGHWAYS else "local"]
+    factors = np.asarray(factors, dtype=np.float64)
+    if PROFILE_BUCKETS % len(factors):
+        raise ValueError(f"A speed profile needs a divisor of {PROFILE_BUCKETS} values, got {len(factors)}")
+    factors = np.repeat(factors, PROFILE_BUCKETS // len(factors))
+    return np.clip(factors, MIN_SPEED_FACTOR, None)
+
+
+def speed_profiles(features):
+    """Deduplicated profiles for a feature list: (profiles, feature_profile).
+
+    `profiles` is a (P, PROFILE_BUCKETS) float32 array with one row per
+    distinct profile and `feature_profile[i]` is the row used by feature i, so
+    roads with the same profile share one row however many edges they have.
+    """
+    if not features:
+        return np.ones((1, PROFILE_BUCKETS), dtype=np.float32), np.empty(0, dtype=np.int32)
+    rows = np.array([speed_profile(f.get('properties') or {}) for f in features], dtype=np.float32)
+    profiles, feature_profile = np.unique(rows, axis=0, return_inverse=True)
+    return profiles, feature_profile.reshape(-1).astype(np.int32)
@@ -0,0 +1,157 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+import Components
+import RoutingGraph
+import SpatialIndex
+
+# A point projected onto a road segment. `edge` and `twin` are the segment's
+# directed edges (twin is -1 on one-way roads); `fraction` runs from edge's
+# source (0) to its target (1). Nothing is added to the graph: the snapped
+# point acts as a virtual node for the one query that uses it.
+Snap = namedtuple("Snap", "edge twin fraction distance lon lat")
+
+
+def find_twin(graph, edge):
+    """The opposite-direction edge of the same road segment, or -1."""
+    u = int(graph.edge_sources()[edge])
+    v = int(graph.targets[edge])
+    way = graph.edge_way[edge]
+    bends = graph.edge_geometry(edge)[::-1]
+    start, end = int(graph.indptr[v]), int(graph.indptr[v + 1])
+    for candidate in range(start, end):
+        # Contracted chains between the same two junctions differ in their bends
+        if (graph.targets[candidate] == u and graph.edge_way[candidate] == way
+                and np.array_equal(graph.edge_geometry(candidate), bends)):
+            return candidate
+    return -1
+
+
+def snap(graph, lon, lat, max_radius=math.inf, largest_component=False):
+    """Project (lon, lat) onto the nearest road segment (in projected meters).
+
+    With largest_component only segments inside the graph's largest strongly
+    connected component are considered, so stray fragments are skipped.
+    On a view with road closures blocked edges are never snapped to, and a
+    blocked twin counts as a one-way road.
+    Raises ValueError when no segment lies within max_radius meters.
+    """
+    mask = Components.largest_component_edges(graph) if largest_component else None
+    if graph.closures:
+        open_edges = graph.closures.open_edges(graph.num_edges)
+        mask = open_edges if mask is None else mask & open_edges
+    found = SpatialIndex.SegmentIndex.for_graph(graph).nearest(lon, lat, max_radius, mask)
+    if found is None:
+        raise ValueError(f"No road within {max_radius} m of ({lon}, {lat}).")
+    edge, distance, fraction = found
+    twin = find_twin(graph, edge)
+    if twin >= 0 and graph.closures and graph.closures.is_blocked(twin):
+        twin = -1
+    # One orientation per segment, so snaps on the same road compare directly
+    if twin >= 0 and twin < edge:
+        edge, twin, fraction = twin, edge, 1.0 - fraction
+    lon, lat = SpatialIndex.SegmentIndex.for_graph(graph).point_at(edge, fraction)
+    return Snap(edge, twin, fraction, distance, lon, lat)
+
+
+def source_exits(graph, weights, snap):
+    """Nodes reachable straight from a virtual source, with the partial edge cost."""
+    exits = {int(graph.targets[snap.edge]): (1 - snap.fraction) * float(weights[snap.edge])}
+    if snap.twin >= 0:
+        exits[int(graph.targets[snap.twin])] = snap.fraction * float(weights[snap.twin])
+    return exits
+
+
+def target_entries(graph, weights, snap):
+    """Nodes a virtual target is reached from, with the partial edge cost."""
+    entries = {int(graph.edge_sources()[snap.edge]): snap.fraction * float(weights[snap.edge])}
+    if snap.twin >= 0:
+        entries[int(graph.edge_sources()[snap.twin])] = (1 - snap.fraction) * float(weights[snap.twin])
+    return entries
+
+
+def along_segment(weights, source, target):
+    """Cost of driving from source to target without leaving their segment.
+
+    inf when the two are on different segments, or when the target lies
+    behind the source on a one-way road.
+    """
+    if source.edge != target.edge:
+        return math.inf
+    if target.fraction >= source.fraction:
+        return (target.fraction - source.fraction) * float(weights[source.edge])
+    if source.twin >= 0:
+        return (source.fraction - target.fraction) * float(weights[source.twin])
+    return math.inf
+
+
+def may_connect(graph, source, target):
+    """False when no route between two snaps can exist (component labels, O(1))."""
+    sources_of = graph.edge_sources()
+    exits = [graph.targets[source.edge]] + ([graph.targets[source.twin]] if source.twin >= 0 else [])
+    entries = [sources_of[target.edge]] + ([sources_of[target.twin]] if target.twin >= 0 else [])
+    return Components.may_reach_any(graph, exits, entries)
+
+
+def shortest_path(graph, source, target, metric="distance", router=None):
+    """Route between two snaps; returns (cost, [[lon, lat], ...]) from snapped source to snapped target.
+
+    Partial edges are charged in proportion to the fraction travelled. A
+    router (e.g. MultilevelRouting.MultilevelRouter) replaces the plain
+    Dijkstra between the snapped segments' end nodes.
+    """
+    weights = graph.weights(metric)
+    best, nodes = math.inf, None
+
+    # Both points on the same segment: driving along it may beat leaving it
+    direct = along_segment(weights, source, target)
+    if direct < math.inf:
+        best, nodes = direct, []
+
+    try:
+        if not may_connect(graph, source, target):
+            raise RoutingGraph.NoPathError("The snapped source and target are in different components.")
+        exits, entries = source_exits(graph, weights, source), target_entries(graph, weights, target)
+        if router is not None:
+            cost, path = router.shortest_path_between(exits, entries)
+        else:
+            cost, path = RoutingGraph.shortest_path_between(graph, exits, entries, metric)
+        if cost < best:
+            best, nodes = cost, path
+    except RoutingGraph.NoPathError:
+        pass
+
+    if nodes is None:
+        raise RoutingGraph.NoPathError("No path exists between the snapped source and target.")
+    return best, route_coords(graph, source, target, nodes, metric)
+
+
+def route_coords(graph, source, target, nodes, metric="distance", edges=None):
+    """[[lon, lat], ...] from the snapped source through `nodes` to the snapped target.
+
+    `nodes` runs from the end of the source's edge (or twin) to the start of
+    the target's; an empty list means the route stays on the segment both
+    points are snapped to. Bends of contracted edges are included, using
+    `edges` between consecutive nodes when given and the cheapest ones otherwise.
+    """
+    index = SpatialIndex.SegmentIndex.for_graph(graph)
+    coords = [[source.lon, source.lat]]
+    if not nodes:
+        if target.fraction >= source.fraction:
+            coords.extend(index.inner_points(source.edge, source.fraction, target.fraction))
+        else:
+            coords.extend(index.inner_points(source.twin, 1 - source.fraction, 1 - target.fraction))
+    else:
+        if nodes[0] == graph.targets[source.edge]:
+            coords.extend(index.inner_points(source.edge, source.fraction, 1.0))
+        else:
+            coords.extend(index.inner_points(source.twin, 1 - source.fraction, 1.0))
+        coords.extend(graph.path_coords(nodes, metric, edges))
+        if nodes[-1] == graph.edge_sources()[target.edge]:
+            coords.extend(index.inner_points(target.edge, 0.0, target.fraction))
+        else:
+            coords.extend(index.inner_points(target.twin, 0.0, 1 - target.fraction))
+    coords.append([target.lon, target.lat])
+    return coords
@@ -0,0 +1,191 @@
+import json
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import psutil
+except ImportError:  # RSS samples are skipped without psutil
+    psutil = None
+
+
+class CountHistogram:
+    """Histogram of non-negative counts with power-of-two buckets (0, 1, 2-3, 4-7, ...)."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        bucket = 0 if value <= 0 else 1 << (int(value).bit_length() - 1)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            # Keys are the lower bound of each bucket
+            "buckets": {str(bound): self.buckets[bound] for bound in sorted(self.buckets)},
+        }
+
+
+class Stage:
+    """Timing and throughput of one build stage; add processed items to `items`."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.seconds = 0.0
+        self.peak_traced_bytes = None
+
+    def to_dict(self):
+        return {
+            "seconds": self.seconds,
+            "items": self.items,
+            "items_per_second": self.items / self.seconds if self.seconds else None,
+            "peak_traced_bytes": self.peak_traced_bytes,
+        }
+
+
+class BuildTelemetry:
+    """Collects stage timings, counters, histograms and memory samples for a graph build.
+
+    Nothing is printed per item. `sample_rate` (0..1) controls which items get a
+    detail log line through `should_log`; `trace_memory` turns on tracemalloc for
+    per-stage peaks and the top allocators in the report.
+    """
+
+    def __init__(self, sample_rate=0.0, trace_memory=False, top_allocators=15, log=print):
+        self.sample_every = math.ceil(1 / sample_rate) if sample_rate > 0 else 0
+        self.trace_memory = trace_memory
+        self.top_allocators = top_allocators
+        self.log = log
+        self.stages = {}
+        self.counters = {}
+        self.histograms = {}
+        self.memory_samples = []
+        self._seen = 0
+        self._depth = 0
+        self._started = time.perf_counter()
+        self._snapshot = None
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        """Time a build stage; yields the Stage so callers can count items."""
+        stage = self.stages.setdefault(name, Stage(name))
+        # Nested stages share the enclosing stage's peak instead of resetting it
+        if self.trace_memory and self._depth == 0:
+            tracemalloc.reset_peak()
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds += time.perf_counter() - start
+            self._depth -= 1
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                stage.peak_traced_bytes = max(stage.peak_traced_bytes or 0, peak)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        self.histograms.setdefault(name, CountHistogram()).observe(value)
+
+    def should_log(self):
+        """True for one item in every 1/sample_rate; use it to gate detail logging."""
+        if not self.sample_every:
+            return False
+        self._seen += 1
+        return self._seen % self.sample_every == 0
+
+    def sample_memory(self, label):
+        """Record RSS (and traced memory) at a point of the build, e.g. after each batch."""
+        sample = {"label": label, "elapsed_s": time.perf_counter() - self._started}
+        if psutil is not None:
+            sample["rss_bytes"] = psutil.Process(os.getpid()).memory_info().rss
+        if self.trace_memory:
+            sample["traced_bytes"], sample["traced_peak_bytes"] = tracemalloc.get_traced_memory()
+        self.memory_samples.append(sample)
+        return sample
+
+    def snapshot_allocators(self):
+        """Take the tracemalloc snapshot used for the top allocators; call before freeing the build."""
+        if self.trace_memory:
+            self._snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ])
+
+    def report(self):
+        if self.trace_memory and self._snapshot is None:
+            self.snapshot_allocators()
+        allocators = []
+        if self._snapshot is not None:
+            for stat in self._snapshot.statistics("lineno")[:self.top_allocators]:
+                frame = stat.traceback[0]
+                allocators.append({
+                    "location": f"{frame.filename}:{frame.lineno}",
+                    "size_bytes": stat.size,
+                    "blocks": stat.count,
+                })
+        return {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "argv": sys.argv,
+            "total_seconds": time.perf_counter() - self._started,
+            "stages": {name: stage.to_dict() for name, stage in self.stages.items()},
+            "counters": self.counters,
+            "histograms": {name: hist.to_dict() for name, hist in self.histograms.items()},
+            "memory_samples": self.memory_samples,
+            "top_allocators": allocators,
+        }
+
+    def write_report(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+        self.log(f"Build report saved to {path}")
+
+
+def compare_reports(baseline_path, candidate_path):
+    """Print stage time and counter differences between two build reports."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(candidate_path, "r", encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    print(f"{'stage':<24} {'before s':>10} {'after s':>10} {'ratio':>7}")
+    for name, stage in candidate["stages"].items():
+        before = baseline["stages"].get(name, {}).get("seconds")
+        if before is None:
+            continue
+        ratio = stage["seconds"] / before if before else math.inf
+        print(f"{name:<24} {before:>10.2f} {stage['seconds']:>10.2f} {ratio:>6.2f}x")
+    for name, value in candidate["counters"].items():
+        before = baseline["counters"].get(name)
+        if before != value:
+            print(f"counter {name}: {before} -> {value}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "compare":
+        print("Usage: python BuildTelemetry.py compare <baseline.json> <candidate.json>")
+        sys.exit(2)
+    compare_reports(sys.argv[2], sys.argv[3])
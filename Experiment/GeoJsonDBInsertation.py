@@ -1,7 +1,13 @@
+import os
+import sys
 import geojson
 import psycopg2
 from psycopg2 import sql
 
+# StreamingGeojson lives in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import StreamingGeojson
+
 # Database connection parameters
 db_config = {
     "dbname": "routedb",  # Your database name
@@ -80,9 +86,6 @@ def insert_geojson_to_db(geojson_data):
             conn.close()
             print("Database connection closed.")
 
-# Load GeoJSON file
+# Stream the GeoJSON file into the database, one feature in memory at a time
 with open("map.geojson", "r", encoding="utf-8") as f:
-    geojson_data = geojson.load(f)
-
-# Insert GeoJSON data into the database
-insert_geojson_to_db(geojson_data)
\ No newline at end of file
+    insert_geojson_to_db({"type": "FeatureCollection", "features": StreamingGeojson.iter_features(f)})
\ No newline at end of file
@@ -1,7 +1,12 @@
 import json
+import os
+import sys
 import psycopg2
 from shapely.geometry import LineString, Point
-from geopy.distance import geodesic
+
+# CostModel lives in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import CostModel
 
 # Database Configuration
 DB_CONFIG = {
@@ -58,25 +63,24 @@ def get_or_create_node(lat, lon):
         node_counter += 1
     return nodes[coord]
 
-for feature in geojson_data["features"]:
-    if feature["geometry"]["type"] == "LineString":
-        coords = feature["geometry"]["coordinates"]
-        properties = feature["properties"]
+line_features = [f for f in geojson_data["features"] if f["geometry"]["type"] == "LineString"]
 
-        highway = properties.get("highway", None)
-        oneway = properties.get("oneway", "no") == "yes"
+# Segment lengths for every LineString in one vectorized call (WGS84 ellipsoid)
+src, dst, owner = CostModel.segment_arrays(line_features)
+lengths = CostModel.ellipsoidal_m(src[:, 0], src[:, 1], dst[:, 0], dst[:, 1])
 
-        for i in range(len(coords) - 1):
-            lat1, lon1 = coords[i][1], coords[i][0]
-            lat2, lon2 = coords[i + 1][1], coords[i + 1][0]
+for (lon1, lat1), (lon2, lat2), feature_index, length in zip(src.tolist(), dst.tolist(), owner.tolist(),
+                                                             lengths.tolist()):
+    properties = line_features[feature_index]["properties"]
+    highway = properties.get("highway", None)
+    oneway = properties.get("oneway", "no") == "yes"
 
-            source = get_or_create_node(lat1, lon1)
-            target = get_or_create_node(lat2, lon2)
+    source = get_or_create_node(lat1, lon1)
+    target = get_or_create_node(lat2, lon2)
 
-            length = geodesic((lat1, lon1), (lat2, lon2)).meters
-            cost = length  # Distance-based cost
+    cost = length  # Distance-based cost
 
-            edges.append((source, target, length, cost, None if oneway else cost, oneway, highway))
+    edges.append((source, target, length, cost, None if oneway else cost, oneway, highway))
 
 # Insert Nodes into PostgreSQL
 for (lat, lon), node_id in nodes.items():
@@ -5,9 +5,8 @@ import geojson
 from shapely.geometry import LineString, Point
 from shapely.validation import make_valid
 from shapely.strtree import STRtree
-import time
-import os
-import psutil
+import argparse
+from BuildTelemetry import BuildTelemetry
 
 
 
@@ -75,11 +74,6 @@ def find_intersection(line1, line2):
         return intersection.coords[0]  # Return the intersection point
     return None  # Ignore multi-point or line intersections
 
-def log_memory_usage():
-    """Log the current memory usage of the process."""
-    process = psutil.Process(os.getpid())
-    print(f"Memory usage: {process.memory_info().rss / 1024 ** 2:.2f} MB")
-
 def split_line_at_point(line, point):
     """Split a LineString at a given point, ensuring valid geometries."""
     line = make_valid(LineString(line))  # Ensure the LineString is valid
@@ -97,34 +91,46 @@ def split_line_at_point(line, point):
     ]
     return [split_line[0], split_line[1]], [split_line[1], split_line[2]]
 
-def build_graph_with_intersections(geojson_data, tolerance=0.0001):
-    """Build a graph from GeoJSON data, handling intersections and merging similar nodes."""
+def build_graph_with_intersections(geojson_data, tolerance=0.0001, telemetry=None):
+    """Build a graph from GeoJSON data, handling intersections and merging similar nodes.
+
+    Progress, counts and memory go to `telemetry` (a BuildTelemetry); only one
+    summary line per batch is printed, plus sampled per-LineString details.
+    """
+    if telemetry is None:
+        telemetry = BuildTelemetry()
     G = nx.DiGraph()
     lines = []
 
     # First pass: Collect all LineStrings and their geometries
     line_geometries = []
-    for feature in geojson_data['features']:
-        if feature['geometry']['type'] == 'LineString':
-            coords = feature['geometry']['coordinates']
-            properties = feature.get('properties', {})
-            try:
-                line = make_valid(LineString(coords))
-                if not line.is_valid:
-                    print(f"Skipping invalid LineString: {coords}")
+    with telemetry.stage("collect_lines") as stage:
+        for feature in geojson_data['features']:
+            if feature['geometry']['type'] == 'LineString':
+                stage.items += 1
+                coords = feature['geometry']['coordinates']
+                properties = feature.get('properties', {})
+                try:
+                    line = make_valid(LineString(coords))
+                    if not line.is_valid:
+                        telemetry.count("invalid_linestrings")
+                        continue
+                    lines.append({
+                        'geometry': line,
+                        'coordinates': coords,
+                        'properties': properties
+                    })
+                    line_geometries.append(line)
+                except Exception as e:
+                    telemetry.count("linestring_errors")
+                    if telemetry.should_log():
+                        print(f"Error creating LineString: {e}")
                     continue
-                lines.append({
-                    'geometry': line,
-                    'coordinates': coords,
-                    'properties': properties
-                })
-                line_geometries.append(line)
-            except Exception as e:
-                print(f"Error creating LineString: {e}")
-                continue
 
     # Build a spatial index
-    tree = STRtree(line_geometries)
+    with telemetry.stage("spatial_index") as stage:
+        tree = STRtree(line_geometries)
+        stage.items = len(line_geometries)
 
     # Second pass: Detect intersections and split LineStrings
     new_lines = []
@@ -133,82 +139,95 @@ def build_graph_with_intersections(geojson_data, tolerance=0.0001):
     max_candidates = 2000  # Skip LineStrings with too many candidates
     max_intersections = 50  # Skip LineStrings with too many intersection points
 
-    for batch in batches:
-        start_time = time.time()
-        batch_index = batches.index(batch) + 1
-        print(f"Processing batch {batch_index}/{len(batches)}")
-        log_memory_usage()
-
-        for line1 in batch:
-            coords1 = line1['coordinates']
-            split_points = set()
-            candidates = tree.query(line1['geometry'])
-            num_candidates = len(candidates)
-            print(f"LineString {batch.index(line1) + 1}/{len(batch)}: {num_candidates} candidates")
-
-            if num_candidates > max_candidates:
-                print(f"Skipping LineString {batch.index(line1) + 1}/{len(batch)}: too many candidates ({num_candidates})")
-                continue
-
-            for candidate in candidates:
-                if candidate == line1['geometry']:
-                    continue  # Skip self
-                if not isinstance(candidate, LineString):
-                    continue  # Skip invalid candidates
-                try:
-                    intersection = line1['geometry'].buffer(tolerance).intersection(candidate.buffer(tolerance))
-                    if intersection.is_empty:
-                        continue
-                    if intersection.geom_type == 'Point':
-                        split_points.add(intersection.coords[0])
-                except Exception as e:
-                    print(f"Error computing intersection: {e}")
+    for batch_index, batch in enumerate(batches, 1):
+        with telemetry.stage("split_lines") as stage:
+            for line_index, line1 in enumerate(batch, 1):
+                stage.items += 1
+                coords1 = line1['coordinates']
+                split_points = set()
+                candidates = tree.query(line1['geometry'])
+                num_candidates = len(candidates)
+                telemetry.observe("candidates_per_line", num_candidates)
+
+                if num_candidates > max_candidates:
+                    telemetry.count("skipped_too_many_candidates")
+                    continue
+
+                with telemetry.stage("intersections"):
+                    for candidate in candidates:
+                        if candidate == line1['geometry']:
+                            continue  # Skip self
+                        if not isinstance(candidate, LineString):
+                            continue  # Skip invalid candidates
+                        try:
+                            intersection = line1['geometry'].buffer(tolerance).intersection(candidate.buffer(tolerance))
+                            if intersection.is_empty:
+                                continue
+                            if intersection.geom_type == 'Point':
+                                split_points.add(intersection.coords[0])
+                        except Exception as e:
+                            telemetry.count("intersection_errors")
+                            if telemetry.should_log():
+                                print(f"Error computing intersection: {e}")
+                            continue
+
+                num_intersections = len(split_points)
+                telemetry.observe("intersections_per_line", num_intersections)
+                if telemetry.should_log():
+                    print(f"Batch {batch_index}, LineString {line_index}/{len(batch)}: "
+                          f"{num_candidates} candidates, {num_intersections} intersection points")
+
+                if num_intersections > max_intersections:
+                    telemetry.count("skipped_too_many_intersections")
                     continue
 
-            num_intersections = len(split_points)
-            print(f"LineString {batch.index(line1) + 1}/{len(batch)}: {num_intersections} intersection points")
-
-            if num_intersections > max_intersections:
-                print(f"Skipping LineString {batch.index(line1) + 1}/{len(batch)}: too many intersections ({num_intersections})")
-                continue
-
-            if split_points:
-                current_line = coords1
-                for point in sorted(split_points, key=lambda p: LineString(current_line).project(Point(p))):
-                    try:
-                        part1, part2 = split_line_at_point(current_line, point)
-                        new_lines.append({'coordinates': part1, 'properties': line1['properties']})
-                        current_line = part2
-                    except ValueError as e:
-                        print(f"Skipping invalid split: {e}")
-                new_lines.append({'coordinates': current_line, 'properties': line1['properties']})
-            else:
-                new_lines.append(line1)
-
-        end_time = time.time()
-        print(f"Batch {batch_index} processed in {end_time - start_time:.2f} seconds")
-        log_memory_usage()
+                if split_points:
+                    current_line = coords1
+                    for point in sorted(split_points, key=lambda p: LineString(current_line).project(Point(p))):
+                        try:
+                            part1, part2 = split_line_at_point(current_line, point)
+                            new_lines.append({'coordinates': part1, 'properties': line1['properties']})
+                            current_line = part2
+                        except ValueError:
+                            telemetry.count("invalid_splits")
+                    new_lines.append({'coordinates': current_line, 'properties': line1['properties']})
+                    telemetry.count("lines_split")
+                else:
+                    new_lines.append(line1)
+
+        memory = telemetry.sample_memory(f"batch {batch_index}")
+        rss = f", RSS {memory['rss_bytes'] / 1024 ** 2:.0f} MB" if "rss_bytes" in memory else ""
+        print(f"Batch {batch_index}/{len(batches)} done ({telemetry.stages['split_lines'].seconds:.1f}s total{rss})")
 
     # Third pass: Add nodes and edges to the graph
-    for line in new_lines:
-        coords = line['coordinates']
-        properties = line['properties']
-        is_oneway = properties.get('oneway', 'no') == 'yes'
-        cost = properties.get('cost', 1)
+    with telemetry.stage("add_edges") as stage:
+        for line in new_lines:
+            coords = line['coordinates']
+            properties = line['properties']
+            is_oneway = properties.get('oneway', 'no') == 'yes'
+            cost = properties.get('cost', 1)
 
-        for i in range(len(coords) - 1):
-            source = tuple(coords[i])
-            target = tuple(coords[i + 1])
+            for i in range(len(coords) - 1):
+                source = tuple(coords[i])
+                target = tuple(coords[i + 1])
 
-            G.add_node(source, pos=source)
-            G.add_node(target, pos=target)
+                G.add_node(source, pos=source)
+                G.add_node(target, pos=target)
 
-            G.add_edge(source, target, weight=cost)
-            if not is_oneway:
-                G.add_edge(target, source, weight=cost)
+                G.add_edge(source, target, weight=cost)
+                if not is_oneway:
+                    G.add_edge(target, source, weight=cost)
+                stage.items += 1
 
     # Merge similar nodes
-    G = merge_similar_nodes(G, tolerance)
+    with telemetry.stage("merge_similar_nodes") as stage:
+        stage.items = G.number_of_nodes()
+        G = merge_similar_nodes(G, tolerance)
+
+    telemetry.count("graph_nodes", G.number_of_nodes())
+    telemetry.count("graph_edges", G.number_of_edges())
+    telemetry.sample_memory("graph built")
+    telemetry.snapshot_allocators()
 
     return G
 
@@ -273,14 +292,23 @@ def generate_leaflet_html(path_coords, output_file="path_visualization.html"):
 
 # Main script
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the routing graph from the routes table.")
+    parser.add_argument("--report", default="build_report.json", help="where to write the JSON build report")
+    parser.add_argument("--sample-rate", type=float, default=0.0,
+                        help="fraction of LineStrings that get a detail log line (0 disables)")
+    parser.add_argument("--trace-memory", action="store_true", help="record tracemalloc peaks and top allocators")
+    args = parser.parse_args()
+
     geojson_data = fetch_geojson_from_db()
     if not geojson_data:
         print("Failed to fetch GeoJSON data from the database.")
         exit()
 
     # Build the graph
-    G = build_graph_with_intersections(geojson_data)
+    telemetry = BuildTelemetry(sample_rate=args.sample_rate, trace_memory=args.trace_memory)
+    G = build_graph_with_intersections(geojson_data, telemetry=telemetry)
     print(f"Graph built with {G.number_of_nodes()} nodes and {G.number_of_edges()} edges.")
+    telemetry.write_report(args.report)
 
     # Build K-D Tree
     nodes = list(G.nodes())
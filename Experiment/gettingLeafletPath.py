@@ -1,34 +1,36 @@
-import geojson
+import os
+import sys
 import networkx as nx
 from scipy.spatial import KDTree
 
-# Load GeoJSON file
-with open("map.geojson", "r", encoding="utf-8") as f:
-    geojson_data = geojson.load(f)
+# StreamingGeojson lives in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import StreamingGeojson
 
 # Initialize a graph
 G = nx.Graph()
 
-# Parse GeoJSON features
-for feature in geojson_data['features']:
-    geometry = feature['geometry']
-    properties = feature.get('properties', {})
+# Parse GeoJSON features one at a time instead of loading the whole file
+with open("map.geojson", "r", encoding="utf-8") as f:
+    for feature in StreamingGeojson.iter_features(f):
+        geometry = feature['geometry']
+        properties = feature.get('properties', {})
 
-    if geometry['type'] == 'LineString':
-        coords = geometry['coordinates']
+        if geometry['type'] == 'LineString':
+            coords = geometry['coordinates']
         
-        # Add edges and nodes to the graph
-        for i in range(len(coords) - 1):
-            source = tuple(coords[i])
-            target = tuple(coords[i + 1])
-            cost = properties.get('cost', 1)  # Default cost if not provided
+            # Add edges and nodes to the graph
+            for i in range(len(coords) - 1):
+                source = tuple(coords[i])
+                target = tuple(coords[i + 1])
+                cost = properties.get('cost', 1)  # Default cost if not provided
             
-            # Add nodes with coordinates as IDs
-            G.add_node(source, pos=source)
-            G.add_node(target, pos=target)
+                # Add nodes with coordinates as IDs
+                G.add_node(source, pos=source)
+                G.add_node(target, pos=target)
             
-            # Add edge
-            G.add_edge(source, target, weight=cost)
+                # Add edge
+                G.add_edge(source, target, weight=cost)
 
 # Build K-D Tree from graph nodes
 nodes = list(G.nodes())
@@ -1,7 +1,11 @@
+import os
+import sys
 import psycopg2
-import heapq
 import networkx as nx
-from decimal import Decimal
+
+# SearchEngine lives in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import SearchEngine
 
 # Connect to PostgreSQL
 def fetch_graph_data():
@@ -25,58 +29,38 @@ def fetch_graph_data():
     return nodes, edges
 
 # Manual dijkstra Algorithm
-def dijkstra_manual(nodes, edges, start, target):
-    # Build adjacency list
-    graph = {}
-    for source, target_node, cost in edges:
-        if source not in graph:
-            graph[source] = []
-        graph[source].append((target_node, float(cost)))
-
-    print(graph)
-
-    # Priority queue for Dijkstra
-    pq = [(0, start)]  # (distance, node)
-    distances = {node_id: float("inf") for node_id, _ in nodes}
-    distances[start] = 0
-    previous = {node_id: None for node_id, _ in nodes}
-    
-    while pq:
-        current_distance, current_node = heapq.heappop(pq)
-        
-        if current_node == target:
-            break
-        
-        if current_distance > distances[current_node]:
-            continue
-        
-        for neighbor, weight in graph.get(current_node, []):
-            distance = current_distance + weight
-            if distance < distances[neighbor]:
-                distances[neighbor] = distance
-                previous[neighbor] = current_node
-                heapq.heappush(pq, (distance, neighbor))
-    
-    # Reconstruct path
-    path = []
-    node = target
-    while node is not None:
-        path.append(node)
-        node = previous[node]
-    path.reverse()
-    
-    return {"cost": distances[target], "path": path}
-
-
-
-def networkx_shortest_path(nodes, edges, start, target):
+# Builds a SearchEngine from the lists on every call; to reuse the adjacency across
+# queries, build one with SearchEngine.from_edges and pass it as `engine` (and build
+# a new one whenever the edges change).
+# Pass a dict as `stats` to get the number of settled nodes back in stats["settled"]
+def dijkstra_manual(nodes, edges, start, target, stats=None, engine=None):
+    if engine is None:
+        engine = SearchEngine.SearchEngine.from_edges(nodes, edges)
+    cost, path = engine.shortest_path(start, target, stats)
+    if not path:
+        path = [target]
+    return {"cost": cost, "path": path}
+
+
+def networkx_shortest_path(nodes, edges, start, target, stats=None):
     G = nx.Graph()
     for source, target_node, cost in edges:
         G.add_edge(source, target_node, weight=float(cost))
-    
+
+    # networkx calls the weight function once per edge of every settled node
+    settled = set()
+
+    def settled_weight(u, v, data):
+        settled.add(u)
+        return data['weight']
+
+    weight = settled_weight if stats is not None else 'weight'
+
     try:
-        path = nx.shortest_path(G, source=start, target=target, weight='weight')
-        cost = nx.shortest_path_length(G, source=start, target=target, weight='weight')
+        path = nx.shortest_path(G, source=start, target=target, weight=weight)
+        cost = nx.shortest_path_length(G, source=start, target=target, weight=weight)
+        if stats is not None:
+            stats["settled"] = len(settled)
         return {"cost": cost, "path": path}
     except nx.NetworkXNoPath:
         return {"cost": float("inf"), "path": []}
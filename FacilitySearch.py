@@ -0,0 +1,194 @@
+import heapq
+import json
+import math
+import os
+import re
+import tempfile
+
+import ComputePool
+import EdgeSnapping
+import RoutingGraph
+
+# Facility sets live next to the graph generations, one JSON file per set
+FACILITIES_DIR = "facilities"
+# Facilities further than this from every road of a graph are left out of that graph
+# (with regional graphs: the facilities of other regions)
+SNAP_RADIUS_M = 500.0
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class UnknownFacilitySet(Exception):
+    """Raised when no facility set has the requested name."""
+
+
+class FacilityIndex:
+    """A facility set snapped onto one graph: which facilities each node leads into.
+
+    `snaps[i]` is facility i's EdgeSnapping.Snap (None when it lies beyond
+    SNAP_RADIUS_M). A facility on edge u->v is entered from u along the edge
+    and, on two-way roads, from v along the twin; the partial costs are taken
+    from the metric's weights at query time, so every metric and closure view
+    shares one index.
+    """
+
+    def __init__(self, graph, points):
+        # Snap ignoring closures: the index is cached for every view of the graph,
+        # and a closed edge simply costs inf to enter at query time
+        plain = RoutingGraph.RoutingGraph(graph.arrays, graph.meta)
+        plain._cache = graph._cache
+        sources = graph.edge_sources()
+        self.snaps = []
+        self.entries = {}  # node -> [(facility, via twin), ...]
+        self.on_edge = {}  # snapped edge -> [facility, ...]
+        for facility, (lon, lat) in enumerate(points):
+            try:
+                snap = EdgeSnapping.snap(plain, lon, lat, SNAP_RADIUS_M)
+            except ValueError:
+                self.snaps.append(None)
+                continue
+            self.snaps.append(snap)
+            self.entries.setdefault(int(sources[snap.edge]), []).append((facility, False))
+            if snap.twin >= 0:
+                self.entries.setdefault(int(sources[snap.twin]), []).append((facility, True))
+            self.on_edge.setdefault(snap.edge, []).append(facility)
+
+    @property
+    def snapped(self):
+        return sum(snap is not None for snap in self.snaps)
+
+
+def nearest(graph, index, origin, k, metric="distance", max_cost=math.inf):
+    """The k facilities closest to the origin snap by network cost, nearest first.
+
+    A single Dijkstra from the origin treats every facility as an extra node
+    reached from its segment's end nodes, and stops as soon as k of them are
+    settled (or the search passes max_cost), however many facilities the set
+    holds. Returns [(facility, cost, nodes), ...] where nodes is the node path
+    for EdgeSnapping.route_coords.
+    """
+    weights = graph.weights(metric)
+    settle = ComputePool.budget().settle
+    if k <= 0:
+        return []
+
+    # Facilities are keyed -1 - i in the heap, nodes by their id
+    best = {}
+    entered_from = {}
+    heap = []
+
+    def offer(facility, cost, node):
+        if cost <= max_cost and cost < best.get(facility, math.inf):
+            best[facility] = cost
+            entered_from[facility] = node
+            heapq.heappush(heap, (cost, -1 - facility))
+
+    # Facilities on the origin's own segment are reached without leaving it
+    for facility in index.on_edge.get(origin.edge, ()):
+        fraction = index.snaps[facility].fraction
+        if fraction >= origin.fraction:
+            offer(facility, (fraction - origin.fraction) * float(weights[origin.edge]), None)
+        elif origin.twin >= 0:
+            offer(facility, (origin.fraction - fraction) * float(weights[origin.twin]), None)
+
+    dist, parent = {}, {}
+    for node, cost in EdgeSnapping.source_exits(graph, weights, origin).items():
+        if cost < dist.get(node, math.inf):
+            dist[node], parent[node] = cost, -1
+            heapq.heappush(heap, (cost, node))
+
+    indptr, edge_targets = graph.indptr, graph.targets
+    found = []
+    done = set()
+    while heap:
+        d, key = heapq.heappop(heap)
+        if d > max_cost:
+            break
+        if key < 0:
+            facility = -1 - key
+            if facility in done or d > best[facility]:
+                continue
+            done.add(facility)
+            node = entered_from[facility]
+            found.append((facility, d, [] if node is None else RoutingGraph.path_to(parent, node)))
+            if len(found) == k:
+                break
+            continue
+        u = key
+        if d > dist[u]:
+            continue
+        settle()
+        for facility, via_twin in index.entries.get(u, ()):
+            snap = index.snaps[facility]
+            partial = (1 - snap.fraction) * weights[snap.twin] if via_twin else snap.fraction * weights[snap.edge]
+            offer(facility, d + float(partial), u)
+        start, end = int(indptr[u]), int(indptr[u + 1])
+        for v, w in zip(edge_targets[start:end].tolist(), weights[start:end].tolist()):
+            nd = d + w
+            if nd < dist.get(v, math.inf):
+                dist[v] = nd
+                parent[v] = u
+                heapq.heappush(heap, (nd, v))
+    return found
+
+
+class FacilityStore:
+    """Named facility sets saved under `<root>/facilities/<name>.json`.
+
+    A set is a list of (lon, lat) points with optional per-facility
+    properties. Each is snapped onto a graph once per process and graph, and
+    again only when the set is replaced.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.join(root, FACILITIES_DIR)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, name):
+        if not NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid facility set name {name!r}; use letters, digits, '_' and '-'.")
+        return os.path.join(self.root, f"{name}.json")
+
+    def names(self):
+        return sorted(entry[:-5] for entry in os.listdir(self.root) if entry.endswith(".json"))
+
+    def save(self, name, points, properties=None):
+        """Create or replace a set; points are [[lon, lat], ...]."""
+        path = self._path(name)
+        if not points or any(len(point) < 2 for point in points):
+            raise ValueError("A facility set needs at least one [longitude, latitude] point.")
+        if properties is not None and len(properties) != len(points):
+            raise ValueError("Give one properties object per facility.")
+        facilities = {"points": [[float(point[0]), float(point[1])] for point in points],
+                      "properties": properties or [{} for _ in points]}
+        handle, staging = tempfile.mkstemp(prefix=f"{name}-", dir=self.root)
+        with os.fdopen(handle, "w", encoding="utf-8") as f:
+            json.dump(facilities, f)
+        os.replace(staging, path)
+        return facilities
+
+    def remove(self, name):
+        """Delete a set; False when there is no such set."""
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def load(self, graph, name):
+        """(facilities, FacilityIndex) of a set on this graph; UnknownFacilitySet when there is no such set."""
+        path = self._path(name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise UnknownFacilitySet(f"No facility set {name!r}.")
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        indexes = graph._cache.setdefault("facility_indexes", {})
+        cached = indexes.get(name)
+        if cached is None or cached[0] != stamp:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    facilities = json.load(f)
+            except FileNotFoundError:  # removed since the stat
+                raise UnknownFacilitySet(f"No facility set {name!r}.")
+            cached = indexes[name] = (stamp, facilities, FacilityIndex(graph, facilities["points"]))
+        return cached[1], cached[2]
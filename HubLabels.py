@@ -0,0 +1,386 @@
+import argparse
+import heapq
+import json
+import math
+import os
+import random
+import time
+
+import numpy as np
+
+import RoutingGraph
+
+# Settled nodes after which a witness search gives up (and the shortcut is added anyway)
+WITNESS_SETTLED = 64
+# Pairs answered per vectorized step of HubLabels.distances (bounds temporary memory)
+QUERY_CHUNK = 1 << 15
+# Sources per dense hub table in HubLabels.distances
+PAIR_SOURCES = 64
+# Targets per dense hub table in HubLabels.matrix
+MATRIX_CHUNK = 256
+
+
+# Contraction hierarchy (gives the node order and the upward graph the labels are built from)
+
+def _witnesses(out, source, skip, limit, targets):
+    """Dijkstra from source avoiding `skip`, until every target is settled, `limit` is passed or
+    WITNESS_SETTLED nodes are settled; returns the (possibly tentative) costs found."""
+    remaining = len(targets) - (source in targets)
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    settled = 0
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        if d > limit or settled == WITNESS_SETTLED:
+            break
+        settled += 1
+        if u in targets and u != source:
+            remaining -= 1
+            if not remaining:
+                break
+        for v, w in out[u].items():
+            nd = d + w
+            if v != skip and nd < dist.get(v, math.inf):
+                dist[v] = nd
+                heapq.heappush(heap, (nd, v))
+    return dist
+
+
+def _shortcuts(out, inn, v):
+    """Shortcuts (u, w, cost) contracting v needs: every u -> v -> w with no witness path around v."""
+    found = []
+    outs = out[v]
+    if not outs:
+        return found
+    top = max(outs.values())
+    for u, cu in inn[v].items():
+        dist = _witnesses(out, u, v, cu + top, outs)
+        for w, cw in outs.items():
+            if w != u and dist.get(w, math.inf) > cu + cw:
+                found.append((u, w, cu + cw))
+    return found
+
+
+def contract(graph, metric="distance"):
+    """Contraction hierarchy of the graph under `metric`: (order, up_out, up_in).
+
+    Nodes are contracted least important first, by twice the edge difference
+    (shortcuts added minus edges removed) plus the number of neighbours
+    already contracted, with lazy updates. `order` lists node ids most
+    important first; up_out[v] and up_in[v] map v's neighbours contracted
+    after it (shortcuts included) to the edge cost from and to v.
+    """
+    n = graph.num_nodes
+    out, inn = [{} for _ in range(n)], [{} for _ in range(n)]
+    # Parallel edges collapse to the cheapest; self-loops never help
+    for u, v, w in zip(graph.edge_sources().tolist(), np.asarray(graph.targets).tolist(),
+                       np.asarray(graph.weights(metric)).tolist()):
+        if u != v and w < out[u].get(v, math.inf):
+            out[u][v] = inn[v][u] = w
+    deleted = [0] * n
+
+    def priority(v):
+        shortcuts = _shortcuts(out, inn, v)
+        return 2 * (len(shortcuts) - len(out[v]) - len(inn[v])) + deleted[v], shortcuts
+
+    heap = [(priority(v)[0], v) for v in range(n)]
+    heapq.heapify(heap)
+    contracted, up_out, up_in = [], [None] * n, [None] * n
+    while heap:
+        _, v = heapq.heappop(heap)
+        # Lazy update: contract v only if it is still the least important
+        key, shortcuts = priority(v)
+        if heap and key > heap[0][0]:
+            heapq.heappush(heap, (key, v))
+            continue
+        for u, w, cost in shortcuts:
+            if cost < out[u].get(w, math.inf):
+                out[u][w] = inn[w][u] = cost
+        for u in inn[v]:
+            del out[u][v]
+            deleted[u] += 1
+        for w in out[v]:
+            del inn[w][v]
+            deleted[w] += 1
+        up_out[v], up_in[v] = out[v], inn[v]
+        out[v], inn[v] = {}, {}
+        contracted.append(v)
+    return np.array(contracted[::-1], dtype=np.int32), up_out, up_in
+
+
+# Hierarchical labeling
+
+def _label(up, order, v, rank, hubs, dists, other_hubs, other_dists, scratch):
+    """Label of v from the labels of its upward neighbours, pruned of entries a higher hub beats.
+
+    Every upward neighbour is more important, so its label and the opposite
+    labels used for pruning are already final. Entries come out sorted by rank.
+    """
+    hub_parts, dist_parts = [np.array([rank])], [np.zeros(1)]
+    for u, cost in up[v].items():
+        hub_parts.append(hubs[u])
+        dist_parts.append(dists[u] + cost)
+    label_hubs, label_dist = np.concatenate(hub_parts), np.concatenate(dist_parts)
+    # Cheapest entry per hub
+    order_by = np.lexsort((label_dist, label_hubs))
+    label_hubs, label_dist = label_hubs[order_by], label_dist[order_by]
+    first = np.concatenate([[True], label_hubs[1:] != label_hubs[:-1]])
+    label_hubs, label_dist = label_hubs[first], label_dist[first]
+    if len(label_hubs) > 1:
+        # (hub, d) is dropped when the labels give v -> hub for less through some other hub.
+        # v itself is the last (least important) entry and is always kept.
+        scratch[label_hubs] = label_dist
+        nodes = order[label_hubs[:-1]]
+        counts = np.array([len(other_hubs[node]) for node in nodes])
+        through = np.concatenate([other_hubs[node] for node in nodes])
+        totals = scratch[through] + np.concatenate([other_dists[node] for node in nodes])
+        totals[through == np.repeat(label_hubs[:-1], counts)] = math.inf
+        scratch[label_hubs] = math.inf
+        keep = np.ones(len(label_hubs), dtype=bool)
+        keep[:-1] = np.minimum.reduceat(totals, np.cumsum(counts) - counts) >= label_dist[:-1]
+        label_hubs, label_dist = label_hubs[keep], label_dist[keep]
+    hubs[v], dists[v] = label_hubs, label_dist
+
+
+def build_labels(graph, metric="distance", hierarchy=None):
+    """Hub labels for every node under `metric`, read off a contraction hierarchy.
+
+    Nodes are labelled most important first: a node's out-label is its
+    upward neighbours' out-labels plus the edge costs (and likewise for
+    in-labels), so it covers its whole upward search space, and entries whose
+    distance another hub beats are pruned. Returns (out_labels, in_labels):
+    per node, (hub ranks, distances) arrays sorted by rank, so that
+    d(s, t) = min over common hubs h of out[s][h] + in[t][h].
+    """
+    order, up_out, up_in = hierarchy or contract(graph, metric)
+    n = graph.num_nodes
+    out_hubs, out_dist, in_hubs, in_dist = [None] * n, [None] * n, [None] * n, [None] * n
+    scratch = np.full(n, math.inf)
+    for rank, v in enumerate(order.tolist()):
+        _label(up_out, order, v, rank, out_hubs, out_dist, in_hubs, in_dist, scratch)
+        _label(up_in, order, v, rank, in_hubs, in_dist, out_hubs, out_dist, scratch)
+    return (out_hubs, out_dist), (in_hubs, in_dist)
+
+
+def _flatten(hubs, dists):
+    counts = np.array([len(h) for h in hubs], dtype=np.int64)
+    ptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    if not len(hubs):
+        return ptr, np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+    return ptr, np.concatenate(hubs).astype(np.int32), np.concatenate(dists).astype(np.float32)
+
+
+class HubLabels:
+    """Distance oracle over flat label arrays (CSR per node, hubs sorted by rank).
+
+    Hub ranks are int32 and distances float32, half the size of the graph's
+    own arrays; distances are therefore exact to float32 precision. Saved as
+    plain .npy files so workers memory-map them like the graph itself.
+    """
+
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+        # Plain ndarray views of the mappings: fancy indexing a np.memmap is noticeably slower
+        view = {name: np.asarray(array) for name, array in arrays.items()}
+        self.out_ptr, self.out_hubs, self.out_dist = view["out_ptr"], view["out_hubs"], view["out_dist"]
+        self.in_ptr, self.in_hubs, self.in_dist = view["in_ptr"], view["in_hubs"], view["in_dist"]
+        self.num_hubs = len(self.out_ptr) - 1
+
+    @classmethod
+    def build(cls, graph, metric="distance"):
+        hierarchy = contract(graph, metric)
+        (out_hubs, out_dist), (in_hubs, in_dist) = build_labels(graph, metric, hierarchy)
+        arrays = {"order": hierarchy[0]}
+        arrays["out_ptr"], arrays["out_hubs"], arrays["out_dist"] = _flatten(out_hubs, out_dist)
+        arrays["in_ptr"], arrays["in_hubs"], arrays["in_dist"] = _flatten(in_hubs, in_dist)
+        meta = {"metric": metric, "nodes": graph.num_nodes, "generation": graph.meta.get("generation")}
+        return cls(arrays, meta)
+
+    @classmethod
+    def for_graph(cls, graph, metric, graph_dir):
+        """Labels saved next to the graph's generation, cached per process; None when not built.
+
+        Also None on a view with road closures, whose distances the labels do not know about.
+        """
+        if graph.closures is not None:
+            return None
+        key = f"hub_labels_{metric}"
+        if key not in graph._cache:
+            path = label_dir(graph_dir, metric)
+            graph._cache[key] = cls.load(path) if os.path.isfile(os.path.join(path, "meta.json")) else None
+        return graph._cache[key]
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def save(self, path):
+        """Write the arrays as uncompressed .npy files (mmap-able) plus meta.json."""
+        os.makedirs(path, exist_ok=True)
+        for name, array in self.arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({**self.meta, "arrays": sorted(self.arrays)}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in meta.pop("arrays")
+        }
+        return cls(arrays, meta)
+
+    def distance(self, source, target):
+        """Shortest distance from source to target node (inf when unreachable)."""
+        s0, s1 = int(self.out_ptr[source]), int(self.out_ptr[source + 1])
+        t0, t1 = int(self.in_ptr[target]), int(self.in_ptr[target + 1])
+        _, i, j = np.intersect1d(self.out_hubs[s0:s1], self.in_hubs[t0:t1], assume_unique=True, return_indices=True)
+        if len(i) == 0:
+            return math.inf
+        return float(np.min(self.out_dist[s0:s1][i].astype(np.float64) + self.in_dist[t0:t1][j]))
+
+    def distances(self, sources, targets):
+        """Distances for many (source, target) node pairs at once; inf where unreachable.
+
+        Pairs are grouped by source, PAIR_SOURCES sources at a time: as in
+        matrix(), their out-labels are scattered into a dense table (one row
+        per source, one column per hub), after which every pair is a gather of
+        its target's in-label from its source's row and a minimum.
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        result = np.full(len(sources), np.inf)
+        by_source = np.argsort(sources, kind="stable")
+        sorted_sources = sources[by_source]
+        group_start = np.flatnonzero(np.concatenate([[True], sorted_sources[1:] != sorted_sources[:-1]]))
+        column_of = np.zeros(self.num_hubs, dtype=np.int64)  # hub -> table column; 0 is the all-inf column
+        start = 0
+        while start < len(sources):
+            # At most PAIR_SOURCES sources and QUERY_CHUNK pairs per step
+            group = int(np.searchsorted(group_start, start, side="right")) - 1 + PAIR_SOURCES
+            end = min(start + QUERY_CHUNK, int(group_start[group]) if group < len(group_start) else len(sources))
+            pairs = by_source[start:end]
+            nodes, row = np.unique(sorted_sources[start:end], return_inverse=True)
+
+            index, counts = self._entries(self.out_ptr, nodes)
+            hubs, column = np.unique(self.out_hubs[index], return_inverse=True)
+            width = len(hubs) + 1
+            table = np.full(len(nodes) * width, np.inf, dtype=np.float32)
+            table[np.repeat(np.arange(len(nodes)) * width, counts) + column + 1] = self.out_dist[index]
+            column_of[hubs] = np.arange(1, width)
+
+            index, counts = self._entries(self.in_ptr, targets[pairs])
+            position = column_of[self.in_hubs[index]]
+            position += np.repeat(row.reshape(-1) * width, counts)
+            totals = table[position]
+            totals += self.in_dist[index]
+            column_of[hubs] = 0
+            labelled = counts > 0
+            result[pairs[labelled]] = np.minimum.reduceat(totals, (np.cumsum(counts) - counts)[labelled])
+            start = end
+        return result
+
+    def matrix(self, sources, targets):
+        """len(sources) x len(targets) distance matrix (inf where unreachable).
+
+        Targets are taken MATRIX_CHUNK at a time: their in-labels are scattered
+        into a dense hub x target table, after which each source's row is one
+        vectorized minimum over the table rows of its own hubs.
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        result = np.full((len(sources), len(targets)), np.inf)
+        pair_s, hub_s, dist_s = self._gather(self.out_ptr, self.out_hubs, self.out_dist, sources)
+        source_ptr = np.searchsorted(pair_s, np.arange(len(sources) + 1))
+        for start in range(0, len(targets), MATRIX_CHUNK):
+            column, hub_t, dist_t = self._gather(self.in_ptr, self.in_hubs, self.in_dist,
+                                                 targets[start:start + MATRIX_CHUNK])
+            hubs, row = np.unique(hub_t, return_inverse=True)
+            table = np.full((len(hubs), min(MATRIX_CHUNK, len(targets) - start)), np.inf, dtype=np.float32)
+            table[row, column] = dist_t
+            # Source hubs that no target in the chunk shares can be skipped
+            found = np.minimum(np.searchsorted(hubs, hub_s), max(len(hubs) - 1, 0))
+            shared = hubs[found] == hub_s if len(hubs) else np.zeros(len(hub_s), dtype=bool)
+            for i in range(len(sources)):
+                s0, s1 = source_ptr[i], source_ptr[i + 1]
+                keep = shared[s0:s1]
+                if keep.any():
+                    rows = table[found[s0:s1][keep]] + dist_s[s0:s1][keep][:, None]
+                    result[i, start:start + table.shape[1]] = rows.min(axis=0)
+        return result
+
+    @staticmethod
+    def _entries(ptr, nodes):
+        """Positions of the label entries of `nodes`, concatenated, and each node's entry count."""
+        starts, counts = ptr[nodes], ptr[nodes + 1] - ptr[nodes]
+        ends = np.cumsum(counts)
+        index = np.arange(int(ends[-1]) if len(ends) else 0, dtype=np.int64)
+        index += np.repeat(starts - (ends - counts), counts)
+        return index, counts
+
+    @staticmethod
+    def _gather(ptr, hubs, dists, nodes):
+        """Concatenated labels of `nodes` with the position of the node each entry belongs to."""
+        index, counts = HubLabels._entries(ptr, nodes)
+        pair = np.repeat(np.arange(len(nodes), dtype=np.int64), counts)
+        return pair, hubs[index].astype(np.int64), dists[index]
+
+
+def label_dir(graph_dir, metric):
+    """Where the labels for one metric of a published generation live."""
+    return os.path.join(graph_dir, f"hub_labels_{metric}")
+
+
+if __name__ == "__main__":
+    import SharedGraph
+
+    parser = argparse.ArgumentParser(description="Build hub labels for the published graph, or benchmark them.")
+    parser.add_argument("--store", default=os.environ.get("ROUTE_GRAPH_STORE", SharedGraph.DEFAULT_ROOT))
+    parser.add_argument("--metric", default="distance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="label the current generation and save next to it")
+    bench_parser = sub.add_parser("bench", help="time batch distance queries and check a sample against Dijkstra")
+    bench_parser.add_argument("--pairs", type=int, default=1000000)
+    bench_parser.add_argument("--check", type=int, default=100)
+    args = parser.parse_args()
+
+    store = SharedGraph.GraphStore(args.store)
+    generation = store.current_generation()
+    if generation is None:
+        raise SystemExit(f"No graph published in {args.store}; run SharedGraph.py publish first.")
+    graph = store.attach(generation)
+    path = label_dir(store.generation_dir(generation), args.metric)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        labels = HubLabels.build(graph, args.metric)
+        labels.save(path)
+        entries = len(labels.out_hubs) + len(labels.in_hubs)
+        print(f"Labelled {graph.num_nodes} nodes in {time.perf_counter() - start:.1f}s: "
+              f"{entries / max(graph.num_nodes, 1) / 2:.1f} hubs per label, {labels.nbytes / 1024 ** 2:.1f} MB")
+    else:
+        labels = HubLabels.load(path)
+        rng = np.random.default_rng(1)
+        sources = rng.integers(graph.num_nodes, size=args.pairs)
+        targets = rng.integers(graph.num_nodes, size=args.pairs)
+        start = time.perf_counter()
+        result = labels.distances(sources, targets)
+        elapsed = time.perf_counter() - start
+        print(f"{args.pairs} random pairs in {elapsed:.2f}s ({args.pairs / elapsed:,.0f}/s)")
+        side = max(1, int(math.sqrt(args.pairs)))
+        start = time.perf_counter()
+        labels.matrix(sources[:side], targets[:side])
+        elapsed = time.perf_counter() - start
+        print(f"{side}x{side} matrix in {elapsed:.2f}s ({side * side / elapsed:,.0f}/s)")
+
+        mismatches = 0
+        for i in random.Random(1).sample(range(args.pairs), min(args.check, args.pairs)):
+            dist, _ = RoutingGraph.one_to_many(graph, int(sources[i]), [int(targets[i])], args.metric)
+            expected = dist.get(int(targets[i]), math.inf)
+            mismatches += not math.isclose(expected, result[i], rel_tol=1e-6, abs_tol=1e-3)
+        print(f"mismatches against Dijkstra: {mismatches}")
@@ -0,0 +1,304 @@
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+import CostModel
+import RoutingGraph
+import SharedGraph
+import SpatialIndex
+
+# GPS noise (standard deviation, meters) for the emission probability
+DEFAULT_SIGMA_M = 10.0
+# Scale (meters) of the route-vs-straight-line difference in the transition probability
+DEFAULT_BETA_M = 50.0
+# Candidate edges are searched within this distance of each GPS point
+DEFAULT_RADIUS_M = 50.0
+MAX_CANDIDATES = 8
+# Bounded searches kept between consecutive points
+SEARCH_CACHE_SIZE = 256
+# Streaming commits everything but the newest point once the window reaches this length
+MAX_WINDOW = 64
+
+Candidate = namedtuple("Candidate", "edge fraction distance lon lat")
+
+
+class MapMatcher:
+    """Hidden-Markov map matching (Newson & Krumm) over a RoutingGraph.
+
+    Hidden states are candidate positions on edges near each GPS point.
+    Emission scores follow the GPS distance to the edge; transition scores
+    compare the route length between two candidates with the straight-line
+    distance between the points. Feed points one at a time with `feed`; a
+    matched point is returned as soon as every surviving hypothesis agrees on
+    it (or the window reaches max_window), so long traces need bounded memory.
+    """
+
+    def __init__(self, graph, sigma=DEFAULT_SIGMA_M, beta=DEFAULT_BETA_M, radius=DEFAULT_RADIUS_M,
+                 max_candidates=MAX_CANDIDATES, max_window=MAX_WINDOW, cache_size=SEARCH_CACHE_SIZE):
+        self.graph = graph
+        self.sigma = sigma
+        self.beta = beta
+        self.radius = radius
+        self.max_candidates = max_candidates
+        self.max_window = max_window
+        self.cache_size = cache_size
+        self.index = SpatialIndex.SegmentIndex.for_graph(graph)
+        self.lengths = graph.weights("distance")
+        self.sources = graph.edge_sources()
+        self.targets = graph.targets
+        self.searches = OrderedDict()  # node -> (bound, dist, parent)
+        self.search_hits = 0
+        self.search_misses = 0
+        self._count = 0
+        self._window = []  # steps not committed yet
+        self._anchor = None  # last committed step, for the route to the next one
+
+    # Model
+
+    def candidates(self, lon, lat):
+        edges, distances, fractions = self.index.query(lon, lat, self.radius)
+        edges, distances, fractions = (a[:self.max_candidates] for a in (edges, distances, fractions))
+        return [Candidate(e, t, d, *self.index.point_at(e, t))
+                for e, t, d in zip(edges.tolist(), fractions.tolist(), distances.tolist())]
+
+    def emission(self, candidates):
+        distances = np.array([c.distance for c in candidates])
+        return -0.5 * (distances / self.sigma) ** 2
+
+    def search(self, node, bound):
+        """Distances (and parents) from node up to `bound` meters, cached between points."""
+        cached = self.searches.get(node)
+        if cached is not None and cached[0] >= bound:
+            self.searches.move_to_end(node)
+            self.search_hits += 1
+            return cached[1], cached[2]
+        self.search_misses += 1
+        dist, parent = RoutingGraph.one_to_many(self.graph, node, None, "distance", max_cost=bound)
+        self.searches[node] = (bound, dist, parent)
+        self.searches.move_to_end(node)
+        if len(self.searches) > self.cache_size:
+            self.searches.popitem(last=False)
+        return dist, parent
+
+    def route_length(self, a, b, bound):
+        """Driving distance from candidate a to candidate b, or None beyond bound."""
+        if a.edge == b.edge and b.fraction >= a.fraction:
+            return (b.fraction - a.fraction) * float(self.lengths[a.edge])
+        dist, _ = self.search(int(self.targets[a.edge]), bound)
+        between = dist.get(int(self.sources[b.edge]))
+        if between is None:
+            return None
+        return (1 - a.fraction) * float(self.lengths[a.edge]) + between + b.fraction * float(self.lengths[b.edge])
+
+    def route_nodes(self, a, b, bound):
+        """Graph nodes driven through from candidate a to candidate b."""
+        if a.edge == b.edge and b.fraction >= a.fraction:
+            return []
+        _, parent = self.search(int(self.targets[a.edge]), bound)
+        return RoutingGraph.path_to(parent, int(self.sources[b.edge]))
+
+    def transition_bound(self, straight):
+        # Routes much longer than the straight line are too unlikely to matter
+        return 2 * straight + 2 * self.radius
+
+    # Streaming
+
+    def feed(self, lon, lat):
+        """Add the next GPS point; returns the matched points that became final (maybe none)."""
+        index = self._count
+        self._count += 1
+        candidates = self.candidates(lon, lat)
+        if not candidates:
+            # Outliers are reported unmatched and do not break the trace
+            self._window.append({"index": index, "lon": lon, "lat": lat, "candidates": []})
+            return self._commit_if_idle()
+
+        emission = self.emission(candidates)
+        previous = self._last_step()
+        step = {"index": index, "lon": lon, "lat": lat, "candidates": candidates, "break": previous is None}
+        if previous is not None:
+            straight = float(CostModel.ellipsoidal_m(previous["lon"], previous["lat"], lon, lat))
+            bound = self.transition_bound(straight)
+            scores = np.full((len(previous["candidates"]), len(candidates)), -np.inf)
+            for i, a in enumerate(previous["candidates"]):
+                if previous["score"][i] == -np.inf:
+                    continue
+                for j, b in enumerate(candidates):
+                    route = self.route_length(a, b, bound)
+                    if route is not None:
+                        scores[i, j] = previous["score"][i] - abs(route - straight) / self.beta
+            step["back"] = scores.argmax(axis=0)
+            step["score"] = scores.max(axis=0) + emission
+            step["bound"] = bound
+
+        if previous is None or not np.isfinite(step["score"]).any():
+            # No candidate pair is connected: finish the current piece and start a new one
+            committed = self._commit(len(self._window)) if previous is not None else []
+            step.update({"break": True, "back": None, "score": emission, "bound": None})
+            self._window.append(step)
+            return committed + self._commit_converged()
+
+        step["score"] = step["score"] - step["score"].max()
+        self._window.append(step)
+        return self._commit_converged()
+
+    def flush(self):
+        """Commit every pending point (call at the end of a trace)."""
+        return self._commit(len(self._window))
+
+    def _last_step(self):
+        for step in reversed(self._window):
+            if step["candidates"]:
+                return step
+        return None
+
+    def _commit_if_idle(self):
+        # Unmatched points with nothing pending before them can go out straight away
+        if self._last_step() is None:
+            return self._commit(len(self._window))
+        return []
+
+    def _chain(self, end, choice):
+        """Candidate chosen at every window step up to `end`, backtracking from `choice`."""
+        chosen = {}
+        for position in range(end, -1, -1):
+            step = self._window[position]
+            if not step["candidates"]:
+                continue
+            chosen[position] = choice
+            if step["back"] is None:
+                break
+            choice = int(step["back"][choice])
+        return chosen
+
+    def _commit(self, count, choice=None):
+        """Emit the first `count` window steps, following the best hypothesis (or `choice`)."""
+        real = [p for p in range(count) if self._window[p]["candidates"]]
+        chosen = {}
+        if real:
+            end = real[-1]
+            if choice is None:
+                choice = int(np.argmax(self._window[end]["score"]))
+            chosen = self._chain(end, choice)
+
+        results = []
+        for position in range(count):
+            step = self._window[position]
+            if not step["candidates"]:
+                results.append({"index": step["index"], "lon": step["lon"], "lat": step["lat"], "edge": None})
+                continue
+            candidate = step["candidates"][chosen[position]]
+            via = []
+            if self._anchor is not None and not step["break"]:
+                via = self.route_nodes(self._anchor, candidate, step["bound"])
+            results.append({
+                "index": step["index"], "lon": step["lon"], "lat": step["lat"],
+                "edge": candidate.edge, "fraction": candidate.fraction, "matched": [candidate.lat, candidate.lon],
+                "distance_m": candidate.distance, "via": via, "break": step["break"],
+            })
+            self._anchor = candidate
+
+        del self._window[:count]
+        # The next step now follows the committed candidate; drop hypotheses through any other
+        following = next((step for step in self._window if step["candidates"]), None)
+        if following is not None and following["back"] is not None and real:
+            following["score"] = np.where(following["back"] == chosen[real[-1]], following["score"], -np.inf)
+            following["back"] = None
+        return results
+
+    def _commit_converged(self):
+        """Commit the prefix every surviving hypothesis agrees on, or force one when the window is full."""
+        real = [p for p, step in enumerate(self._window) if step["candidates"]]
+        if len(real) < 2:
+            return []
+        alive = set(np.flatnonzero(np.isfinite(self._window[real[-1]]["score"])).tolist())
+        for k in range(len(real) - 1, 0, -1):
+            alive = {int(self._window[real[k]]["back"][c]) for c in alive}
+            if len(alive) == 1:
+                return self._commit(real[k - 1] + 1, choice=alive.pop())
+        if len(real) >= self.max_window:
+            last = self._window[real[-1]]
+            best = int(np.argmax(last["score"]))
+            return self._commit(real[-2] + 1, choice=int(last["back"][best]))
+        return []
+
+    # Whole traces
+
+    def match(self, points):
+        """Match a list of (lon, lat) points; returns (matched points, paths as [[lat, lon], ...])."""
+        results = []
+        for lon, lat in points:
+            results.extend(self.feed(lon, lat))
+        results.extend(self.flush())
+        return results, matched_paths(self.graph, results)
+
+
+def matched_paths(graph, results):
+    """Stitch matched points into [[lat, lon], ...] paths, one per unbroken piece of the trace."""
+    index = SpatialIndex.SegmentIndex.for_graph(graph)
+    paths = []
+    previous = None
+    for result in results:
+        if result["edge"] is None:
+            continue
+        if result["break"] or not paths:
+            paths.append([])
+            previous = None
+        # Follow the roads from the previous matched point, bends included
+        coords = []
+        if result["via"]:
+            if previous is not None:
+                coords.extend(index.inner_points(previous["edge"], previous["fraction"], 1.0))
+            coords.extend(graph.path_coords(result["via"]))
+            coords.extend(index.inner_points(result["edge"], 0.0, result["fraction"]))
+        elif previous is not None and previous["edge"] == result["edge"]:
+            coords.extend(index.inner_points(result["edge"], previous["fraction"], result["fraction"]))
+        paths[-1].extend([lat, lon] for lon, lat in coords)
+        paths[-1].append(result["matched"])
+        previous = result
+    return paths
+
+
+def read_trace(lines):
+    """(lon, lat) points from CSV lines (lon,lat[,...]) or NDJSON lines with lon/lat keys."""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            record = json.loads(line)
+            yield float(record["lon"]), float(record["lat"])
+            continue
+        parts = line.split(",")
+        try:
+            yield float(parts[0]), float(parts[1])
+        except ValueError:
+            continue  # header line
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Map-match a GPS trace, writing NDJSON matched points as they settle.")
+    parser.add_argument("trace", help="CSV (lon,lat) or NDJSON file of GPS points ('-' for stdin)")
+    parser.add_argument("--store", default=os.environ.get("ROUTE_GRAPH_STORE", SharedGraph.DEFAULT_ROOT))
+    parser.add_argument("--sigma", type=float, default=DEFAULT_SIGMA_M)
+    parser.add_argument("--beta", type=float, default=DEFAULT_BETA_M)
+    parser.add_argument("--radius", type=float, default=DEFAULT_RADIUS_M)
+    args = parser.parse_args()
+
+    store = SharedGraph.GraphStore(args.store)
+    generation = store.current_generation()
+    if generation is None:
+        sys.exit(f"No graph published in {args.store}; run SharedGraph.py publish first.")
+    matcher = MapMatcher(store.attach(generation), sigma=args.sigma, beta=args.beta, radius=args.radius)
+
+    trace = sys.stdin if args.trace == "-" else open(args.trace, "r", encoding="utf-8")
+    for lon, lat in read_trace(trace):
+        for result in matcher.feed(lon, lat):
+            print(json.dumps(result))
+    for result in matcher.flush():
+        print(json.dumps(result))
+    print(f"Searches: {matcher.search_misses} run, {matcher.search_hits} reused", file=sys.stderr)
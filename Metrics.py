@@ -0,0 +1,224 @@
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds (Prometheus convention)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Spans recorded by the request currently being served (set by the HTTP middleware)
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+_request_endpoint = contextvars.ContextVar("request_endpoint", default="none")
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _render_sample(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            le = (("le", _format_value(bound)),)
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Holds every metric of the process and renders them in Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUEST_DURATION = REGISTRY.histogram(
+    "routeapi_request_duration_seconds", "HTTP request latency per endpoint.", ("endpoint", "method", "status"))
+STAGE_DURATION = REGISTRY.histogram(
+    "routeapi_stage_duration_seconds", "Latency of each pipeline stage per endpoint.", ("endpoint", "stage"))
+DB_QUERY_DURATION = REGISTRY.histogram(
+    "routeapi_db_query_duration_seconds", "Database query latency.", ("query",))
+GRAPH_NODES = REGISTRY.gauge("routeapi_graph_nodes", "Nodes in the current routing graph.")
+GRAPH_EDGES = REGISTRY.gauge("routeapi_graph_edges", "Edges in the current routing graph.")
+GRAPH_MEMORY = REGISTRY.gauge(
+    "routeapi_graph_memory_bytes", "Bytes of the routing graph arrays (shared between workers).")
+PROCESS_RSS = REGISTRY.gauge("routeapi_process_resident_memory_bytes", "Resident memory of the API process.")
+
+
+def begin_request(endpoint):
+    """Start collecting spans for the current request; returns the span list."""
+    spans = []
+    _request_spans.set(spans)
+    _request_endpoint.set(endpoint)
+    return spans
+
+
+@contextmanager
+def span(stage):
+    """Time one pipeline stage of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_DURATION.observe(elapsed, endpoint=_request_endpoint.get(), stage=stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+@contextmanager
+def db_query(name):
+    """Time one database query; it also shows up as a `db_<name>` span."""
+    start = time.perf_counter()
+    try:
+        with span(f"db_{name}"):
+            yield
+    finally:
+        DB_QUERY_DURATION.observe(time.perf_counter() - start, query=name)
+
+
+def server_timing_header(spans):
+    """Format request spans as a Server-Timing header value."""
+    return ", ".join(f"{stage};dur={elapsed * 1000:.2f}" for stage, elapsed in spans)
+
+
+def record_graph_size(graph):
+    """Update the graph gauges from a RoutingGraph."""
+    GRAPH_NODES.set(graph.num_nodes)
+    GRAPH_EDGES.set(graph.num_edges)
+    GRAPH_MEMORY.set(graph.nbytes)
+
+
+def update_process_memory():
+    """Refresh the RSS gauge from /proc, or from psutil where there is no /proc."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        PROCESS_RSS.set(resident_pages * os.sysconf("SC_PAGE_SIZE"))
+        return
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return
+    PROCESS_RSS.set(psutil.Process(os.getpid()).memory_info().rss)
@@ -0,0 +1,191 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+import ComputePool
+import EdgeSnapping
+import RoutingGraph
+
+# Stops accepted in one trip (the matrix and the heuristics grow quadratically and worse)
+MAX_STOPS = 200
+# Exit nodes searched per scipy Dijkstra call (bounds the rows x nodes distance block)
+SEARCH_CHUNK = 16
+# Stand-in cost of an impossible leg, so the heuristics never meet inf - inf
+UNREACHABLE = 1e15
+# Smallest gain a heuristic move must make (avoids cycling on rounding noise)
+EPSILON = 1e-7
+
+
+# Stop-to-stop costs
+
+def _node_matrix(graph, sources, targets, metric, labels=None):
+    """Node-to-node costs between two node lists, from hub labels or from chunked one-to-many searches."""
+    if labels is not None:
+        return labels.matrix(sources, targets)
+    weights = np.asarray(graph.weights(metric))
+    rows, cols = graph.edge_sources(), np.asarray(graph.targets)
+    # Keep the cheapest of parallel edges (a sparse matrix would add them up)
+    order = np.lexsort((weights, cols, rows))
+    rows, cols, weights = rows[order], cols[order], weights[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    n = graph.num_nodes
+    matrix = csr_matrix((weights[first], (rows[first], cols[first])), shape=(n, n))
+
+    budget = ComputePool.budget()
+    result = np.empty((len(sources), len(targets)))
+    for start in range(0, len(sources), SEARCH_CHUNK):
+        budget.check_deadline()
+        block = dijkstra(matrix, directed=True, indices=sources[start:start + SEARCH_CHUNK])
+        budget.settle(int(np.isfinite(block).sum()))
+        result[start:start + SEARCH_CHUNK] = block[:, targets]
+    return result
+
+
+def snap_matrix(graph, sources, targets, metric="distance", labels=None):
+    """len(sources) x len(targets) route costs between snapped points (inf where unreachable).
+
+    Every source leaves through its segment's end nodes and every target is
+    entered from its segment's start nodes, with the partial edge costs added
+    on either side; points on a shared segment may also be driven between
+    directly.
+    """
+    weights = graph.weights(metric)
+    exits = [EdgeSnapping.source_exits(graph, weights, snap) for snap in sources]
+    entries = [EdgeSnapping.target_entries(graph, weights, snap) for snap in targets]
+    exit_nodes = sorted({node for nodes in exits for node in nodes})
+    entry_nodes = sorted({node for nodes in entries for node in nodes})
+    between = _node_matrix(graph, np.array(exit_nodes, dtype=np.int64), np.array(entry_nodes, dtype=np.int64),
+                           metric, labels)
+    exit_row = {node: i for i, node in enumerate(exit_nodes)}
+    entry_col = {node: i for i, node in enumerate(entry_nodes)}
+
+    costs = np.full((len(sources), len(targets)), np.inf)
+    for i, source in enumerate(sources):
+        for j, target in enumerate(targets):
+            best = EdgeSnapping.along_segment(weights, source, target)
+            for node, leave in exits[i].items():
+                for entry, arrive in entries[j].items():
+                    best = min(best, leave + float(between[exit_row[node], entry_col[entry]]) + arrive)
+            costs[i, j] = best
+    return costs
+
+
+def cost_matrix(graph, snaps, metric="distance", labels=None):
+    """len(snaps) x len(snaps) route costs between snapped stops (inf where unreachable)."""
+    costs = snap_matrix(graph, snaps, snaps, metric, labels)
+    np.fill_diagonal(costs, 0.0)
+    return costs
+
+
+# Stop order heuristics. A tour is a list of matrix indices whose first `lo` and
+# everything from `hi` on are fixed; only seq[lo:hi] is reordered.
+
+def _insert(cost, seq, lo, hi, nodes):
+    """Nearest insertion: add the node closest to the tour, at its cheapest position, until none are left."""
+    remaining = list(nodes)
+    tour = np.array(seq)
+    near = np.minimum(cost[np.ix_(tour, remaining)].min(axis=0), cost[np.ix_(remaining, tour)].min(axis=1))
+    while remaining:
+        pick = int(np.argmin(near))
+        v = remaining.pop(pick)
+        near = np.delete(near, pick)
+        before, after = np.array(seq[lo - 1:hi]), np.array(seq[lo:hi + 1])
+        position = lo + int(np.argmin(cost[before, v] + cost[v, after] - cost[before, after]))
+        seq.insert(position, v)
+        hi += 1
+        if remaining:
+            near = np.minimum(near, np.minimum(cost[v, remaining], cost[remaining, v]))
+    return seq, hi
+
+
+def _two_opt(c, seq, lo, hi):
+    """Reverse the first segment of seq[lo:hi] whose reversal shortens the tour; False when none does.
+
+    Costs need not be symmetric: prefix sums of the tour's cost in both
+    directions price a reversed segment in O(1).
+    """
+    forward, backward = [0.0], [0.0]
+    for a, b in zip(seq, seq[1:]):
+        forward.append(forward[-1] + c[a][b])
+        backward.append(backward[-1] + c[b][a])
+    for i in range(lo, hi - 1):
+        before = seq[i - 1]
+        for j in range(i + 1, hi):
+            after = seq[j + 1]
+            old = c[before][seq[i]] + forward[j] - forward[i] + c[seq[j]][after]
+            new = c[before][seq[j]] + backward[j] - backward[i] + c[seq[i]][after]
+            if new < old - EPSILON:
+                seq[i:j + 1] = seq[i:j + 1][::-1]
+                return True
+    return False
+
+
+def _or_opt(c, seq, lo, hi):
+    """Move the first run of 1-3 stops whose relocation shortens the tour; False when none does."""
+    for length in (1, 2, 3):
+        for i in range(lo, hi - length + 1):
+            first, last = seq[i], seq[i + length - 1]
+            before, after = seq[i - 1], seq[i + length]
+            gain = c[before][first] + c[last][after] - c[before][after]
+            for k in range(lo, hi + 1):
+                # Insert between seq[k - 1] and seq[k], outside the run and its current place
+                if i <= k <= i + length:
+                    continue
+                a, b = seq[k - 1], seq[k]
+                if c[a][first] + c[last][b] - c[a][b] < gain - EPSILON:
+                    run = seq[i:i + length]
+                    del seq[i:i + length]
+                    seq[k - length if k > i else k:k - length if k > i else k] = run
+                    return True
+    return False
+
+
+def optimize_order(costs, fix_start=True, fix_end=False, round_trip=False):
+    """Visiting order of the stops (indices into costs) from nearest insertion refined by 2-opt and Or-opt.
+
+    With fix_start the first stop stays first and with fix_end the last
+    stays last; a round trip starts at the first stop and returns to it
+    (the returning leg is not repeated in the order).
+    An open end is modelled as a free dummy stop, so every case is a tour
+    with fixed ends.
+    """
+    n = len(costs)
+    if n < 2:
+        return list(range(n))
+    cost = np.where(np.isfinite(costs), costs, UNREACHABLE)
+    if round_trip:
+        head, tail, free = [0], [0], range(1, n)
+    else:
+        # Index n: the dummy stop, free to reach and to leave
+        cost = np.pad(cost, ((0, 1), (0, 1)))
+        head = [0] if fix_start else [n]
+        tail = [n - 1] if fix_end else [n]
+        free = [i for i in range(n) if i not in head + tail]
+
+    seq, hi = _insert(cost, head + tail, len(head), len(head), free)
+    lo, c = len(head), cost.tolist()
+    while _two_opt(c, seq, lo, hi) or _or_opt(c, seq, lo, hi):
+        pass
+    return [stop for stop in (seq[:-1] if round_trip else seq) if stop < n]
+
+
+# Stitched route
+
+def route(graph, snaps, order, metric="distance", router=None):
+    """Legs along `order` (a list of indices into snaps), each routed between its two stops.
+
+    Returns (legs, coords): legs as [(from, to, cost), ...] and the stitched
+    [[lon, lat], ...] of the whole trip. Raises RoutingGraph.NoPathError
+    when a leg cannot be driven.
+    """
+    legs, coords = [], []
+    for a, b in zip(order, order[1:]):
+        try:
+            cost, leg = EdgeSnapping.shortest_path(graph, snaps[a], snaps[b], metric, router)
+        except RoutingGraph.NoPathError:
+            raise RoutingGraph.NoPathError(f"No path from stop {a} to stop {b}.")
+        legs.append((a, b, cost))
+        # Consecutive legs share the stop between them
+        coords.extend(leg[1:] if coords else leg)
+    return legs, coords
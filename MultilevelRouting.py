@@ -0,0 +1,401 @@
+import argparse
+import heapq
+import math
+import os
+import random
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+import ComputePool
+import RoutingGraph
+import SpatialIndex
+
+# Maximum nodes per cell, lowest level first; levels with a single cell are dropped
+DEFAULT_CELL_SIZES = (256, 4096, 65536)
+
+
+# Partition (metric-independent, done once per graph)
+
+def _bisect(xy, nodes, max_size):
+    """Split `nodes` by recursive coordinate bisection into groups of at most max_size."""
+    groups = []
+    stack = [nodes]
+    while stack:
+        group = stack.pop()
+        if len(group) <= max_size:
+            groups.append(group)
+            continue
+        points = xy[group]
+        axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        half = len(group) // 2
+        order = np.argpartition(points[:, axis], half)
+        # Pushed in reverse so groups come out in spatial order
+        stack.append(group[order[half:]])
+        stack.append(group[order[:half]])
+    return groups
+
+
+def build_partition(graph, cell_sizes=DEFAULT_CELL_SIZES):
+    """Nested multilevel partition and its boundary structure, as flat arrays.
+
+    Level 1 cells hold at most cell_sizes[0] nodes and every level-l cell is a
+    union of level l-1 cells. An edge's cut level is the highest level at which
+    its endpoints are in different cells; a level-l boundary node touches an
+    edge cut at level l or above. Returns (arrays, meta).
+    """
+    n = graph.num_nodes
+    coords = np.asarray(graph.coords)
+    projection = SpatialIndex.LocalProjection(*coords.mean(axis=0)) if n else SpatialIndex.LocalProjection(0, 0)
+    xy = np.column_stack(projection.project(coords[:, 0], coords[:, 1])) if n else np.empty((0, 2))
+
+    # Top-down, so every level refines the one above it
+    sizes = [size for size in cell_sizes if size < n] or [max(n, 1)]
+    cells = np.zeros((len(sizes), n), dtype=np.int32)
+    groups = [np.arange(n)]
+    for level in reversed(range(len(sizes))):
+        groups = [part for group in groups for part in _bisect(xy, group, sizes[level])]
+        for cell, group in enumerate(groups):
+            cells[level, group] = cell
+
+    sources, targets = graph.edge_sources(), np.asarray(graph.targets)
+    cut_level = (cells[:, sources] != cells[:, targets]).sum(axis=0).astype(np.int8)
+
+    arrays = {"crp_cell": cells, "crp_cut_level": cut_level}
+    positions = np.full((len(sizes), n), -1, dtype=np.int32)
+    for level in range(1, len(sizes) + 1):
+        cut = cut_level >= level
+        boundary = np.unique(np.concatenate([sources[cut], targets[cut]]))
+        boundary = boundary[np.argsort(cells[level - 1, boundary], kind="stable")]
+        counts = np.bincount(cells[level - 1, boundary], minlength=int(cells[level - 1].max()) + 1 if n else 0)
+        ptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        positions[level - 1, boundary] = np.arange(len(boundary)) - np.repeat(ptr[:-1], counts)
+        arrays[f"crp_bnd_ptr_{level}"] = ptr
+        arrays[f"crp_bnd_nodes_{level}"] = boundary.astype(np.int32)
+        arrays[f"crp_clique_ptr_{level}"] = np.concatenate([[0], np.cumsum(counts.astype(np.int64) ** 2)])
+    arrays["crp_bnd_pos"] = positions
+    return arrays, {"levels": len(sizes), "cell_sizes": sizes, "metrics": []}
+
+
+# Customization (per metric, repeated whenever weights change)
+
+def _cell_clique(size, rows, cols, weights, entries):
+    """Shortest distances between `entries` inside one cell, flattened row by row."""
+    if len(entries) == 0:
+        return np.empty(0)
+    # Keep the cheapest of parallel edges (a sparse matrix would add them up)
+    order = np.lexsort((weights, cols, rows))
+    rows, cols, weights = rows[order], cols[order], weights[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    matrix = csr_matrix((weights[first], (rows[first], cols[first])), shape=(size, size))
+    distances = dijkstra(matrix, directed=True, indices=entries)
+    return distances[:, entries].ravel()
+
+
+def _cell_cliques(tasks):
+    return [_cell_clique(*task) for task in tasks]
+
+
+def _level_tasks(graph, partition, weights, level, cliques):
+    """One clique computation per cell of `level`, each on a small local graph.
+
+    Level 1 cells use their original edges; higher levels use the boundary
+    nodes of their subcells, connected by the subcells' cliques and by the
+    original edges cut exactly one level below.
+    """
+    arrays = partition
+    cells = arrays["crp_cell"]
+    cut_level = arrays["crp_cut_level"]
+    sources, targets = graph.edge_sources(), np.asarray(graph.targets)
+    cell_of = cells[level - 1]
+    num_cells = len(arrays[f"crp_bnd_ptr_{level}"]) - 1
+
+    if level == 1:
+        vertices = np.arange(graph.num_nodes)
+        inner = np.flatnonzero(cut_level == 0)
+        edge_rows, edge_cols, edge_weights = sources[inner], targets[inner], np.asarray(weights)[inner]
+    else:
+        below = level - 1
+        vertices = arrays[f"crp_bnd_nodes_{below}"].astype(np.int64)
+        inner = np.flatnonzero(cut_level == below)
+        rows, cols, values = [sources[inner]], [targets[inner]], [np.asarray(weights)[inner]]
+        # Clique entries of every subcell, expanded to (from node, to node, cost)
+        ptr = arrays[f"crp_bnd_ptr_{below}"]
+        counts = np.diff(ptr)
+        for sub in np.flatnonzero(counts):
+            members = vertices[ptr[sub]:ptr[sub + 1]]
+            k = len(members)
+            rows.append(np.repeat(members, k))
+            cols.append(np.tile(members, k))
+            values.append(cliques[below][arrays[f"crp_clique_ptr_{below}"][sub]:][:k * k])
+        edge_rows, edge_cols, edge_weights = np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+        finite = np.isfinite(edge_weights) & (edge_rows != edge_cols)
+        edge_rows, edge_cols, edge_weights = edge_rows[finite], edge_cols[finite], edge_weights[finite]
+
+    # Local vertex ids per cell
+    vertex_cell = cell_of[vertices]
+    order = np.argsort(vertex_cell, kind="stable")
+    vertex_ptr = np.concatenate([[0], np.cumsum(np.bincount(vertex_cell, minlength=num_cells))])
+    local = np.full(graph.num_nodes, -1, dtype=np.int64)
+    local[vertices[order]] = np.arange(len(vertices)) - np.repeat(vertex_ptr[:-1], np.diff(vertex_ptr))
+
+    edge_cell = cell_of[edge_rows]
+    edge_order = np.argsort(edge_cell, kind="stable")
+    edge_ptr = np.concatenate([[0], np.cumsum(np.bincount(edge_cell, minlength=num_cells))])
+    edge_rows, edge_cols, edge_weights = edge_rows[edge_order], edge_cols[edge_order], edge_weights[edge_order]
+
+    boundary_ptr = arrays[f"crp_bnd_ptr_{level}"]
+    boundary = arrays[f"crp_bnd_nodes_{level}"]
+    tasks = []
+    for cell in range(num_cells):
+        e0, e1 = edge_ptr[cell], edge_ptr[cell + 1]
+        tasks.append((int(vertex_ptr[cell + 1] - vertex_ptr[cell]),
+                      local[edge_rows[e0:e1]], local[edge_cols[e0:e1]], edge_weights[e0:e1],
+                      local[boundary[boundary_ptr[cell]:boundary_ptr[cell + 1]]]))
+    return tasks
+
+
+def customize(graph, partition, weights, pool=None):
+    """Clique costs for every level under `weights`: {level: flat float64 array}.
+
+    Cells of one level are independent, so with a process pool they are
+    computed in parallel; only the levels run one after another.
+    """
+    cliques = {}
+    for level in range(1, partition["crp_cell"].shape[0] + 1):
+        tasks = _level_tasks(graph, partition, weights, level, cliques)
+        if pool is None:
+            results = _cell_cliques(tasks)
+        else:
+            chunk = max(1, len(tasks) // (4 * (os.cpu_count() or 1)))
+            batches = [tasks[i:i + chunk] for i in range(0, len(tasks), chunk)]
+            results = [clique for batch in pool.map(_cell_cliques, batches) for clique in batch]
+        cliques[level] = np.concatenate(results) if results else np.empty(0)
+    return cliques
+
+
+def add_overlay(graph, cell_sizes=DEFAULT_CELL_SIZES, pool=None):
+    """Partition the graph and customize every metric, storing the arrays in the graph's snapshot."""
+    arrays, meta = build_partition(graph, cell_sizes)
+    graph.arrays.update(arrays)
+    graph.meta["crp"] = meta
+    for metric in graph.meta["metrics"]:
+        recustomize(graph, metric, pool=pool)
+
+
+def recustomize(graph, metric, weights=None, pool=None):
+    """Re-run customization for one metric (optionally with new edge weights); returns seconds taken."""
+    start = time.perf_counter()
+    if weights is not None:
+        graph.arrays[f"weight_{metric}"] = np.ascontiguousarray(weights, dtype=np.float64)
+    partition = {name: array for name, array in graph.arrays.items() if name.startswith("crp_")}
+    for level, clique in customize(graph, partition, graph.weights(metric), pool).items():
+        graph.arrays[f"crp_clique_{metric}_{level}"] = clique
+    if metric not in graph.meta["crp"]["metrics"]:
+        graph.meta["crp"]["metrics"].append(metric)
+    graph._cache.pop(f"crp_router_{metric}", None)
+    return time.perf_counter() - start
+
+
+# Queries
+
+class MultilevelRouter:
+    """Dijkstra on the overlay: full detail near the endpoints, cell cliques everywhere else."""
+
+    def __init__(self, graph, metric="distance"):
+        if metric not in graph.meta.get("crp", {}).get("metrics", []):
+            raise ValueError(f"The routing graph has no overlay for metric {metric!r}.")
+        self.graph = graph
+        self.metric = metric
+        self.weights = graph.weights(metric)
+        self.levels = graph.meta["crp"]["levels"]
+        self.cells = graph.arrays["crp_cell"]
+        self.cut_level = graph.arrays["crp_cut_level"]
+        self.positions = graph.arrays["crp_bnd_pos"]
+        self.boundary_ptr = [None] + [graph.arrays[f"crp_bnd_ptr_{l}"] for l in range(1, self.levels + 1)]
+        self.boundary = [None] + [graph.arrays[f"crp_bnd_nodes_{l}"] for l in range(1, self.levels + 1)]
+        self.clique_ptr = [None] + [graph.arrays[f"crp_clique_ptr_{l}"] for l in range(1, self.levels + 1)]
+        self.cliques = [None] + [graph.arrays[f"crp_clique_{metric}_{l}"] for l in range(1, self.levels + 1)]
+        # Cliques of cells with a road closure are out of date; such cells are searched in full detail
+        self.closed_cells = [set() for _ in range(self.levels)]
+        if graph.closures:
+            ends = np.concatenate([graph.edge_sources()[graph.closures.edges], graph.targets[graph.closures.edges]])
+            self.closed_cells = [set(np.unique(self.cells[level, ends]).tolist()) for level in range(self.levels)]
+
+    @classmethod
+    def for_graph(cls, graph, metric):
+        """Router for the graph's overlay, or None when the snapshot has none for this metric."""
+        if graph.closures is not None:
+            # A view with closures: a router of its own (cheap, it only holds array references)
+            if metric not in graph.meta.get("crp", {}).get("metrics", []):
+                return None
+            return cls(graph, metric)
+        key = f"crp_router_{metric}"
+        if key not in graph._cache:
+            has_overlay = metric in graph.meta.get("crp", {}).get("metrics", [])
+            graph._cache[key] = cls(graph, metric) if has_overlay else None
+        return graph._cache[key]
+
+    def _query_level(self, node, near):
+        # Highest level whose cell holds no endpoint; cells are nested so count from the bottom
+        level = 0
+        while level < self.levels and int(self.cells[level, node]) not in near[level]:
+            level += 1
+        return level
+
+    def shortest_path_between(self, sources, targets):
+        """Same contract as RoutingGraph.shortest_path_between, searched on the overlay."""
+        indptr, edge_targets, weights = self.graph.indptr, self.graph.targets, self.weights
+        ends = list(sources) + list(targets)
+        near = [{int(self.cells[level, node]) for node in ends} | self.closed_cells[level]
+                for level in range(self.levels)]
+        settle = ComputePool.budget().settle
+
+        dist, parent, via_level = {}, {}, {}
+        heap = []
+        for node, cost in sources.items():
+            if cost < dist.get(node, math.inf):
+                dist[node], parent[node], via_level[node] = cost, -1, 0
+                heapq.heappush(heap, (cost, node))
+
+        best, best_node = math.inf, -1
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if d >= best:
+                break
+            settle()
+            if u in targets and d + targets[u] < best:
+                best, best_node = d + targets[u], u
+
+            level = self._query_level(u, near)
+            arcs = []
+            start, end = int(indptr[u]), int(indptr[u + 1])
+            if level == 0:
+                arcs.append((edge_targets[start:end].tolist(), weights[start:end].tolist(), 0))
+            else:
+                # Edges leaving u's level cell, then the clique row inside it
+                cut = np.flatnonzero(self.cut_level[start:end] >= level) + start
+                arcs.append((edge_targets[cut].tolist(), weights[cut].tolist(), 0))
+                # A clique already holds the best way across the cell, so only nodes
+                # entered over a cut edge need their row
+                if via_level[u] != level:
+                    cell = int(self.cells[level - 1, u])
+                    b0, b1 = int(self.boundary_ptr[level][cell]), int(self.boundary_ptr[level][cell + 1])
+                    k = b1 - b0
+                    row = int(self.clique_ptr[level][cell]) + int(self.positions[level - 1, u]) * k
+                    arcs.append((self.boundary[level][b0:b1].tolist(), self.cliques[level][row:row + k].tolist(),
+                                 level))
+
+            for heads, costs, arc_level in arcs:
+                for v, w in zip(heads, costs):
+                    nd = d + w
+                    if nd < dist.get(v, math.inf):
+                        dist[v], parent[v], via_level[v] = nd, u, arc_level
+                        heapq.heappush(heap, (nd, v))
+
+        if best_node < 0:
+            raise RoutingGraph.NoPathError("No path between the given start and end nodes.")
+
+        # Unpack clique arcs into original nodes
+        path = [best_node]
+        node = best_node
+        while parent[node] != -1:
+            previous = parent[node]
+            if via_level[node] == 0:
+                path.append(previous)
+            else:
+                path.extend(reversed(self._cell_path(previous, node, via_level[node])[:-1]))
+            node = previous
+        path.reverse()
+        return best, path
+
+    def _cell_path(self, source, target, level):
+        """Shortest source -> target path staying inside source's level cell (what a clique arc stands for)."""
+        cell = self.cells[level - 1, source]
+        indptr, edge_targets, weights = self.graph.indptr, self.graph.targets, self.weights
+        dist, parent = {source: 0.0}, {source: -1}
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if u == target:
+                break
+            start, end = int(indptr[u]), int(indptr[u + 1])
+            for v, w in zip(edge_targets[start:end].tolist(), weights[start:end].tolist()):
+                if self.cells[level - 1, v] != cell:
+                    continue
+                nd = d + w
+                if nd < dist.get(v, math.inf):
+                    dist[v], parent[v] = nd, u
+                    heapq.heappush(heap, (nd, v))
+        return RoutingGraph.path_to(parent, target)
+
+
+if __name__ == "__main__":
+    import BatchRouting
+    import SharedGraph
+
+    parser = argparse.ArgumentParser(description="Multilevel (CRP) overlay: customize metrics and compare queries.")
+    parser.add_argument("--store", default=os.environ.get("ROUTE_GRAPH_STORE", SharedGraph.DEFAULT_ROOT))
+    parser.add_argument("--workers", type=int, default=1, help="processes used for customization")
+    sub = parser.add_subparsers(dest="command", required=True)
+    customize_parser = sub.add_parser("customize", help="re-customize one metric and publish a new generation")
+    customize_parser.add_argument("--metric", default="time")
+    customize_parser.add_argument("--weights", help=".npy file with one new weight per edge (CSR order)")
+    bench_parser = sub.add_parser("bench", help="time overlay queries against plain Dijkstra")
+    bench_parser.add_argument("--metric", default="distance")
+    bench_parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    store = SharedGraph.GraphStore(args.store)
+    generation = store.current_generation()
+    if generation is None:
+        raise SystemExit(f"No graph published in {args.store}; run SharedGraph.py publish first.")
+    graph = store.attach(generation)
+    if "crp" not in graph.meta:
+        raise SystemExit("This generation has no overlay; republish it with SharedGraph.py publish.")
+
+    if args.command == "customize":
+        # Copy the arrays out of the read-only mapping before changing them
+        graph = RoutingGraph.RoutingGraph({name: np.array(a) for name, a in graph.arrays.items()}, graph.meta)
+        weights = np.load(args.weights) if args.weights else None
+        pool = None
+        if args.workers > 1:
+            pool = BatchRouting.make_pool(args.workers)
+        try:
+            seconds = recustomize(graph, args.metric, weights, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        with store.build_lock():
+            generation = store.publish(graph)
+        print(f"Customized {args.metric!r} in {seconds:.2f}s; published generation {generation}")
+    else:
+        router = MultilevelRouter.for_graph(graph, args.metric)
+        rng = random.Random(1)
+        pairs = [(rng.randrange(graph.num_nodes), rng.randrange(graph.num_nodes)) for _ in range(args.queries)]
+        timings = {"dijkstra": 0.0, "overlay": 0.0}
+        mismatches = 0
+        for s, t in pairs:
+            start = time.perf_counter()
+            try:
+                expected = RoutingGraph.shortest_path(graph, s, t, args.metric)[0]
+            except RoutingGraph.NoPathError:
+                expected = None
+            timings["dijkstra"] += time.perf_counter() - start
+            start = time.perf_counter()
+            try:
+                got = router.shortest_path_between({s: 0.0}, {t: 0.0})[0]
+            except RoutingGraph.NoPathError:
+                got = None
+            timings["overlay"] += time.perf_counter() - start
+            mismatches += (expected is None) != (got is None) or (got is not None and abs(expected - got) > 1e-6)
+        for name, seconds in timings.items():
+            print(f"{name:<9} {seconds / len(pairs) * 1000:8.2f} ms/query")
+        print(f"cost mismatches: {mismatches}")
@@ -0,0 +1,161 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import Metrics
+import SharedGraph
+
+# Points this far (degrees, ~1 km) outside a region's bounding box still route in it
+REGION_MARGIN_DEG = 0.01
+# A lookup that misses re-reads the root (a region may have been published since), at most this often
+REDISCOVER_INTERVAL_S = 1.0
+
+REGION_LOADS = Metrics.REGISTRY.counter(
+    "routeapi_region_loads_total", "Regional graphs attached from their snapshot.", ("region",))
+REGION_EVICTIONS = Metrics.REGISTRY.counter(
+    "routeapi_region_evictions_total", "Regional graphs dropped to stay within the memory budget.", ("region",))
+REGION_RESIDENT_BYTES = Metrics.REGISTRY.gauge(
+    "routeapi_region_resident_bytes", "Bytes of graph arrays held for a region (0 when not loaded).", ("region",))
+REGIONS_RESIDENT_BYTES = Metrics.REGISTRY.gauge(
+    "routeapi_regions_resident_bytes", "Bytes of graph arrays held for all loaded regions.")
+
+
+def grid_bbox(grid):
+    """(min_lon, min_lat, max_lon, max_lat) covered by a graph's node grid (meta["grid"])."""
+    return (grid["min_lon"], grid["min_lat"],
+            grid["min_lon"] + grid["cols"] * grid["cell_size"], grid["min_lat"] + grid["rows"] * grid["cell_size"])
+
+
+def snapshot_bbox(store):
+    """Bounding box of a store's current generation, read from its meta.json alone; None if unpublished."""
+    generation = store.current_generation()
+    if generation is None:
+        return None
+    with open(os.path.join(store.generation_dir(generation), "meta.json"), "r", encoding="utf-8") as f:
+        return grid_bbox(json.load(f)["grid"])
+
+
+class RegionalGraphs:
+    """Routing graphs of several regions, attached on first use and evicted least recently used.
+
+    Every subdirectory of `root` is a SharedGraph.GraphStore holding one
+    region (publish with `SharedGraph.py --store <root>/<region> publish`).
+    Requests pick the region whose bounding box holds all their points; only
+    the regions in use stay attached, and the least recently used ones are
+    dropped once their arrays together exceed `memory_budget` bytes.
+    """
+
+    def __init__(self, root, memory_budget):
+        self.root = root
+        self.memory_budget = memory_budget
+        self.bboxes = {}
+        self.handles = {}
+        self._resident = OrderedDict()  # region -> bytes, least recently used first
+        self._lock = threading.Lock()
+        self.discovered = None  # time.monotonic() of the last discover()
+        self.discover()
+
+    def discover(self):
+        """(Re)read the regions under root and their bounding boxes."""
+        bboxes = {}
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                bbox = snapshot_bbox(SharedGraph.GraphStore(path))
+                if bbox is not None:
+                    bboxes[name] = bbox
+        with self._lock:
+            self.bboxes = bboxes
+            self.discovered = time.monotonic()
+            for name in bboxes:
+                REGION_RESIDENT_BYTES.set(self._resident.get(name, 0), region=name)
+
+    def _rediscover(self):
+        """discover() after a lookup missed, unless it ran within REDISCOVER_INTERVAL_S; True if it ran."""
+        if time.monotonic() - self.discovered < REDISCOVER_INTERVAL_S:
+            return False
+        self.discover()
+        return True
+
+    def region_for(self, points):
+        """Name of the smallest region whose box (plus REGION_MARGIN_DEG) holds every (lon, lat) point.
+
+        Raises ValueError when no single region covers them all.
+        """
+        best = self._smallest_cover(points)
+        if best is None and self._rediscover():
+            best = self._smallest_cover(points)
+        if best is None:
+            raise ValueError("No region covers all of the given points.")
+        return best
+
+    def _smallest_cover(self, points):
+        best, best_area = None, None
+        for name, (min_lon, min_lat, max_lon, max_lat) in self.bboxes.items():
+            if all(min_lon - REGION_MARGIN_DEG <= lon <= max_lon + REGION_MARGIN_DEG
+                   and min_lat - REGION_MARGIN_DEG <= lat <= max_lat + REGION_MARGIN_DEG for lon, lat in points):
+                area = (max_lon - min_lon) * (max_lat - min_lat)
+                if best is None or area < best_area:
+                    best, best_area = name, area
+        return best
+
+    def get(self, region):
+        """The region's current graph, attaching it (and evicting others) as needed."""
+        if region not in self.bboxes:
+            self._rediscover()
+        with self._lock:
+            handle = self.handles.get(region)
+            if handle is None:
+                if region not in self.bboxes:
+                    raise ValueError(f"Unknown region {region!r}.")
+                handle = self.handles[region] = SharedGraph.SharedGraph(
+                    SharedGraph.GraphStore(os.path.join(self.root, region)))
+            generation = handle.generation
+            graph = handle.get()
+            if graph is None:
+                raise ValueError(f"Region {region!r} has no published graph.")
+            if handle.generation != generation:
+                REGION_LOADS.inc(region=region)
+                graph.meta["region"] = region
+                # A new generation may cover a different area
+                self.bboxes[region] = grid_bbox(graph.meta["grid"])
+                self._resident[region] = graph.nbytes
+                REGION_RESIDENT_BYTES.set(graph.nbytes, region=region)
+            self._resident.move_to_end(region)
+            self._evict()
+            return graph
+
+    def graph_for(self, points):
+        """Graph of the region covering every (lon, lat) point."""
+        return self.get(self.region_for(points))
+
+    def generation_dir(self, graph):
+        """Snapshot directory of a graph returned by get()."""
+        store = SharedGraph.GraphStore(os.path.join(self.root, graph.meta["region"]))
+        return store.generation_dir(graph.meta["generation"])
+
+    def _evict(self):
+        # The region just used is last and always stays, even if it alone is over budget
+        while sum(self._resident.values()) > self.memory_budget and len(self._resident) > 1:
+            region = next(iter(self._resident))
+            del self._resident[region]
+            # Requests still holding the graph keep it alive; the mapping goes with the last one
+            del self.handles[region]
+            REGION_EVICTIONS.inc(region=region)
+            REGION_RESIDENT_BYTES.set(0, region=region)
+        REGIONS_RESIDENT_BYTES.set(sum(self._resident.values()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List the regions under a regional graph root.")
+    parser.add_argument("--root", default=os.environ.get("ROUTE_REGIONS_ROOT"),
+                        required="ROUTE_REGIONS_ROOT" not in os.environ)
+    args = parser.parse_args()
+
+    regions = RegionalGraphs(args.root, memory_budget=0)
+    for name, bbox in regions.bboxes.items():
+        store = SharedGraph.GraphStore(os.path.join(args.root, name))
+        print(f"{name}: generation {store.current_generation()}, bbox {', '.join(f'{v:.5f}' for v in bbox)}")
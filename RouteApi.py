@@ -2,14 +2,41 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Match
 import psycopg2
 from psycopg2 import sql
 import geojson
-import networkx as nx
-from scipy.spatial import KDTree
 from pydantic import BaseModel
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import os
+import json
+import math
+import threading
+import time
+import weakref
+from itertools import islice
+from datetime import datetime
+import numpy as np
+import Metrics
+import CostModel
+import RoutingGraph
+import SharedGraph
+import BatchRouting
+import MapMatching
+import EdgeSnapping
+import TimeDependent
+import TurnRouting
+import MultilevelRouting
+import HubLabels
+import SingleFlight
+import ComputePool
+import RegionalGraphs
+import Closures
+import FacilitySearch
+import MultiStop
+import StreamingGeojson
 
 # Database connection parameters
 db_config = {
@@ -20,6 +47,50 @@ db_config = {
     "port": "5432"  # Your database port
 }
 
+# Stand-in for the routes table when set (local runs and load tests without PostGIS): a GeoJSON
+# file holding the routes, with inserted features appended to "<file>.inserted.ndjson"
+ROUTE_DATA_FILE = os.environ.get("ROUTE_DATA_FILE")
+data_file_features = None
+
+# Graph generations are published here and memory-mapped by every worker process
+GRAPH_STORE = SharedGraph.GraphStore(os.environ.get("ROUTE_GRAPH_STORE", SharedGraph.DEFAULT_ROOT))
+shared_graph = SharedGraph.SharedGraph(GRAPH_STORE)
+
+# Several regions instead of the one graph when set: every subdirectory of ROUTE_REGIONS_ROOT is a
+# region's graph store. Regions attach on first use; least recently used ones are dropped once the
+# attached graphs exceed ROUTE_REGION_MEMORY_MB.
+ROUTE_REGIONS_ROOT = os.environ.get("ROUTE_REGIONS_ROOT")
+REGION_MEMORY_BUDGET = int(os.environ.get("ROUTE_REGION_MEMORY_MB", "1024")) * 1024 ** 2
+regional_graphs = RegionalGraphs.RegionalGraphs(ROUTE_REGIONS_ROOT, REGION_MEMORY_BUDGET) if ROUTE_REGIONS_ROOT else None
+
+# Road closures shared by every worker (ROUTE_CLOSURES_DIR, next to the graphs by default); each
+# request routes on a view of the graph whose weights include the closures in force
+closure_store = Closures.ClosureStore(
+    os.environ.get("ROUTE_CLOSURES_DIR", ROUTE_REGIONS_ROOT or GRAPH_STORE.root))
+
+# Facility sets for /facilities/ (ROUTE_FACILITIES_DIR, next to the graphs by default)
+facility_store = FacilitySearch.FacilityStore(
+    os.environ.get("ROUTE_FACILITIES_DIR", ROUTE_REGIONS_ROOT or GRAPH_STORE.root))
+
+# Process pool for /batch-route/, started on first use (ROUTE_BATCH_WORKERS processes)
+BATCH_WORKERS = int(os.environ.get("ROUTE_BATCH_WORKERS", str(os.cpu_count() or 1)))
+batch_pool = None
+# Each batch holds a compute pool slot with its own deadline and settled-node budget (0 disables either);
+# beyond ROUTE_BATCH_CONCURRENT running batches more get 503
+BATCH_DEADLINE_S = float(os.environ.get("ROUTE_BATCH_DEADLINE_S", "600")) or None
+BATCH_MAX_SETTLED = int(os.environ.get("ROUTE_BATCH_MAX_SETTLED", "500000000")) or None
+BATCH_CONCURRENT = int(os.environ.get("ROUTE_BATCH_CONCURRENT", "2"))
+batch_slots = threading.BoundedSemaphore(BATCH_CONCURRENT)
+# Results streamed per compute pool step
+BATCH_STEP = 256
+
+# Bounded pool for CPU-bound request work (ROUTE_COMPUTE_WORKERS, _QUEUE, _DEADLINE_S, _MAX_SETTLED);
+# when it is full requests get 503 with Retry-After instead of queueing without limit
+compute_pool = ComputePool.ComputePool.from_env("route")
+
+# Coalesces identical /shortest-path/ computations that are in flight at the same time
+route_flight = SingleFlight.SingleFlight("shortest_path", compute_pool.run)
+
 # Initialize FastAPI app
 app = FastAPI()
 
@@ -31,6 +102,47 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+# Send a Server-Timing header on every response, or only when the client sends "X-Server-Timing: 1"
+SERVER_TIMING_ALWAYS = os.environ.get("ROUTEAPI_SERVER_TIMING", "0") == "1"
+
+# Per-request latency metrics and stage spans
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    # Label by route template so unknown paths do not create new series
+    endpoint = "unmatched"
+    for route in app.router.routes:
+        if route.matches(request.scope)[0] == Match.FULL:
+            endpoint = route.path
+            break
+
+    spans = Metrics.begin_request(endpoint)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        Metrics.REQUEST_DURATION.observe(time.perf_counter() - start, endpoint=endpoint,
+                                         method=request.method, status=status)
+
+    if spans and (SERVER_TIMING_ALWAYS or request.headers.get("x-server-timing") == "1"):
+        response.headers["Server-Timing"] = Metrics.server_timing_header(spans)
+    return response
+
+# Admission control, deadlines and search budgets of the compute pool
+@app.exception_handler(ComputePool.Saturated)
+async def saturated_handler(request: Request, exc: ComputePool.Saturated):
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+@app.exception_handler(ComputePool.DeadlineExceeded)
+async def deadline_handler(request: Request, exc: ComputePool.DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+@app.exception_handler(ComputePool.BudgetExceeded)
+async def budget_handler(request: Request, exc: ComputePool.BudgetExceeded):
+    return JSONResponse(status_code=422, content={"detail": str(exc)})
+
 # Mount the static files directory
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -50,12 +162,55 @@ class GeoJSONData(BaseModel):
 class ShortestPathRequest(BaseModel):
     source: List[float]  # [longitude, latitude]
     target: List[float]  # [longitude, latitude]
-
-# Load GeoJSON file
+    metric: str = "distance"  # "distance" (meters), "time" (seconds) or "cost" (properties['cost'])
+    departure_time: Optional[str] = None  # "HH:MM" or ISO datetime; routes by time-of-day travel time
+    turn_aware: bool = False  # apply turn restrictions, turn penalties (metric "time") and no U-turns
+    largest_component: bool = False  # snap only onto roads of the largest connected part of the network
+
+class DistanceMatrixRequest(BaseModel):
+    sources: List[List[float]]  # [[longitude, latitude], ...]
+    targets: List[List[float]]  # [[longitude, latitude], ...]
+    metric: str = "distance"
+
+class MapMatchRequest(BaseModel):
+    points: List[List[float]]  # GPS trace as [[longitude, latitude], ...]
+    sigma: float = MapMatching.DEFAULT_SIGMA_M  # GPS noise (meters)
+    radius: float = MapMatching.DEFAULT_RADIUS_M  # candidate search radius (meters)
+
+class ClosureRequest(BaseModel):
+    edges: Optional[List[int]] = None  # edge ids of the current graph, or
+    path: Optional[List[List[float]]] = None  # [[longitude, latitude], ...] along the closed road
+    both_directions: Optional[bool] = None  # default: true for a path, false for edge ids (each is one way)
+    factor: Optional[float] = None  # cost multiplier (>= 1); omitted blocks the road
+    ttl_s: Optional[float] = None  # expires after this many seconds, or
+    expires_at: Optional[str] = None  # ISO datetime
+    reason: str = ""
+    region: Optional[str] = None  # with regional graphs, the region the edge ids refer to
+
+class MultiStopRequest(BaseModel):
+    stops: List[List[float]]  # [[longitude, latitude], ...] in the order given
+    metric: str = "distance"
+    optimize: bool = False  # reorder the stops to shorten the trip
+    fix_start: bool = True  # when optimizing, keep the first stop first
+    fix_end: bool = False  # when optimizing, keep the last stop last
+    round_trip: bool = False  # return to the first stop at the end
+
+class FacilitySetRequest(BaseModel):
+    points: List[List[float]]  # [[longitude, latitude], ...]
+    properties: Optional[List[Dict[str, Any]]] = None  # one object per facility, returned with the results
+
+class NearestFacilitiesRequest(BaseModel):
+    origin: List[float]  # [longitude, latitude]
+    k: int = 5
+    max_cost: Optional[float] = None  # leave out facilities costlier than this to reach
+    metric: str = "distance"
+    paths: bool = False  # include the route to each facility
+
+# Load GeoJSON file: its features one at a time, so a large extract is never held whole
 def load_geojson():
     geojson_path = Path("data/map.geojson")
     with open(geojson_path, "r", encoding="utf-8") as f:
-        return geojson.load(f)
+        yield from StreamingGeojson.iter_features(f)
     
 # Function to convert GeoJSON geometry to WKT
 def geojson_to_wkt(geometry):
@@ -77,8 +232,44 @@ def geojson_to_wkt(geometry):
     else:
         raise ValueError(f"Unsupported geometry type: {geom_type}")
 
+# File-backed routes: the base file is read once per process, inserted features on every fetch
+# (appends are single writes, so worker processes see each other's inserts)
+def fetch_geojson_from_file():
+    global data_file_features
+    if data_file_features is None:
+        with open(ROUTE_DATA_FILE, "r", encoding="utf-8") as f:
+            data_file_features = json.load(f)["features"]
+    return {"type": "FeatureCollection", "features": list(data_file_features) + list(inserted_file_features())}
+
+def inserted_file_features():
+    try:
+        with open(ROUTE_DATA_FILE + ".inserted.ndjson", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    except FileNotFoundError:
+        pass
+
+def insert_geojson_to_file(geojson_data):
+    lines = []
+    for feature in geojson_data['features']:
+        try:
+            # Same validation as the database path
+            geojson_to_wkt(feature['geometry'])
+        except ValueError as e:
+            print(f"Skipping feature due to error: {e}")
+            continue
+        lines.append(json.dumps({"type": "Feature", "properties": feature.get('properties', {}),
+                                 "geometry": feature['geometry']}) + "\n")
+    with open(ROUTE_DATA_FILE + ".inserted.ndjson", "a", encoding="utf-8") as f:
+        f.write("".join(lines))
+    return {"message": "GeoJSON data inserted into the data file."}
+
 # Function to insert GeoJSON data into the database
 def insert_geojson_to_db(geojson_data):
+    if ROUTE_DATA_FILE:
+        with Metrics.db_query("insert_route"):
+            return insert_geojson_to_file(geojson_data)
     try:
         conn = psycopg2.connect(**db_config)
         cursor = conn.cursor()
@@ -91,8 +282,9 @@ def insert_geojson_to_db(geojson_data):
             geometry GEOMETRY(Geometry, 4326)
         );
         """
-        cursor.execute(create_table_query)
-        conn.commit()
+        with Metrics.db_query("create_table"):
+            cursor.execute(create_table_query)
+            conn.commit()
 
         # Insert GeoJSON features into the database
         for feature in geojson_data['features']:
@@ -108,12 +300,14 @@ def insert_geojson_to_db(geojson_data):
                 INSERT INTO routes (properties, geometry)
                 VALUES (%s, ST_GeomFromText(%s, 4326));
                 """)
-                cursor.execute(insert_query, (geojson.dumps(properties), wkt))
+                with Metrics.db_query("insert_route"):
+                    cursor.execute(insert_query, (geojson.dumps(properties), wkt))
 
             except ValueError as e:
                 print(f"Skipping feature due to error: {e}")
 
-        conn.commit()
+        with Metrics.db_query("commit"):
+            conn.commit()
         return {"message": "GeoJSON data inserted into the database."}
 
     except Exception as e:
@@ -126,6 +320,9 @@ def insert_geojson_to_db(geojson_data):
 
 # Function to fetch GeoJSON data from the database
 def fetch_geojson_from_db():
+    if ROUTE_DATA_FILE:
+        with Metrics.db_query("fetch_routes"):
+            return fetch_geojson_from_file()
     try:
         conn = psycopg2.connect(**db_config)
         cursor = conn.cursor()
@@ -135,8 +332,9 @@ def fetch_geojson_from_db():
         SELECT properties, ST_AsGeoJSON(geometry) AS geometry
         FROM routes;
         """
-        cursor.execute(query)
-        rows = cursor.fetchall()
+        with Metrics.db_query("fetch_routes"):
+            cursor.execute(query)
+            rows = cursor.fetchall()
 
         # Convert the fetched data into a GeoJSON-like structure
         features = []
@@ -165,93 +363,393 @@ def fetch_geojson_from_db():
             cursor.close()
             conn.close()
 
-# Function to build a graph from GeoJSON data
-def build_graph_from_geojson(geojson_data):
-    G = nx.Graph()
-
-    for feature in geojson_data['features']:
-        geometry = feature['geometry']
-        properties = feature.get('properties', {})
-
-        if geometry['type'] == 'LineString':
-            coords = geometry['coordinates']
-            for i in range(len(coords) - 1):
-                source = tuple(coords[i])
-                target = tuple(coords[i + 1])
-                cost = properties.get('cost', 1)  # Default cost if not provided
-                G.add_node(source, pos=source)
-                G.add_node(target, pos=target)
-                G.add_edge(source, target, weight=cost)
-
-        elif geometry['type'] == 'Polygon':
-            # Handle Polygon geometry
-            # Extract the exterior ring of the polygon (ignoring holes for simplicity)
-            exterior_ring = geometry['coordinates'][0]
-            for i in range(len(exterior_ring) - 1):
-                source = tuple(exterior_ring[i])
-                target = tuple(exterior_ring[i + 1])
-                cost = properties.get('cost', 1)  # Default cost if not provided
-                
-                # Add nodes with coordinates as IDs
-                G.add_node(source, pos=source)
-                G.add_node(target, pos=target)
-                
-                # Add edge
-                G.add_edge(source, target, weight=cost)
-
-        elif geometry['type'] == 'Point':
-            # Handle Point geometry (optional, if needed)
-            coords = geometry['coordinates']
-            point = tuple(coords)
-            G.add_node(point, pos=point)
-
-    return G
-
-# Function to find the nearest node using a K-D Tree
-def find_nearest_node(kdtree, nodes, target_coords):
-    distance, index = kdtree.query(target_coords)
-    return nodes[index], distance
+# Function to build the routing graph from the routes table
+# Every edge carries all CostModel.METRICS ("distance", "time", "cost") so the
+# metric is picked per query.
+def build_routing_graph():
+    if ROUTE_DATA_FILE:
+        # Streamed straight from the file: memory follows the graph, not the GeoJSON
+        with Metrics.span("build_graph"):
+            return StreamingGeojson.build_graph(ROUTE_DATA_FILE, inserted_file_features())
+    with Metrics.span("fetch_geojson"):
+        geojson_data = fetch_geojson_from_db()
+    with Metrics.span("build_graph"):
+        return RoutingGraph.RoutingGraph.from_geojson(geojson_data)
+
+# Function to get the shared routing graph (built once, then reused by all workers).
+# With regions, the graph of the named region or of the one covering every (lon, lat) point.
+def get_routing_graph(points=None, region=None):
+    if regional_graphs is not None:
+        try:
+            return regional_graphs.get(region) if region else regional_graphs.graph_for(points or [])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    graph = shared_graph.get_or_build(build_routing_graph)
+    Metrics.record_graph_size(graph)
+    return graph
+
+# Graph view with the road closures currently in force
+def with_closures(graph):
+    return graph.with_closures(closure_store.overlay(graph))
+
+# Closure view of a request's graph. Building it, waiting on another worker's build lock and
+# matching closures all block, so handlers run this on the compute pool (with no deadline: a build is no search).
+def closure_graph(points=None, region=None):
+    with Metrics.span("graph"):
+        return with_closures(get_routing_graph(points, region))
+
+# closure_graph of the points plus their snaps onto the nearest road segments (400 when a point has no road)
+def snapped_graph(points, largest_component=False):
+    graph = closure_graph([point[:2] for point in points])
+    with Metrics.span("snap"):
+        try:
+            snaps = [EdgeSnapping.snap(graph, *point[:2], largest_component=largest_component) for point in points]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return graph, snaps
+
+async def prepare(fn, *args):
+    return await compute_pool.run(fn, *args, deadline_s=None, max_settled=None)
+
+# Snapshot directory of a graph from get_routing_graph (worker processes memory-map it)
+def graph_dir_of(graph):
+    if regional_graphs is not None:
+        return regional_graphs.generation_dir(graph)
+    return GRAPH_STORE.generation_dir(graph.meta["generation"])
+
+# Route between two snaps; runs off the event loop, once per set of identical concurrent requests
+def compute_route(graph, source_snap, target_snap, metric, departure, turn_aware):
+    # Use Dijkstra's algorithm to find the shortest path (time-dependent A* with a departure time)
+    with Metrics.span("dijkstra"):
+        if turn_aware:
+            total_cost, shortest_path = TurnRouting.shortest_path(graph, source_snap, target_snap, metric)
+        elif departure is None:
+            # Multilevel overlay when the snapshot has one, plain Dijkstra otherwise
+            router = MultilevelRouting.MultilevelRouter.for_graph(graph, metric)
+            total_cost, shortest_path = EdgeSnapping.shortest_path(graph, source_snap, target_snap, metric, router)
+        else:
+            total_cost, shortest_path = TimeDependent.shortest_path(graph, source_snap, target_snap, departure)
+    with Metrics.span("serialize"):
+        path_coords = [[lat, lon] for lon, lat in shortest_path]
+    result = {
+        "shortest_path": path_coords,
+        "total_cost": total_cost
+    }
+    if departure is not None:
+        result["arrival_time"] = TimeDependent.format_clock(departure + total_cost)
+    return result
+
+# Store new features and publish a new generation; workers switch to it on their next request
+def ingest_geojson(geojson_data):
+    result = insert_geojson_to_db(geojson_data)
+    with Metrics.span("rebuild_graph"):
+        shared_graph.rebuild(build_routing_graph)
+    return result
 
 # API Endpoints
 @app.get("/")
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+# Regional graphs are published per region with SharedGraph.py, never built from ROUTE_DATA_FILE or the database
+def reject_in_regional_mode():
+    if regional_graphs is not None:
+        raise HTTPException(status_code=409, detail="Regions are published with `SharedGraph.py --store "
+                            "<ROUTE_REGIONS_ROOT>/<region> publish`; this server does not build them.")
+
 @app.post("/insert-geojson/")
 async def insert_geojson(geojson_data: GeoJSONData):
-    return insert_geojson_to_db(geojson_data.dict())
+    reject_in_regional_mode()
+    # Rebuilds are not routing searches: no deadline or budget
+    return await compute_pool.run(ingest_geojson, geojson_data.dict(), deadline_s=None, max_settled=None)
+
+# With regions, re-reads ROUTE_REGIONS_ROOT instead; each region switches to a new generation on its own
+@app.post("/reload-graph/")
+async def reload_graph():
+    if regional_graphs is not None:
+        await compute_pool.run(regional_graphs.discover, deadline_s=None, max_settled=None)
+        return {"regions": sorted(regional_graphs.bboxes)}
+    with Metrics.span("rebuild_graph"):
+        graph = await compute_pool.run(shared_graph.rebuild, build_routing_graph, deadline_s=None, max_settled=None)
+    return {"generation": shared_graph.generation, "nodes": graph.num_nodes, "edges": graph.num_edges}
 
 @app.get("/fetch-geojson/")
 async def fetch_geojson():
-    return fetch_geojson_from_db()
+    with Metrics.span("fetch_geojson"):
+        return fetch_geojson_from_db()
+
+@app.get("/metrics")
+async def metrics():
+    Metrics.update_process_memory()
+    return Response(content=Metrics.REGISTRY.render(), media_type=Metrics.PROMETHEUS_CONTENT_TYPE)
 
 @app.post("/shortest-path/")
 async def shortest_path(request: ShortestPathRequest):
-    geojson_data = fetch_geojson_from_db()
-    G = build_graph_from_geojson(geojson_data)
-
-    # Build K-D Tree from graph nodes
-    nodes = list(G.nodes())
-    kdtree = KDTree(nodes)
+    if request.metric not in CostModel.METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric {request.metric!r}; use one of {list(CostModel.METRICS)}.")
+
+    if request.departure_time is not None and request.turn_aware:
+        raise HTTPException(status_code=400, detail="departure_time and turn_aware cannot be combined.")
+    departure = None
+    if request.departure_time is not None:
+        try:
+            departure = TimeDependent.parse_departure(request.departure_time)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid departure_time {request.departure_time!r}.")
+
+    # Snap both points onto the nearest road segments (virtual nodes, the shared graph is untouched)
+    graph, (source_snap, target_snap) = await prepare(snapped_graph, [request.source, request.target],
+                                                      request.largest_component)
+
+    # Identical concurrent requests (same generation, closures, snaps and options) share one computation
+    key = (graph.meta.get("region"), graph.meta.get("generation"), graph.closures and graph.closures.version,
+           request.metric, source_snap.edge, source_snap.fraction, target_snap.edge, target_snap.fraction,
+           departure, request.turn_aware)
+    try:
+        return await route_flight.run(key, compute_route, graph, source_snap, target_snap, request.metric,
+                                      departure, request.turn_aware)
+    except RoutingGraph.NoPathError:
+        raise HTTPException(status_code=404, detail="No path exists between the source and target nodes.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Match a GPS trace onto the road network; each unbroken piece of the trace gives one path
+@app.post("/map-match/")
+async def map_match(request: MapMatchRequest):
+    points = [point[:2] for point in request.points]
+    graph = await prepare(get_routing_graph, points)
+    with Metrics.span("match"):
+        matched_points, paths = await compute_pool.run(match_trace, graph, points, request.sigma, request.radius)
+    return {"matched_points": matched_points, "paths": paths}
+
+def match_trace(graph, points, sigma, radius):
+    return MapMatching.MapMatcher(graph, sigma=sigma, radius=radius).match(points)
+
+# Distances only (no geometry) between every source and every target, snapped onto the nearest road
+# segments as /shortest-path/ snaps them. Uses the generation's hub labels between the segments' end
+# nodes when they have been built (HubLabels.py build), Dijkstra otherwise.
+@app.post("/distances/")
+async def distances(request: DistanceMatrixRequest):
+    if request.metric not in CostModel.METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric {request.metric!r}; use one of {list(CostModel.METRICS)}.")
+    if not request.sources or not request.targets:
+        raise HTTPException(status_code=400, detail="sources and targets must not be empty.")
+
+    graph, snaps = await prepare(snapped_graph, request.sources + request.targets)
+    source_snaps, target_snaps = snaps[:len(request.sources)], snaps[len(request.sources):]
+    with Metrics.span("distances"):
+        matrix = await compute_pool.run(distance_matrix, graph, source_snaps, target_snaps, request.metric)
+    # Unreachable pairs are null
+    return {"distances": [[None if np.isinf(d) else d for d in row] for row in matrix.tolist()]}
+
+def distance_matrix(graph, source_snaps, target_snaps, metric):
+    labels = HubLabels.HubLabels.for_graph(graph, metric, graph_dir_of(graph))
+    return MultiStop.snap_matrix(graph, source_snaps, target_snaps, metric, labels)
+
+# Road closures: block (or slow down by `factor`) edges given by id or by a path along the road,
+# optionally until an expiry. They apply to the next request without rebuilding the graph.
+@app.post("/closures/")
+async def add_closure(request: ClosureRequest):
+    if (request.edges is None) == (request.path is None):
+        raise HTTPException(status_code=400, detail="Give either edges or path.")
+    # Reads the graph, locks the closures file and matches the closure: all blocking
+    return await prepare(create_closure, request)
+
+def create_closure(request):
+    if request.edges is not None:
+        if regional_graphs is not None and not request.region:
+            raise HTTPException(status_code=400, detail="Name the region the edge ids refer to.")
+        graph = get_routing_graph(region=request.region)
+        if not request.edges or not all(0 <= edge < graph.num_edges for edge in request.edges):
+            raise HTTPException(status_code=400, detail=f"Edge ids must be between 0 and {graph.num_edges - 1}.")
+        # Exactly these edges on this generation; the paths stand in for them on later ones
+        paths = [Closures.edge_path(graph, edge) for edge in request.edges]
+        edges, key, both_directions = request.edges, Closures.graph_key(graph), bool(request.both_directions)
+    else:
+        graph = get_routing_graph([point[:2] for point in request.path])
+        paths = [request.path]
+        edges, key, both_directions = None, None, request.both_directions is not False
+
+    expires = None
+    if request.ttl_s is not None:
+        expires = time.time() + request.ttl_s
+    elif request.expires_at is not None:
+        try:
+            expires = datetime.fromisoformat(request.expires_at).timestamp()
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid expires_at {request.expires_at!r}.")
+    try:
+        closure = closure_store.add(paths, not both_directions, request.factor, expires, request.reason, edges, key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {**closure, "closed_edges": closure_store.edges(graph, closure).tolist()}
+
+@app.get("/closures/")
+async def list_closures():
+    return {"closures": closure_store.closures()}
+
+@app.delete("/closures/{closure_id}")
+async def remove_closure(closure_id: int):
+    if not await prepare(closure_store.remove, closure_id):
+        raise HTTPException(status_code=404, detail=f"No closure {closure_id}.")
+    return {"removed": closure_id}
+
+# Trip through several stops: costs between every pair of stops from one-to-many searches, the stop
+# order optionally improved on them, then each leg routed and the legs stitched into one path
+def compute_trip(graph, graph_dir, snaps, metric, optimize, fix_start, fix_end, round_trip):
+    order = list(range(len(snaps)))
+    if optimize:
+        with Metrics.span("matrix"):
+            labels = HubLabels.HubLabels.for_graph(graph, metric, graph_dir)
+            costs = MultiStop.cost_matrix(graph, snaps, metric, labels)
+        with Metrics.span("order"):
+            order = MultiStop.optimize_order(costs, fix_start, fix_end, round_trip)
+    with Metrics.span("dijkstra"):
+        router = MultilevelRouting.MultilevelRouter.for_graph(graph, metric)
+        legs, coords = MultiStop.route(graph, snaps, order + order[:1] if round_trip else order, metric, router)
+    return {
+        "order": order,
+        "legs": [{"from": a, "to": b, "cost": cost} for a, b, cost in legs],
+        "total_cost": sum(cost for _, _, cost in legs),
+        "path": [[lat, lon] for lon, lat in coords],
+    }
+
+@app.post("/multi-stop/")
+async def multi_stop(request: MultiStopRequest):
+    if request.metric not in CostModel.METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric {request.metric!r}; use one of {list(CostModel.METRICS)}.")
+    if not 2 <= len(request.stops) <= MultiStop.MAX_STOPS:
+        raise HTTPException(status_code=400, detail=f"Give between 2 and {MultiStop.MAX_STOPS} stops.")
+
+    graph, snaps = await prepare(snapped_graph, request.stops)
+    try:
+        return await compute_pool.run(compute_trip, graph, graph_dir_of(graph), snaps, request.metric, request.optimize,
+                                      request.fix_start, request.fix_end, request.round_trip)
+    except RoutingGraph.NoPathError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+# Facility sets ("hospitals", "stops", ...) for nearest-by-road queries; saving replaces a set
+@app.put("/facilities/{name}")
+async def save_facilities(name: str, request: FacilitySetRequest):
+    try:
+        facility_store.save(name, request.points, request.properties)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"name": name, "facilities": len(request.points)}
 
-    # Find the nearest nodes
-    source_node, _ = find_nearest_node(kdtree, nodes, request.source)
-    target_node, _ = find_nearest_node(kdtree, nodes, request.target)
+@app.get("/facilities/")
+async def list_facilities():
+    return {"facility_sets": facility_store.names()}
 
-    # Use Dijkstra's algorithm to find the shortest path
+@app.delete("/facilities/{name}")
+async def remove_facilities(name: str):
     try:
-        shortest_path = nx.dijkstra_path(G, source=source_node, target=target_node, weight='weight')
-        total_cost = sum(G[shortest_path[i]][shortest_path[i + 1]]['weight'] for i in range(len(shortest_path)
-                                                                                             - 1))
-        path_coords = [[lon, lat] for lat, lon in shortest_path]
-        return {
-            "shortest_path": path_coords,
-            "total_cost": total_cost
-        }
-    except nx.NetworkXNoPath:
-        raise HTTPException(status_code=404, detail="No path exists between the source and target nodes.")
+        removed = facility_store.remove(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"No facility set {name!r}.")
+    return {"removed": name}
+
+# The k facilities of a set nearest to the origin by road, nearest first: one search that stops
+# once k facilities are reached, however many the set holds
+def nearest_facilities(graph, name, origin, k, metric, max_cost, paths):
+    # Snapped once per set and graph, on the first query after the set is saved
+    with Metrics.span("facilities"):
+        facilities, index = facility_store.load(graph, name)
+    with Metrics.span("dijkstra"):
+        found = FacilitySearch.nearest(graph, index, origin, k, metric, max_cost)
+    results = []
+    for facility, cost, nodes in found:
+        snap = index.snaps[facility]
+        result = {"facility": facility, "location": facilities["points"][facility],
+                  "properties": facilities["properties"][facility], "cost": cost}
+        if paths:
+            result["path"] = [[lat, lon] for lon, lat in EdgeSnapping.route_coords(graph, origin, snap, nodes, metric)]
+        results.append(result)
+    return results
+
+@app.post("/facilities/{name}/nearest")
+async def nearest(name: str, request: NearestFacilitiesRequest):
+    if request.metric not in CostModel.METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric {request.metric!r}; use one of {list(CostModel.METRICS)}.")
+    if request.k < 1:
+        raise HTTPException(status_code=400, detail="k must be at least 1.")
+
+    graph, (origin,) = await prepare(snapped_graph, [request.origin])
+
+    max_cost = math.inf if request.max_cost is None else request.max_cost
+    try:
+        results = await compute_pool.run(nearest_facilities, graph, name, origin, request.k, request.metric,
+                                         max_cost, request.paths)
+    except FacilitySearch.UnknownFacilitySet as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"facilities": results}
+
+# Batch routing: the body is NDJSON or CSV OD pairs, the response streams one NDJSON result per pair.
+# With regions the batch names its region (?region=...), since pairs are only parsed while streaming.
+@app.post("/batch-route/")
+async def batch_route(request: Request, metric: str = "distance", paths: bool = False, region: Optional[str] = None):
+    global batch_pool
+    if metric not in CostModel.METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric {metric!r}; use one of {list(CostModel.METRICS)}.")
+    if regional_graphs is not None and not region:
+        raise HTTPException(status_code=400, detail="Name the region of the batch with ?region=...")
+
+    graph = await prepare(closure_graph, None, region)
+    body = await request.body()
+    if BATCH_WORKERS > 1 and batch_pool is None:
+        batch_pool = BatchRouting.make_pool(BATCH_WORKERS)
+
+    # Admitted last, so nothing below can fail and leave the slots held
+    if not batch_slots.acquire(blocking=False):
+        raise ComputePool.Saturated(f"{BATCH_CONCURRENT} batches are already running.", compute_pool.retry_after())
+    try:
+        job = compute_pool.admit(deadline_s=BATCH_DEADLINE_S, max_settled=BATCH_MAX_SETTLED)
+    except ComputePool.Saturated:
+        batch_slots.release()
+        raise
+    # Workers memory-map the same generation this request snapped against
+    results = BatchRouting.route_batch(graph, BatchRouting.parse_pairs(body.splitlines()), metric,
+                                       graph_dir_of(graph), batch_pool, paths)
+    stream = stream_batch(job, results)
+    # A stream dropped before its first chunk never reaches its finally
+    weakref.finalize(stream, release_batch, job)
+    return StreamingResponse(stream, media_type="application/x-ndjson")
+
+def release_batch(job):
+    if not job.closed:
+        job.close()
+        batch_slots.release()
+
+def batch_lines(results):
+    return "".join(json.dumps(result) + "\n" for result in islice(results, BATCH_STEP))
+
+async def stream_batch(job, results):
+    """NDJSON of `results`, computed as steps of the batch's compute pool job.
+
+    The response has started by the time a batch runs out of time or budget,
+    so that ends the stream with an "aborted" line instead of an error status.
+    """
+    try:
+        while True:
+            lines = await job.step(batch_lines, results)
+            if not lines:
+                break
+            yield lines
+    except (ComputePool.DeadlineExceeded, ComputePool.BudgetExceeded) as e:
+        yield json.dumps({"status": "aborted", "error": str(e)}) + "\n"
+    except FileNotFoundError as e:
+        # Generations are leased while batches read them, so only outside interference gets here
+        yield json.dumps({"status": "aborted", "error": f"Graph generation no longer available: {e}"}) + "\n"
+    finally:
+        release_batch(job)
 
 # Run the FastAPI server
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=2000)
\ No newline at end of file
+    # Several workers share one graph through GRAPH_STORE
+    workers = int(os.environ.get("ROUTE_WORKERS", "1"))
+    uvicorn.run("RouteApi:app" if workers > 1 else app, host="127.0.0.1", port=2000, workers=workers)
\ No newline at end of file
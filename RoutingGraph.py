@@ -0,0 +1,420 @@
+import heapq
+import json
+import math
+import os
+
+import numpy as np
+
+import ChainContraction
+import Components
+import ComputePool
+import CostModel
+import SpatialIndex
+import TurnRouting
+import MultilevelRouting
+
+# Aim for this many nodes per cell of the nearest-node grid
+GRID_NODES_PER_CELL = 4
+
+
+class NoPathError(Exception):
+    """Raised when the target cannot be reached from the source."""
+
+
+class RoutingGraph:
+    """Read-only road graph stored as flat NumPy arrays (CSR adjacency).
+
+    Node ids are 0..num_nodes-1 and `coords[i]` is node i's (lon, lat). The
+    outgoing edges of node u are positions indptr[u]:indptr[u + 1] of
+    `targets` and of every weight array, so an edge id is its CSR position.
+    Everything lives in `arrays` so a graph can be saved, memory-mapped and
+    shared between processes as-is. After chain contraction an edge may bend:
+    its inner vertices are geom_coords[geom_ptr[e]:geom_ptr[e + 1]].
+    """
+
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+        self._cache = {}
+        # Closures.Overlay applied by weights(); only set on views made by with_closures
+        self.closures = None
+
+    @property
+    def coords(self):
+        return self.arrays["coords"]
+
+    @property
+    def indptr(self):
+        return self.arrays["indptr"]
+
+    @property
+    def targets(self):
+        return self.arrays["targets"]
+
+    @property
+    def edge_way(self):
+        """Index of the GeoJSON feature each edge came from."""
+        return self.arrays["edge_way"]
+
+    @property
+    def num_nodes(self):
+        return len(self.indptr) - 1
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def weights(self, metric):
+        if metric not in self.meta["metrics"]:
+            raise ValueError(f"Unknown metric {metric!r}; use one of {self.meta['metrics']}")
+        if self.closures is not None:
+            return self.closures.weights(self, metric)
+        return self.arrays[f"weight_{metric}"]
+
+    def with_closures(self, overlay):
+        """View of this graph (same arrays and per-process caches) whose weights include road closures.
+
+        Returns the graph itself when the overlay is None or empty.
+        """
+        if not overlay:
+            return self
+        view = RoutingGraph(self.arrays, self.meta)
+        view._cache = self._cache
+        view.closures = overlay
+        return view
+
+    def edge_sources(self):
+        """Source node of every edge (derived from indptr, cached per process)."""
+        if "edge_sources" not in self._cache:
+            degrees = np.diff(self.indptr)
+            self._cache["edge_sources"] = np.repeat(np.arange(self.num_nodes, dtype=np.int32), degrees)
+        return self._cache["edge_sources"]
+
+    # Edge geometry
+
+    def edge_geometry(self, edge):
+        """Inner (lon, lat) vertices of an edge in travel order; empty for straight edges."""
+        if "geom_ptr" not in self.arrays:
+            return np.empty((0, 2))
+        ptr = self.arrays["geom_ptr"]
+        return self.arrays["geom_coords"][ptr[edge]:ptr[edge + 1]]
+
+    def edge_shapes(self):
+        """Straight pieces of every edge in travel order, cached per process.
+
+        Returns (piece_ptr, start, end): the pieces of edge e are
+        piece_ptr[e]:piece_ptr[e + 1] and start/end are (P, 2) lon/lat arrays.
+        Without chain contraction every edge is a single piece.
+        """
+        if "edge_shapes" not in self._cache:
+            coords = np.asarray(self.coords)
+            first, last = coords[self.edge_sources()], coords[np.asarray(self.targets)]
+            if "geom_ptr" not in self.arrays:
+                shapes = np.arange(self.num_edges + 1, dtype=np.int64), first, last
+            else:
+                inner = np.diff(self.arrays["geom_ptr"])
+                point_ptr = np.concatenate([[0], np.cumsum(inner + 2)])
+                points = np.empty((int(point_ptr[-1]), 2))
+                is_inner = np.ones(len(points), dtype=bool)
+                is_inner[point_ptr[:-1]] = is_inner[point_ptr[1:] - 1] = False
+                points[point_ptr[:-1]], points[point_ptr[1:] - 1] = first, last
+                points[is_inner] = self.arrays["geom_coords"]
+                # Every point but an edge's last starts a piece
+                is_start = np.ones(len(points), dtype=bool)
+                is_start[point_ptr[1:] - 1] = False
+                starts = np.flatnonzero(is_start)
+                piece_ptr = np.concatenate([[0], np.cumsum(inner + 1)]).astype(np.int64)
+                shapes = piece_ptr, points[starts], points[starts + 1]
+            self._cache["edge_shapes"] = shapes
+        return self._cache["edge_shapes"]
+
+    def edge_between(self, u, v, metric="distance"):
+        """Cheapest edge from u to v (a contracted graph may have several), or -1."""
+        start, end = int(self.indptr[u]), int(self.indptr[u + 1])
+        candidates = np.flatnonzero(np.asarray(self.targets[start:end]) == v) + start
+        if len(candidates) == 0:
+            return -1
+        return int(candidates[np.argmin(self.weights(metric)[candidates])])
+
+    def path_coords(self, nodes, metric="distance", edges=None):
+        """[[lon, lat], ...] along a node path, including the inner vertices of every edge used.
+
+        `edges` names the edge taken between each pair of consecutive nodes;
+        by default it is the cheapest one under `metric`.
+        """
+        if "geom_ptr" not in self.arrays:
+            return self.coords[nodes].tolist()
+        if edges is None:
+            edges = [self.edge_between(u, v, metric) for u, v in zip(nodes[:-1], nodes[1:])]
+        coords = self.coords[nodes[:1]].tolist()
+        for edge, v in zip(edges, nodes[1:]):
+            coords.extend(self.edge_geometry(edge).tolist())
+            coords.append(self.coords[v].tolist())
+        return coords
+
+    # Building
+
+    @classmethod
+    def from_segments(cls, src, dst, oneway, weights, way, contract=True):
+        """Build from segment arrays: src/dst are (K, 2) lon/lat, weights maps metric -> (K,) array.
+
+        Endpoints with identical coordinates become one node; two-way segments
+        get an edge in each direction. With `contract`, degree-2 chains are
+        collapsed into single edges (see ChainContraction).
+        """
+        points, inverse = np.unique(np.concatenate([src, dst]), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1).astype(np.int32)
+        u, v = inverse[:len(src)], inverse[len(src):]
+
+        two_way = ~np.asarray(oneway, dtype=bool)
+        sources = np.concatenate([u, v[two_way]])
+        targets = np.concatenate([v, u[two_way]])
+        edge_way = np.concatenate([way, way[two_way]]).astype(np.int32)
+        edge_weights = {m: np.concatenate([w, w[two_way]]) for m, w in weights.items()}
+
+        # Zero-length segments (repeated coordinates) only add self-loops
+        keep = sources != targets
+        order = np.argsort(sources[keep], kind="stable")
+        sources = sources[keep][order]
+
+        arrays = {
+            "coords": np.ascontiguousarray(points, dtype=np.float64),
+            "indptr": np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=len(points)))]).astype(np.int64),
+            "targets": targets[keep][order],
+            "edge_way": edge_way[keep][order],
+        }
+        for metric, values in edge_weights.items():
+            arrays[f"weight_{metric}"] = np.ascontiguousarray(values[keep][order], dtype=np.float64)
+
+        graph = cls(arrays, {"metrics": list(edge_weights)})
+        if contract:
+            graph = ChainContraction.contract(graph)
+        graph.build_indexes()
+        return graph
+
+    def build_indexes(self):
+        """Add the nearest-node grid and the segment index (stored in the snapshot so workers never rebuild them)."""
+        grid_arrays, self.meta["grid"] = build_grid_index(self.arrays["coords"])
+        self.arrays.update(grid_arrays)
+        segment_arrays, self.meta["segments"] = SpatialIndex.build_segment_index(self)
+        self.arrays.update(segment_arrays)
+
+    @classmethod
+    def from_geojson(cls, geojson_data):
+        """Build from the LineStrings (and Polygon exterior rings) of a FeatureCollection."""
+        features = geojson_data['features']
+        src, dst, owner, weights = CostModel.geojson_edge_weights(features)
+        oneway = np.array([(f.get('properties') or {}).get('oneway', 'no') == 'yes' for f in features],
+                          dtype=bool)
+        graph = cls.from_segments(src, dst, oneway[owner], weights, owner)
+        graph.add_speed_profiles(*CostModel.speed_profiles(features))
+        Components.add_component_labels(graph)
+        TurnRouting.add_turn_tables(graph, features)
+        MultilevelRouting.add_overlay(graph)
+        return graph
+
+    def add_speed_profiles(self, profiles, feature_profile):
+        """Attach time-of-day profiles: rows of `profiles` shared by edges via edge_profile."""
+        self.arrays["td_profiles"] = profiles
+        self.arrays["edge_profile"] = np.asarray(feature_profile, dtype=np.int32)[self.edge_way]
+
+    # Persistence
+
+    def save(self, path):
+        """Write every array as an uncompressed .npy file (mmap-able) plus meta.json."""
+        os.makedirs(path, exist_ok=True)
+        for name, array in self.arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({**self.meta, "arrays": sorted(self.arrays)}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load a saved graph; with mmap the arrays are read-only views of the files."""
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in meta.pop("arrays")
+        }
+        return cls(arrays, meta)
+
+    # Spatial lookups
+
+    def nearest_node(self, lon, lat):
+        """Closest node to (lon, lat) in raw degrees, like the old KD-tree; returns (node, distance)."""
+        grid = self.meta["grid"]
+        cell_ptr = self.arrays["grid_cell_ptr"]
+        cell_nodes = self.arrays["grid_nodes"]
+        coords = self.coords
+        size = grid["cell_size"]
+        cx = min(max(int((lon - grid["min_lon"]) / size), 0), grid["cols"] - 1)
+        cy = min(max(int((lat - grid["min_lat"]) / size), 0), grid["rows"] - 1)
+
+        best, best_dist = -1, math.inf
+        for ring in range(max(grid["cols"], grid["rows"])):
+            # Every unvisited cell is at least (ring - 1) cells away from the point
+            if best >= 0 and (ring - 1) * size > best_dist:
+                break
+            for y in range(cy - ring, cy + ring + 1):
+                if y < 0 or y >= grid["rows"]:
+                    continue
+                on_edge = y in (cy - ring, cy + ring)
+                for x in (range(cx - ring, cx + ring + 1) if on_edge else (cx - ring, cx + ring)):
+                    if x < 0 or x >= grid["cols"]:
+                        continue
+                    cell = y * grid["cols"] + x
+                    nodes = cell_nodes[cell_ptr[cell]:cell_ptr[cell + 1]]
+                    if len(nodes) == 0:
+                        continue
+                    d = np.hypot(coords[nodes, 0] - lon, coords[nodes, 1] - lat)
+                    i = int(np.argmin(d))
+                    if d[i] < best_dist:
+                        best, best_dist = int(nodes[i]), float(d[i])
+        if best < 0:
+            raise ValueError("The routing graph has no nodes.")
+        return best, best_dist
+
+
+def build_grid_index(coords):
+    """Uniform grid over node coordinates stored as arrays (cell -> nodes in CSR form)."""
+    n = len(coords)
+    if n == 0:
+        grid = {"min_lon": 0.0, "min_lat": 0.0, "cell_size": 1.0, "cols": 1, "rows": 1}
+        return {"grid_cell_ptr": np.zeros(2, dtype=np.int64), "grid_nodes": np.empty(0, dtype=np.int32)}, grid
+
+    min_lon, min_lat = coords.min(axis=0)
+    max_lon, max_lat = coords.max(axis=0)
+    span = max(max_lon - min_lon, max_lat - min_lat, 1e-9)
+    area = max((max_lon - min_lon) * (max_lat - min_lat), span * span / n)
+    cell_size = max(math.sqrt(area * GRID_NODES_PER_CELL / n), span / 4096)
+    cols = int((max_lon - min_lon) / cell_size) + 1
+    rows = int((max_lat - min_lat) / cell_size) + 1
+
+    cx = np.minimum(((coords[:, 0] - min_lon) / cell_size).astype(np.int64), cols - 1)
+    cy = np.minimum(((coords[:, 1] - min_lat) / cell_size).astype(np.int64), rows - 1)
+    cell = cy * cols + cx
+    order = np.argsort(cell, kind="stable")
+    cell_ptr = np.concatenate([[0], np.cumsum(np.bincount(cell, minlength=cols * rows))]).astype(np.int64)
+
+    grid = {"min_lon": float(min_lon), "min_lat": float(min_lat), "cell_size": float(cell_size),
+            "cols": cols, "rows": rows}
+    return {"grid_cell_ptr": cell_ptr, "grid_nodes": order.astype(np.int32)}, grid
+
+
+def one_to_many(graph, source, targets=None, metric="distance", max_cost=math.inf):
+    """Dijkstra from source until every node in `targets` is settled (or the graph is exhausted).
+
+    `source` is a node, or a dict of start nodes to the cost already spent
+    reaching them (e.g. the part of an edge after a snapped point). With
+    targets=None the search settles everything within max_cost. Returns
+    (dist, parent) dicts covering the nodes reached so far; a target missing
+    from dist is unreachable (or further than max_cost).
+    """
+    indptr = graph.indptr
+    edge_targets = graph.targets
+    weights = graph.weights(metric)
+    remaining = set(targets) if targets is not None else None
+    settle = ComputePool.budget().settle
+
+    starts = source if isinstance(source, dict) else {source: 0.0}
+    dist = dict(starts)
+    parent = dict.fromkeys(starts, -1)
+    heap = [(cost, node) for node, cost in starts.items()]
+    heapq.heapify(heap)
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        if d > max_cost:
+            break
+        settle()
+        if remaining is not None:
+            remaining.discard(u)
+            if not remaining:
+                break
+        start, end = int(indptr[u]), int(indptr[u + 1])
+        for v, w in zip(edge_targets[start:end].tolist(), weights[start:end].tolist()):
+            nd = d + w
+            if nd < dist.get(v, math.inf):
+                dist[v] = nd
+                parent[v] = u
+                heapq.heappush(heap, (nd, v))
+
+    # Tentative labels of unsettled targets are not final; drop them
+    for node in remaining or ():
+        dist.pop(node, None)
+    if max_cost < math.inf:
+        dist = {node: d for node, d in dist.items() if d <= max_cost}
+    return dist, parent
+
+
+def path_to(parent, target):
+    """Node list from the search source to target using a parent map."""
+    path = []
+    node = target
+    while node != -1:
+        path.append(node)
+        node = parent[node]
+    path.reverse()
+    return path
+
+
+def shortest_path_between(graph, sources, targets, metric="distance"):
+    """Dijkstra from several start nodes to several end nodes, each with an extra cost.
+
+    `sources` and `targets` map node -> cost to add at that end (e.g. the part
+    of an edge up to a virtual node). Returns (cost, path) where path runs from
+    the chosen start node to the chosen end node.
+    """
+    indptr = graph.indptr
+    edge_targets = graph.targets
+    weights = graph.weights(metric)
+    settle = ComputePool.budget().settle
+
+    dist = {}
+    parent = {}
+    heap = []
+    for node, cost in sources.items():
+        if cost < dist.get(node, math.inf):
+            dist[node] = cost
+            parent[node] = -1
+            heapq.heappush(heap, (cost, node))
+
+    best, best_node = math.inf, -1
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        # Target costs are non-negative, so nothing popped later can do better
+        if d >= best:
+            break
+        settle()
+        if u in targets and d + targets[u] < best:
+            best, best_node = d + targets[u], u
+        start, end = int(indptr[u]), int(indptr[u + 1])
+        for v, w in zip(edge_targets[start:end].tolist(), weights[start:end].tolist()):
+            nd = d + w
+            if nd < dist.get(v, math.inf):
+                dist[v] = nd
+                parent[v] = u
+                heapq.heappush(heap, (nd, v))
+
+    if best_node < 0:
+        raise NoPathError("No path between the given start and end nodes.")
+    return best, path_to(parent, best_node)
+
+
+def shortest_path(graph, source, target, metric="distance"):
+    """Dijkstra from source to target over the CSR arrays; returns (cost, [node, ...])."""
+    # Different components: fail at once instead of exhausting the source's component
+    if not Components.may_reach(graph, source, target):
+        raise NoPathError(f"No path from node {source} to node {target}.")
+    dist, parent = one_to_many(graph, source, (target,), metric)
+    if target not in dist:
+        raise NoPathError(f"No path from node {source} to node {target}.")
+    return dist[target], path_to(parent, target)
@@ -0,0 +1,117 @@
+import heapq
+import math
+import threading
+
+
+class Workspace:
+    """Per-thread Dijkstra labels that are reset lazily.
+
+    `dist` and `parent` are sized to the graph once; an entry only counts when
+    its `stamp` equals the current `generation`, so starting a new query is a
+    counter increment and a search touches only the nodes it reaches.
+    """
+
+    def __init__(self, num_nodes):
+        self.dist = [math.inf] * num_nodes
+        self.parent = [-1] * num_nodes
+        self.stamp = [0] * num_nodes
+        self.generation = 0
+
+    def begin(self):
+        self.generation += 1
+        return self.generation
+
+
+class SearchEngine:
+    """Point-to-point Dijkstra over an adjacency built once.
+
+    Node ids are mapped to dense indices and the edges stored as CSR lists;
+    each thread gets its own Workspace, so one engine serves concurrent queries.
+    """
+
+    def __init__(self, node_ids, edges):
+        self.node_ids = list(node_ids)
+        self.index = {node: i for i, node in enumerate(self.node_ids)}
+        for source, target, _ in edges:
+            for node in (source, target):
+                if node not in self.index:
+                    self.index[node] = len(self.node_ids)
+                    self.node_ids.append(node)
+
+        counts = [0] * (len(self.node_ids) + 1)
+        for source, _, _ in edges:
+            counts[self.index[source] + 1] += 1
+        for i in range(len(self.node_ids)):
+            counts[i + 1] += counts[i]
+        self.indptr = counts
+        self.targets = [0] * len(edges)
+        self.weights = [0.0] * len(edges)
+        fill = counts[:-1]
+        for source, target, cost in edges:
+            u = self.index[source]
+            self.targets[fill[u]] = self.index[target]
+            self.weights[fill[u]] = float(cost)
+            fill[u] += 1
+        self._local = threading.local()
+
+    @classmethod
+    def from_edges(cls, nodes, edges):
+        """Engine for the (id, name) node and (source, target, cost) edge lists of fetch_graph_data."""
+        return cls((node_id for node_id, _ in nodes), edges)
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    def workspace(self):
+        """The calling thread's Workspace, created on first use."""
+        workspace = getattr(self._local, "workspace", None)
+        if workspace is None:
+            workspace = self._local.workspace = Workspace(self.num_nodes)
+        return workspace
+
+    def shortest_path(self, start, target, stats=None):
+        """Cost and node-id path from start to target; (inf, []) when target cannot be reached.
+
+        Pass a dict as `stats` to get the number of settled nodes back in stats["settled"].
+        """
+        s, t = self.index.get(start), self.index.get(target)
+        if s is None or t is None:
+            return math.inf, []
+        indptr, targets, weights = self.indptr, self.targets, self.weights
+        workspace = self.workspace()
+        dist, parent, stamp = workspace.dist, workspace.parent, workspace.stamp
+        generation = workspace.begin()
+
+        dist[s], parent[s], stamp[s] = 0.0, -1, generation
+        heap = [(0.0, s)]
+        settled = 0
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u == t:
+                break
+            if d > dist[u]:
+                continue
+            settled += 1
+            for e in range(indptr[u], indptr[u + 1]):
+                v = targets[e]
+                nd = d + weights[e]
+                if stamp[v] != generation or nd < dist[v]:
+                    dist[v], parent[v], stamp[v] = nd, u, generation
+                    heapq.heappush(heap, (nd, v))
+
+        if stats is not None:
+            stats["settled"] = stats.get("settled", 0) + settled
+        if stamp[t] != generation:
+            return math.inf, []
+        path = []
+        node = t
+        while node != -1:
+            path.append(self.node_ids[node])
+            node = parent[node]
+        path.reverse()
+        return dist[t], path
@@ -0,0 +1,213 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from RoutingGraph import RoutingGraph
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process build lock (run a single worker)
+    fcntl = None
+
+# tmpfs when available, so published arrays live in shared memory rather than on disk
+DEFAULT_ROOT = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "biit-routing")
+CURRENT_FILE = "CURRENT"
+# Readers hold a shared flock on this file in a generation directory; publish only prunes
+# generations it can lock exclusively, so a directory is never deleted while it is read by path
+LEASE_FILE = "LEASE"
+
+
+def lease(directory):
+    """Shared lock keeping a generation directory from being pruned; released when the file is closed.
+
+    Raises FileNotFoundError when the generation is gone. Returns None
+    without fcntl (Windows), where nothing is pruned while mapped anyway.
+    """
+    if fcntl is None:
+        return None
+    try:
+        f = open(os.path.join(directory, LEASE_FILE), "r")
+    except FileNotFoundError:
+        if os.path.exists(os.path.join(directory, "meta.json")):
+            return None  # published before leases existed
+        raise FileNotFoundError(f"Graph generation {directory} has been removed.") from None
+    # Waits out a prune in progress, after which the directory may be gone
+    fcntl.flock(f, fcntl.LOCK_SH)
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        f.close()
+        raise FileNotFoundError(f"Graph generation {directory} has been removed.")
+    return f
+
+
+def load_generation(directory):
+    """Memory-map a published generation, leased for as long as the graph (or a view of it) is alive."""
+    generation_lease = lease(directory)
+    graph = RoutingGraph.load(directory, mmap=True)
+    # Views made by with_closures share _cache, so they keep the lease too
+    graph._cache["generation_lease"] = generation_lease
+    return graph
+
+
+class GraphStore:
+    """Directory of published graph generations shared by every worker process.
+
+    `publish` writes a graph to a new `gen-<n>` directory and then atomically
+    replaces the CURRENT file with its number; this is the generation handshake.
+    Workers memory-map the arrays read-only, so the pages are shared between
+    processes instead of copied into each one.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def generation_dir(self, generation):
+        """Directory holding a published generation's arrays."""
+        return os.path.join(self.root, f"gen-{generation:06d}")
+
+    def current_generation(self):
+        """Generation named by CURRENT, or None when nothing has been published yet."""
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE), "r", encoding="utf-8") as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _generations(self):
+        generations = []
+        for name in os.listdir(self.root):
+            if name.startswith("gen-") and name[4:].isdigit():
+                generations.append(int(name[4:]))
+        return sorted(generations)
+
+    def _prune(self, generation):
+        """Delete a generation unless a reader holds its lease; True if it is gone."""
+        directory = self.generation_dir(generation)
+        if fcntl is not None:
+            try:
+                f = open(os.path.join(directory, LEASE_FILE), "r")
+            except FileNotFoundError:
+                f = None  # published before leases existed
+            if f is not None:
+                with f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        return False
+                    shutil.rmtree(directory, ignore_errors=True)
+                return True
+        shutil.rmtree(directory, ignore_errors=True)
+        return True
+
+    def publish(self, graph, keep=2):
+        """Store a graph as the next generation and make it current; returns the generation.
+
+        Generations older than the last `keep` are deleted once no reader
+        leases them; those still in use are retried on later publishes.
+        """
+        generations = self._generations()
+        generation = (generations[-1] if generations else 0) + 1
+
+        staging = tempfile.mkdtemp(prefix="staging-", dir=self.root)
+        graph.save(staging)
+        open(os.path.join(staging, LEASE_FILE), "w").close()
+        os.replace(staging, self.generation_dir(generation))
+
+        pointer = os.path.join(self.root, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+        with open(pointer, "w", encoding="utf-8") as f:
+            f.write(str(generation))
+        os.replace(pointer, os.path.join(self.root, CURRENT_FILE))
+
+        for old in generations:
+            if old <= generation - keep:
+                self._prune(old)
+        return generation
+
+    def attach(self, generation):
+        graph = load_generation(self.generation_dir(generation))
+        graph.meta["generation"] = generation
+        return graph
+
+    @contextmanager
+    def build_lock(self):
+        """Cross-process lock so only one worker builds and publishes at a time."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.root, "build.lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SharedGraph:
+    """Per-process handle that follows the store's current generation."""
+
+    def __init__(self, store):
+        self.store = store
+        self.graph = None
+        self.generation = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Current graph, re-attaching when another process published a new generation."""
+        generation = self.store.current_generation()
+        if generation is None:
+            return None
+        if generation != self.generation:
+            with self._lock:
+                if generation != self.generation:
+                    self.graph = self.store.attach(generation)
+                    self.generation = generation
+        return self.graph
+
+    def get_or_build(self, build):
+        """Current graph; if none is published yet, one process calls build() and publishes it."""
+        graph = self.get()
+        if graph is not None:
+            return graph
+        with self.store.build_lock():
+            graph = self.get()
+            if graph is None:
+                self.store.publish(build())
+                graph = self.get()
+        return graph
+
+    def rebuild(self, build):
+        """Publish a freshly built graph; every worker picks it up on its next request."""
+        with self.store.build_lock():
+            self.store.publish(build())
+        return self.get()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish or inspect the shared routing graph.")
+    parser.add_argument("--store", default=os.environ.get("ROUTE_GRAPH_STORE", DEFAULT_ROOT))
+    sub = parser.add_subparsers(dest="command", required=True)
+    publish_parser = sub.add_parser("publish", help="build a graph from a GeoJSON file and make it current")
+    publish_parser.add_argument("geojson")
+    sub.add_parser("info", help="show the current generation")
+    args = parser.parse_args()
+
+    store = GraphStore(args.store)
+    if args.command == "publish":
+        import StreamingGeojson
+
+        graph = StreamingGeojson.build_graph(args.geojson)
+        with store.build_lock():
+            generation = store.publish(graph)
+        print(f"Published generation {generation}: {graph.num_nodes} nodes, {graph.num_edges} edges, "
+              f"{graph.nbytes / 1024 ** 2:.1f} MB")
+    else:
+        generation = store.current_generation()
+        if generation is None:
+            print("Nothing published yet.")
+        else:
+            graph = store.attach(generation)
+            print(f"Generation {generation}: {graph.num_nodes} nodes, {graph.num_edges} edges, "
+                  f"{graph.nbytes / 1024 ** 2:.1f} MB")
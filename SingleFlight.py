@@ -0,0 +1,53 @@
+import asyncio
+
+import Metrics
+
+FLIGHT_REQUESTS = Metrics.REGISTRY.counter(
+    "routeapi_singleflight_requests_total",
+    "Requests that started a computation (leader) or joined one already in flight (coalesced).",
+    ("flight", "role"))
+FLIGHTS_IN_PROGRESS = Metrics.REGISTRY.gauge(
+    "routeapi_singleflight_in_flight", "Distinct computations currently running.", ("flight",))
+
+
+class SingleFlight:
+    """Runs one computation per key at a time and shares its outcome with every concurrent caller.
+
+    Nothing is cached: the key is forgotten as soon as the computation
+    finishes, so a request arriving afterwards computes afresh. The work runs
+    through `runner` (a thread by default, e.g. ComputePool.run to bound it),
+    so the event loop keeps serving meanwhile, and a caller that goes away
+    does not cancel it for the others.
+    """
+
+    def __init__(self, name, runner=asyncio.to_thread):
+        self.name = name
+        self.runner = runner
+        self._flights = {}
+
+    def in_flight(self):
+        return len(self._flights)
+
+    async def run(self, key, fn, *args):
+        """Result of fn(*args), computed once for all concurrent callers with an equal key.
+
+        Exceptions raised by fn reach every caller.
+        """
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.runner(fn, *args))
+            FLIGHT_REQUESTS.inc(flight=self.name, role="leader")
+            self._flights[key] = task
+            FLIGHTS_IN_PROGRESS.set(len(self._flights), flight=self.name)
+            task.add_done_callback(lambda done: self._land(key, done))
+        else:
+            FLIGHT_REQUESTS.inc(flight=self.name, role="coalesced")
+        return await asyncio.shield(task)
+
+    def _land(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        FLIGHTS_IN_PROGRESS.set(len(self._flights), flight=self.name)
+        # Retrieve the exception even when every caller left, so asyncio does not log it as lost
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,215 @@
+import math
+
+import numpy as np
+
+import CostModel
+
+# Aim for this many segments per cell of the segment grid
+SEGMENTS_PER_CELL = 8
+
+
+class LocalProjection:
+    """Equirectangular projection in meters around a reference point.
+
+    Uses the WGS84 radii of curvature at the reference latitude, so distances
+    are accurate to well under a meter across a city-sized area.
+    """
+
+    def __init__(self, lon0, lat0):
+        self.lon0 = float(lon0)
+        self.lat0 = float(lat0)
+        phi = math.radians(self.lat0)
+        w2 = 1 - CostModel.WGS84_E2 * math.sin(phi) ** 2
+        self.kx = math.radians(1) * CostModel.WGS84_A / math.sqrt(w2) * math.cos(phi)
+        self.ky = math.radians(1) * CostModel.WGS84_A * (1 - CostModel.WGS84_E2) / w2 ** 1.5
+
+    def project(self, lon, lat):
+        return (np.asarray(lon) - self.lon0) * self.kx, (np.asarray(lat) - self.lat0) * self.ky
+
+    def unproject(self, x, y):
+        return np.asarray(x) / self.kx + self.lon0, np.asarray(y) / self.ky + self.lat0
+
+
+def point_segment_distance(px, py, ax, ay, bx, by):
+    """Distance from point(s) p to segments a-b and the clamped fraction along each segment."""
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    t = np.divide((px - ax) * dx + (py - ay) * dy, length2, out=np.zeros_like(length2), where=length2 > 0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy)), t
+
+
+def build_segment_index(graph):
+    """Grid over the projected edge pieces stored as arrays (cell -> pieces in CSR form).
+
+    Pieces are the straight parts of every edge (see RoutingGraph.edge_shapes;
+    one per edge unless chains were contracted), and each is listed in every
+    cell its bounding box touches. Returns (arrays, meta) like
+    RoutingGraph.build_grid_index.
+    """
+    coords = np.asarray(graph.coords)
+    if graph.num_edges == 0:
+        meta = {"lon0": 0.0, "lat0": 0.0, "min_x": 0.0, "min_y": 0.0, "cell_size": 1.0, "cols": 1, "rows": 1}
+        return {"seg_cell_ptr": np.zeros(2, dtype=np.int64), "seg_edges": np.empty(0, dtype=np.int32)}, meta
+
+    lon0, lat0 = coords.mean(axis=0)
+    projection = LocalProjection(lon0, lat0)
+    _, start, end = graph.edge_shapes()
+    ax, ay = projection.project(start[:, 0], start[:, 1])
+    bx, by = projection.project(end[:, 0], end[:, 1])
+    x0, x1 = np.minimum(ax, bx), np.maximum(ax, bx)
+    y0, y1 = np.minimum(ay, by), np.maximum(ay, by)
+    pieces = len(start)
+
+    min_x, min_y = float(x0.min()), float(y0.min())
+    width, height = max(float(x1.max()) - min_x, 1.0), max(float(y1.max()) - min_y, 1.0)
+    lengths = np.hypot(x1 - x0, y1 - y0)
+    # Cells no smaller than a typical piece, so most pieces touch only a few
+    cell_size = max(math.sqrt(width * height * SEGMENTS_PER_CELL / pieces),
+                    float(np.median(lengths)), max(width, height) / 4096)
+    cols = int(width / cell_size) + 1
+    rows = int(height / cell_size) + 1
+
+    cx0 = ((x0 - min_x) / cell_size).astype(np.int64)
+    cx1 = np.minimum(((x1 - min_x) / cell_size).astype(np.int64), cols - 1)
+    cy0 = ((y0 - min_y) / cell_size).astype(np.int64)
+    cy1 = np.minimum(((y1 - min_y) / cell_size).astype(np.int64), rows - 1)
+    spans_x = cx1 - cx0 + 1
+    counts = spans_x * (cy1 - cy0 + 1)
+
+    # Expand every piece into the cells of its bounding box without a Python loop
+    piece = np.repeat(np.arange(pieces, dtype=np.int64), counts)
+    offset = np.arange(len(piece)) - np.repeat(np.cumsum(counts) - counts, counts)
+    cell = (cy0[piece] + offset // spans_x[piece]) * cols + cx0[piece] + offset % spans_x[piece]
+
+    order = np.argsort(cell, kind="stable")
+    cell_ptr = np.concatenate([[0], np.cumsum(np.bincount(cell, minlength=cols * rows))]).astype(np.int64)
+    meta = {"lon0": float(lon0), "lat0": float(lat0), "min_x": min_x, "min_y": min_y,
+            "cell_size": float(cell_size), "cols": cols, "rows": rows}
+    return {"seg_cell_ptr": cell_ptr, "seg_edges": piece[order].astype(np.int32)}, meta
+
+
+class SegmentIndex:
+    """Nearest-edge queries in projected meters over a RoutingGraph.
+
+    Positions along an edge are fractions of its projected length, 0 at its
+    source and 1 at its target, also for edges that bend.
+    """
+
+    def __init__(self, graph, arrays, meta):
+        self.graph = graph
+        self.meta = meta
+        self.cell_ptr = arrays["seg_cell_ptr"]
+        self.cell_pieces = arrays["seg_edges"]
+        self.projection = LocalProjection(meta["lon0"], meta["lat0"])
+        self.piece_ptr, self.start, self.end = graph.edge_shapes()
+        self.piece_edge = np.repeat(np.arange(graph.num_edges), np.diff(self.piece_ptr))
+        self.ax, self.ay = self.projection.project(self.start[:, 0], self.start[:, 1])
+        self.bx, self.by = self.projection.project(self.end[:, 0], self.end[:, 1])
+        # Where each piece starts along its edge and how much of the edge it covers
+        lengths = np.hypot(self.bx - self.ax, self.by - self.ay)
+        before = np.cumsum(lengths) - lengths
+        edge_start = before[self.piece_ptr[:-1]]
+        owner_length = np.append(edge_start[1:], lengths.sum())[self.piece_edge] - edge_start[self.piece_edge]
+        self.piece_offset = np.divide(before - edge_start[self.piece_edge], owner_length,
+                                      out=np.zeros_like(lengths), where=owner_length > 0)
+        self.piece_share = np.divide(lengths, owner_length, out=np.ones_like(lengths), where=owner_length > 0)
+
+    @classmethod
+    def for_graph(cls, graph):
+        """The graph's segment index from its snapshot (or built for older snapshots), cached per process."""
+        if "segment_index" not in graph._cache:
+            if "seg_cell_ptr" in graph.arrays:
+                arrays, meta = graph.arrays, graph.meta["segments"]
+            else:
+                arrays, meta = build_segment_index(graph)
+            graph._cache["segment_index"] = cls(graph, arrays, meta)
+        return graph._cache["segment_index"]
+
+    def query(self, lon, lat, radius):
+        """Edges within `radius` meters of (lon, lat), nearest first.
+
+        Returns (edges, distances, fractions); fraction is the position of the
+        closest point along each edge, 0 at its source and 1 at its target.
+        """
+        meta = self.meta
+        px, py = self.projection.project(lon, lat)
+        size = meta["cell_size"]
+        cx0 = max(int((px - radius - meta["min_x"]) // size), 0)
+        cx1 = min(int((px + radius - meta["min_x"]) // size), meta["cols"] - 1)
+        cy0 = max(int((py - radius - meta["min_y"]) // size), 0)
+        cy1 = min(int((py + radius - meta["min_y"]) // size), meta["rows"] - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+
+        chunks = []
+        for cy in range(cy0, cy1 + 1):
+            # Cells of one grid row are contiguous in the CSR arrays
+            first, last = cy * meta["cols"] + cx0, cy * meta["cols"] + cx1
+            chunks.append(self.cell_pieces[self.cell_ptr[first]:self.cell_ptr[last + 1]])
+        pieces = np.unique(np.concatenate(chunks)).astype(np.int64)
+        if len(pieces) == 0:
+            return pieces, np.empty(0), np.empty(0)
+
+        distances, t = point_segment_distance(px, py, self.ax[pieces], self.ay[pieces],
+                                              self.bx[pieces], self.by[pieces])
+        within = distances <= radius
+        pieces, distances, t = pieces[within], distances[within], t[within]
+        # Nearest piece of every edge, nearest edge first
+        order = np.argsort(distances, kind="stable")
+        edges = self.piece_edge[pieces[order]]
+        _, first = np.unique(edges, return_index=True)
+        order = order[np.sort(first)]
+        fractions = self.piece_offset[pieces[order]] + t[order] * self.piece_share[pieces[order]]
+        return self.piece_edge[pieces[order]], distances[order], np.minimum(fractions, 1.0)
+
+    def point_at(self, edge, fraction):
+        """(lon, lat) of the position `fraction` along an edge."""
+        p0, p1 = int(self.piece_ptr[edge]), int(self.piece_ptr[edge + 1])
+        piece = p0 + max(int(np.searchsorted(self.piece_offset[p0:p1], fraction, side="right")) - 1, 0)
+        share = float(self.piece_share[piece])
+        t = min(max((fraction - float(self.piece_offset[piece])) / share, 0.0), 1.0) if share > 0 else 0.0
+        point = self.start[piece] + t * (self.end[piece] - self.start[piece])
+        return float(point[0]), float(point[1])
+
+    def direction_at(self, edge, fraction):
+        """Unit (dx, dy) in projected meters of the edge's travel direction at `fraction`."""
+        p0, p1 = int(self.piece_ptr[edge]), int(self.piece_ptr[edge + 1])
+        piece = p0 + max(int(np.searchsorted(self.piece_offset[p0:p1], fraction, side="right")) - 1, 0)
+        dx, dy = float(self.bx[piece] - self.ax[piece]), float(self.by[piece] - self.ay[piece])
+        length = math.hypot(dx, dy)
+        return (dx / length, dy / length) if length > 0 else (0.0, 0.0)
+
+    def inner_points(self, edge, start=0.0, end=1.0):
+        """[[lon, lat], ...] of an edge's bends strictly between two fractions (start <= end)."""
+        p0, p1 = int(self.piece_ptr[edge]), int(self.piece_ptr[edge + 1])
+        # Bends are where the edge's pieces after the first begin
+        offsets = self.piece_offset[p0 + 1:p1]
+        between = np.flatnonzero((offsets > start) & (offsets < end)) + p0 + 1
+        return self.start[between].tolist()
+
+    def nearest(self, lon, lat, max_radius=math.inf, edge_mask=None):
+        """Closest edge to (lon, lat) as (edge, distance, fraction), or None when nothing is within max_radius.
+
+        The search radius starts at one cell and doubles until an edge is
+        found. With `edge_mask` (a boolean array over edges) only edges it
+        marks are considered.
+        """
+        meta = self.meta
+        px, py = self.projection.project(lon, lat)
+        max_x = meta["min_x"] + meta["cols"] * meta["cell_size"]
+        max_y = meta["min_y"] + meta["rows"] * meta["cell_size"]
+        # Beyond the farthest grid corner there is nothing left to find
+        reach = min(max_radius, math.hypot(max(abs(px - meta["min_x"]), abs(px - max_x)),
+                                           max(abs(py - meta["min_y"]), abs(py - max_y))))
+        radius = min(meta["cell_size"], reach)
+        while True:
+            edges, distances, fractions = self.query(lon, lat, radius)
+            if edge_mask is not None:
+                allowed = edge_mask[edges]
+                edges, distances, fractions = edges[allowed], distances[allowed], fractions[allowed]
+            if len(edges):
+                return int(edges[0]), float(distances[0]), float(fractions[0])
+            if radius >= reach:
+                return None
+            radius = min(radius * 2, reach)
@@ -0,0 +1,193 @@
+import json
+from array import array
+
+import numpy as np
+
+import Components
+import CostModel
+import MultilevelRouting
+import RoutingGraph
+import TurnRouting
+
+# Characters read from the file at a time; a feature larger than this grows the buffer
+READ_SIZE = 1 << 20
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class _Reader:
+    """Text buffer over a file that parses one JSON value at a time, reading more as needed."""
+
+    def __init__(self, f, read_size):
+        self.f = f
+        self.read_size = read_size
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # At least as much as is buffered, so a value spanning many reads is re-parsed O(log n) times
+        chunk = self.f.read(max(self.read_size, len(self.text) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop what has been parsed so the buffer stays one feature (or chunk) long
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character, or "" at the end of the file."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text) or not self._fill():
+                return self.text[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            found = self.peek() or "end of file"
+            raise ValueError(f"Malformed GeoJSON: expected {char!r}, found {found!r}.")
+        self.pos += 1
+
+    def value(self):
+        """The next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # Most likely cut off by the end of the buffer; read on and retry
+                if self.eof or not self._fill():
+                    raise
+                continue
+            # A number may end exactly at the buffer's end and continue in the next read
+            if end == len(self.text) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_features(f, read_size=READ_SIZE):
+    """Features of a GeoJSON FeatureCollection in a text file, parsed one at a time.
+
+    Only the feature being parsed (and one read buffer) is held in memory,
+    so the file may be far larger than RAM. Other top-level members are
+    parsed and skipped.
+    """
+    reader = _Reader(f, read_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key != "features":
+            reader.value()
+        else:
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.peek() == "]":
+                        reader.pos += 1
+                        break
+                    reader.expect(",")
+        if reader.peek() == "}":
+            return
+        reader.expect(",")
+
+
+class GraphBuilder:
+    """Collects what RoutingGraph.from_geojson needs from features fed one at a time.
+
+    Line coordinates go into growable typed arrays and each feature leaves
+    only a few numbers (speed, cost, oneway, speed profile row, way id)
+    behind, so memory follows the size of the graph rather than of the
+    GeoJSON. build() then gives the same graph as from_geojson on the whole
+    FeatureCollection.
+    """
+
+    def __init__(self):
+        self.points = array("d")  # lon, lat of every line vertex
+        self.line_lengths = array("q")
+        self.line_owner = array("q")
+        self.speeds = array("d")
+        self.legacy_cost = array("d")
+        self.oneway = array("b")
+        self.feature_profile = array("q")
+        self.profiles = {}  # profile bytes -> row
+        self.ways = {}  # way id -> feature index, for turn restrictions
+        self.restrictions = []  # turn restriction Point features (few)
+        self.count = 0
+
+    def add(self, feature):
+        index = self.count
+        self.count += 1
+        properties = feature.get('properties') or {}
+        for coords in CostModel.feature_lines(feature):
+            if len(coords) >= 2:
+                for point in coords:
+                    self.points.append(float(point[0]))
+                    self.points.append(float(point[1]))
+                self.line_lengths.append(len(coords))
+                self.line_owner.append(index)
+        self.speeds.append(CostModel.speed_kmh(properties))
+        self.legacy_cost.append(float(properties.get('cost', 1)))
+        self.oneway.append(properties.get('oneway', 'no') == 'yes')
+        profile = CostModel.speed_profile(properties).astype(np.float32).tobytes()
+        self.feature_profile.append(self.profiles.setdefault(profile, len(self.profiles)))
+        for key in TurnRouting.WAY_ID_KEYS:
+            if key in properties:
+                self.ways[str(properties[key])] = index
+                break
+        if feature['geometry']['type'] == 'Point' and 'restriction' in properties:
+            self.restrictions.append(feature)
+
+    def add_features(self, features):
+        for feature in features:
+            self.add(feature)
+        return self
+
+    def segments(self):
+        """(src, dst, owner) as CostModel.segment_arrays returns them."""
+        points = np.frombuffer(self.points, dtype=np.float64).reshape(-1, 2)
+        counts = np.frombuffer(self.line_lengths, dtype=np.int64)
+        starts = np.ones(len(points), dtype=bool)
+        starts[np.cumsum(counts) - 1] = False
+        src_index = np.flatnonzero(starts)
+        owner = np.repeat(np.frombuffer(self.line_owner, dtype=np.int64), counts - 1)
+        return points[src_index], points[src_index + 1], owner
+
+    def speed_profiles(self):
+        """(profiles, feature_profile) as CostModel.speed_profiles returns them."""
+        if not self.count:
+            return np.ones((1, CostModel.PROFILE_BUCKETS), dtype=np.float32), np.empty(0, dtype=np.int32)
+        rows = np.frombuffer(b"".join(self.profiles), dtype=np.float32).reshape(-1, CostModel.PROFILE_BUCKETS)
+        # Sorted rows, like np.unique in CostModel.speed_profiles
+        profiles, remap = np.unique(rows, axis=0, return_inverse=True)
+        return profiles, remap.reshape(-1)[np.frombuffer(self.feature_profile, dtype=np.int64)].astype(np.int32)
+
+    def build(self):
+        src, dst, owner = self.segments()
+        speeds = np.frombuffer(self.speeds, dtype=np.float64)
+        legacy = np.frombuffer(self.legacy_cost, dtype=np.float64)
+        weights = CostModel.edge_weights(src, dst, speeds[owner], legacy[owner])
+        oneway = np.frombuffer(self.oneway, dtype=np.int8).astype(bool)
+        graph = RoutingGraph.RoutingGraph.from_segments(src, dst, oneway[owner], weights, owner)
+        graph.add_speed_profiles(*self.speed_profiles())
+        Components.add_component_labels(graph)
+        TurnRouting.add_turn_tables(graph, self.restrictions, self.ways)
+        MultilevelRouting.add_overlay(graph)
+        return graph
+
+
+def build_graph(path, extra_features=()):
+    """Routing graph of a GeoJSON file (plus any extra features), streamed rather than loaded whole."""
+    builder = GraphBuilder()
+    with open(path, "r", encoding="utf-8") as f:
+        builder.add_features(iter_features(f))
+    return builder.add_features(extra_features).build()
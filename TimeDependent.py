@@ -0,0 +1,189 @@
+import copy
+import heapq
+import math
+from datetime import datetime, time as dtime
+
+import numpy as np
+
+import ComputePool
+import CostModel
+import EdgeSnapping
+import RoutingGraph
+
+DAY_SECONDS = 24 * 3600
+# Straight-line estimates use the sphere while edge lengths use the ellipsoid; stay a little below
+HEURISTIC_SLACK = 0.99
+
+
+class TimeDependentCosts:
+    """Edge travel times by time of day, from a graph's shared speed profiles.
+
+    Each edge has a free-flow time (the "time" weight) and a row of
+    `td_profiles` (speed factors per 15-minute bucket) chosen by
+    `edge_profile`. Travel time integrates the speed across buckets, so
+    entering an edge later never means leaving it earlier (FIFO).
+    """
+
+    def __init__(self, graph):
+        if "td_profiles" not in graph.arrays:
+            raise ValueError("The routing graph has no speed profiles; rebuild it to route by departure time.")
+        # Base times; for_graph swaps in a closure view's own
+        self.free_flow = graph.arrays["weight_time"]
+        self.profiles = graph.arrays["td_profiles"]
+        self.edge_profile = graph.arrays["edge_profile"]
+        distance = graph.arrays["weight_distance"]
+        moving = np.isfinite(self.free_flow) & (self.free_flow > 0)
+        top_speed = float(np.max(distance[moving] / self.free_flow[moving])) if moving.any() else 1.0
+        # Fastest speed anywhere at any time, for the A* lower bound (closures only slow roads down)
+        self.max_speed_ms = top_speed * float(np.max(self.profiles))
+
+    @classmethod
+    def for_graph(cls, graph):
+        if "td_costs" not in graph._cache:
+            graph._cache["td_costs"] = cls(graph)
+        base = graph._cache["td_costs"]
+        if graph.closures is None:
+            return base
+        # A closure view differs only in its free-flow times
+        costs = copy.copy(base)
+        costs.free_flow = graph.weights("time")
+        return costs
+
+    def travel_time(self, edge, start, fraction=1.0):
+        """Seconds to drive `fraction` of an edge entered at `start` (seconds since midnight)."""
+        remaining = float(self.free_flow[edge]) * fraction  # free-flow seconds still to drive
+        if remaining <= 0:
+            return 0.0
+        if remaining == math.inf:  # closed road
+            return math.inf
+        factors = self.profiles[self.edge_profile[edge]]
+        t = start
+        while True:
+            bucket = int(t // CostModel.BUCKET_SECONDS) % CostModel.PROFILE_BUCKETS
+            factor = float(factors[bucket])
+            left = CostModel.BUCKET_SECONDS - t % CostModel.BUCKET_SECONDS
+            if remaining <= left * factor:
+                return t + remaining / factor - start
+            remaining -= left * factor
+            t += left
+
+
+def parse_departure(value):
+    """Seconds since midnight from "HH:MM[:SS]", an ISO datetime, or a number of seconds."""
+    if isinstance(value, (int, float)):
+        return float(value) % DAY_SECONDS
+    try:
+        moment = dtime.fromisoformat(value)
+    except ValueError:
+        moment = datetime.fromisoformat(value).time()
+    return float(moment.hour * 3600 + moment.minute * 60 + moment.second)
+
+
+def format_clock(seconds):
+    seconds = int(round(seconds)) % DAY_SECONDS
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def earliest_arrival(graph, sources, targets, departure, target_point=None):
+    """Time-dependent Dijkstra (A* when target_point is given) over the CSR arrays.
+
+    `sources` maps start node -> seconds after departure it is reached;
+    `targets` maps end node -> (edge, fraction) still to drive from it. Returns
+    (duration, path) for the earliest arrival, path from start to end node.
+    """
+    costs = TimeDependentCosts.for_graph(graph)
+    indptr = graph.indptr
+    edge_targets = graph.targets
+    settle = ComputePool.budget().settle
+
+    if target_point is not None:
+        # Only for the nodes the search pushes, once each: a short query never touches the whole graph
+        coords = graph.coords
+        target_lon, target_lat = math.radians(target_point[0]), math.radians(target_point[1])
+        cos_target = math.cos(target_lat)
+        meters_to_seconds = 2 * CostModel.EARTH_RADIUS_M * HEURISTIC_SLACK / costs.max_speed_ms
+        estimates = {}
+
+        def estimate(node):
+            if node not in estimates:
+                lon, lat = coords[node].tolist()
+                lon, lat = math.radians(lon), math.radians(lat)
+                a = math.sin((target_lat - lat) / 2) ** 2 + \
+                    math.cos(lat) * cos_target * math.sin((target_lon - lon) / 2) ** 2
+                # Haversine, as CostModel.haversine_m
+                estimates[node] = math.asin(math.sqrt(min(a, 1.0))) * meters_to_seconds
+            return estimates[node]
+    else:
+        def estimate(node):
+            return 0.0
+
+    dist = {}
+    parent = {}
+    heap = []
+    for node, arrival in sources.items():
+        if arrival < dist.get(node, math.inf):
+            dist[node] = arrival
+            parent[node] = -1
+            heapq.heappush(heap, (arrival + estimate(node), arrival, node))
+
+    best, best_node = math.inf, -1
+    while heap:
+        key, d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        if key >= best:
+            break
+        settle()
+        if u in targets:
+            edge, fraction = targets[u]
+            total = d + costs.travel_time(edge, departure + d, fraction)
+            if total < best:
+                best, best_node = total, u
+        for e in range(int(indptr[u]), int(indptr[u + 1])):
+            v = int(edge_targets[e])
+            nd = d + costs.travel_time(e, departure + d)
+            if nd < dist.get(v, math.inf):
+                dist[v] = nd
+                parent[v] = u
+                heapq.heappush(heap, (nd + estimate(v), nd, v))
+
+    if best_node < 0:
+        raise RoutingGraph.NoPathError("No path between the given start and end nodes.")
+    return best, RoutingGraph.path_to(parent, best_node)
+
+
+def shortest_path(graph, source, target, departure, astar=True):
+    """Earliest-arrival route between two EdgeSnapping snaps leaving at `departure` (seconds since midnight).
+
+    Returns (duration_s, [[lon, lat], ...]) from the snapped source to the snapped target.
+    """
+    costs = TimeDependentCosts.for_graph(graph)
+    sources_of = graph.edge_sources()
+    best, nodes = math.inf, None
+
+    if source.edge == target.edge:
+        if target.fraction >= source.fraction:
+            best, nodes = costs.travel_time(source.edge, departure, target.fraction - source.fraction), []
+        elif source.twin >= 0:
+            best, nodes = costs.travel_time(source.twin, departure, source.fraction - target.fraction), []
+
+    starts = {int(graph.targets[source.edge]): costs.travel_time(source.edge, departure, 1 - source.fraction)}
+    ends = {int(sources_of[target.edge]): (target.edge, target.fraction)}
+    if source.twin >= 0:
+        starts[int(graph.targets[source.twin])] = costs.travel_time(source.twin, departure, source.fraction)
+    if target.twin >= 0:
+        ends[int(sources_of[target.twin])] = (target.twin, 1 - target.fraction)
+
+    try:
+        if not EdgeSnapping.may_connect(graph, source, target):
+            raise RoutingGraph.NoPathError("The snapped source and target are in different components.")
+        duration, path = earliest_arrival(graph, starts, ends, departure,
+                                          (target.lon, target.lat) if astar else None)
+        if duration < best:
+            best, nodes = duration, path
+    except RoutingGraph.NoPathError:
+        pass
+
+    if nodes is None:
+        raise RoutingGraph.NoPathError("No path exists between the snapped source and target.")
+    return best, EdgeSnapping.route_coords(graph, source, target, nodes, "time")
@@ -0,0 +1,201 @@
+import argparse
+import io
+import json
+import time
+
+import numpy as np
+import psycopg2
+
+import CostModel
+
+# Database connection parameters
+DB_CONFIG = {
+    "dbname": "routedb",
+    "user": "postgres",
+    "password": "admin",
+    "host": "localhost",
+    "port": "5432"
+}
+
+# Same columns as pgrouting.sql, with geometry filled at load time
+CREATE_TABLES = """
+CREATE TABLE nodes (
+    id SERIAL PRIMARY KEY,
+    lat NUMERIC NOT NULL,
+    lon NUMERIC NOT NULL,
+    geom geometry(Point, 4326)
+);
+
+CREATE TABLE edges (
+    id SERIAL PRIMARY KEY,
+    source INT NOT NULL,
+    target INT NOT NULL,
+    length NUMERIC NOT NULL, -- Distance (meters)
+    cost NUMERIC NOT NULL, -- Travel cost (time or distance)
+    reverse_cost NUMERIC, -- -1 for one-way edges (pgRouting convention)
+    oneway BOOLEAN DEFAULT FALSE,
+    highway TEXT,
+    maxspeed INT,
+    geom geometry(LineString, 4326)
+);
+"""
+
+# Built after the data is in, which is much faster than maintaining them row by row
+CREATE_INDEXES = """
+ALTER TABLE edges ADD CONSTRAINT edges_source_fkey FOREIGN KEY (source) REFERENCES nodes(id);
+ALTER TABLE edges ADD CONSTRAINT edges_target_fkey FOREIGN KEY (target) REFERENCES nodes(id);
+CREATE INDEX nodes_geom_idx ON nodes USING GIST (geom);
+CREATE INDEX edges_geom_idx ON edges USING GIST (geom);
+CREATE INDEX edges_source_idx ON edges (source);
+CREATE INDEX edges_target_idx ON edges (target);
+SELECT setval('nodes_id_seq', (SELECT COALESCE(MAX(id), 1) FROM nodes));
+SELECT setval('edges_id_seq', (SELECT COALESCE(MAX(id), 1) FROM edges));
+"""
+
+
+class LineIterFile(io.TextIOBase):
+    """Read-only file object over an iterator of text lines, so COPY can stream them."""
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = ""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+        if size < 0:
+            chunk, self._buffer = self._buffer, ""
+        else:
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def copy_text(value):
+    """Escape a value for COPY's text format (None becomes NULL)."""
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def build_topology(features, precision=7, metric="distance"):
+    """Deduplicate segment endpoints into nodes and compute source/target for every edge.
+
+    Endpoints are merged when they are equal after rounding to `precision`
+    decimal places (7 is about 1 cm; 4 matches pgr_createTopology's 0.0001).
+    """
+    line_features = [f for f in features if f['geometry']['type'] == 'LineString']
+    src, dst, owner, weights = CostModel.geojson_edge_weights(line_features)
+
+    scale = 10.0 ** precision
+    keys = np.rint(np.concatenate([src, dst]) * scale).astype(np.int64)
+    unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    source = inverse[:len(src)] + 1  # node ids start at 1 like SERIAL
+    target = inverse[len(src):] + 1
+
+    # Segments that collapse to a single node cannot be routed over
+    keep = source != target
+    properties = [f.get('properties') or {} for f in line_features]
+    oneway = np.array([p.get('oneway', 'no') == 'yes' for p in properties], dtype=bool)[owner]
+
+    return {
+        "node_coords": unique_keys / scale,  # (N, 2) lon/lat
+        "source": source[keep],
+        "target": target[keep],
+        "length": weights["distance"][keep],
+        "cost": weights[metric][keep],
+        "oneway": oneway[keep],
+        "owner": owner[keep],
+        "properties": properties,
+    }
+
+
+def node_rows(topology):
+    for node_id, (lon, lat) in enumerate(topology["node_coords"].tolist(), 1):
+        yield f"{node_id}\t{lat!r}\t{lon!r}\tSRID=4326;POINT({lon!r} {lat!r})\n"
+
+
+def edge_rows(topology):
+    properties = topology["properties"]
+    # Ends on the merged node positions, so ST_StartPoint(e.geom) = n.geom joins hold at any precision
+    node_coords = topology["node_coords"]
+    columns = zip(topology["source"].tolist(), topology["target"].tolist(), topology["length"].tolist(),
+                  topology["cost"].tolist(), topology["oneway"].tolist(), topology["owner"].tolist(),
+                  node_coords[topology["source"] - 1].tolist(), node_coords[topology["target"] - 1].tolist())
+    for edge_id, (source, target, length, cost, oneway, owner, (x1, y1), (x2, y2)) in enumerate(columns, 1):
+        props = properties[owner]
+        maxspeed = CostModel.parse_maxspeed(props.get("maxspeed"))
+        highway = props.get("highway")
+        yield "\t".join((
+            str(edge_id), str(source), str(target), repr(length), repr(cost),
+            "-1" if oneway else repr(cost),
+            "t" if oneway else "f",
+            copy_text(highway if not isinstance(highway, list) else ";".join(highway)),
+            copy_text(round(maxspeed) if maxspeed is not None else None),
+            f"SRID=4326;LINESTRING({x1!r} {y1!r}, {x2!r} {y2!r})",
+        )) + "\n"
+
+
+def load_topology(conn, topology, replace=False, log=print):
+    """Write nodes and edges with COPY, then index and analyze them, in one transaction."""
+    with conn.cursor() as cur:
+        if replace:
+            cur.execute("DROP TABLE IF EXISTS edges; DROP TABLE IF EXISTS nodes;")
+        cur.execute(CREATE_TABLES)
+
+        start = time.perf_counter()
+        cur.copy_expert("COPY nodes (id, lat, lon, geom) FROM STDIN", LineIterFile(node_rows(topology)))
+        log(f"Copied {len(topology['node_coords'])} nodes in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        cur.copy_expert(
+            "COPY edges (id, source, target, length, cost, reverse_cost, oneway, highway, maxspeed, geom) FROM STDIN",
+            LineIterFile(edge_rows(topology)))
+        log(f"Copied {len(topology['source'])} edges in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        cur.execute(CREATE_INDEXES)
+        log(f"Built constraints and indexes in {time.perf_counter() - start:.1f}s")
+
+        # Fresh planner statistics so pgr_dijkstra's edge query is planned well straight away
+        start = time.perf_counter()
+        cur.execute("ANALYZE nodes; ANALYZE edges;")
+        log(f"Analyzed in {time.perf_counter() - start:.1f}s")
+    conn.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load a GeoJSON road network into routable nodes/edges tables (replaces pgr_createTopology).")
+    parser.add_argument("geojson", help="path to the GeoJSON file, e.g. data/map.geojson")
+    parser.add_argument("--replace", action="store_true", help="drop existing nodes/edges tables first")
+    parser.add_argument("--precision", type=int, default=7,
+                        help="decimal places used to merge coincident endpoints (4 ~ pgr_createTopology 0.0001)")
+    parser.add_argument("--cost", choices=["distance", "time"], default="distance",
+                        help="what the edges.cost column holds")
+    parser.add_argument("--dry-run", action="store_true", help="build the topology but do not touch the database")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with open(args.geojson, "r", encoding="utf-8") as f:
+        geojson_data = json.load(f)
+    topology = build_topology(geojson_data['features'], precision=args.precision, metric=args.cost)
+    print(f"Topology: {len(topology['node_coords'])} nodes, {len(topology['source'])} edges "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    if not args.dry_run:
+        conn = psycopg2.connect(**DB_CONFIG)
+        try:
+            load_topology(conn, topology, replace=args.replace)
+        finally:
+            conn.close()
+        print(f"Done in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,250 @@
+import heapq
+import math
+
+import numpy as np
+
+import ComputePool
+import EdgeSnapping
+import RoutingGraph
+
+# Turn penalties in seconds, added when routing by "time". Traffic keeps left
+# here, so right turns cross oncoming traffic; flip LEFT_HAND_TRAFFIC otherwise.
+LEFT_HAND_TRAFFIC = True
+STRAIGHT_DEGREES = 30.0
+KERBSIDE_TURN_S = 5.0
+CROSSING_TURN_S = 15.0
+U_TURN_S = 30.0
+# Restriction features are Points at the via node whose from/to refer to ways by one of these properties
+WAY_ID_KEYS = ("osm_id", "@id", "id")
+# A restriction's via point must sit on a graph node (degrees)
+VIA_TOLERANCE_DEG = 1e-6
+
+
+def edge_bearings(graph):
+    """Compass bearings (degrees clockwise from north) with which every edge starts and ends, vectorized.
+
+    Straight edges start and end on the same bearing; a contracted edge that
+    bends uses its first and last piece.
+    """
+    piece_ptr, start, end = graph.edge_shapes()
+    mid_lat = np.radians((start[:, 1] + end[:, 1]) / 2)
+    dx = (end[:, 0] - start[:, 0]) * np.cos(mid_lat)
+    dy = end[:, 1] - start[:, 1]
+    bearings = (np.degrees(np.arctan2(dx, dy)) % 360).astype(np.float32)
+    return bearings[piece_ptr[:-1]], bearings[piece_ptr[1:] - 1]
+
+
+def _way_index(features):
+    """Way id -> feature index, from the first WAY_ID_KEYS property each feature has."""
+    index = {}
+    for i, feature in enumerate(features):
+        properties = feature.get('properties') or {}
+        for key in WAY_ID_KEYS:
+            if key in properties:
+                index[str(properties[key])] = i
+                break
+    return index
+
+
+def turn_angles(arriving, leaving):
+    """Signed turn angle in degrees (> 0 turns right) from every arriving bearing to every leaving one."""
+    return (leaving[None, :] - arriving[:, None] + 540.0) % 360.0 - 180.0
+
+
+def _matches_turn(kind, angles):
+    """Which turns an OSM restriction value (no_left_turn, only_straight_on, ...) is about."""
+    if kind.endswith("left_turn"):
+        return angles <= -STRAIGHT_DEGREES
+    if kind.endswith("right_turn"):
+        return angles >= STRAIGHT_DEGREES
+    if kind.endswith("straight_on"):
+        return np.abs(angles) < STRAIGHT_DEGREES
+    if kind.endswith("u_turn"):
+        return np.abs(angles) > 180.0 - STRAIGHT_DEGREES
+    return np.ones(angles.shape, dtype=bool)
+
+
+def restriction_keys(graph, features, start_bearings, end_bearings, ways=None):
+    """Sorted int64 keys from_edge * num_edges + to_edge of every banned turn.
+
+    Restrictions are Point features at the via node with properties
+    `restriction` (OSM values such as no_left_turn or only_straight_on),
+    `from` and `to` (way ids). Ways are not split at junctions, so the turn
+    direction in the value picks which of the from/to edge pairs it covers.
+    Returns (keys, skipped) where skipped counts restrictions that did not
+    match the graph. `ways` maps way ids to feature indexes when `features`
+    holds only the restrictions (see StreamingGeojson.GraphBuilder).
+    """
+    if ways is None:
+        ways = _way_index(features)
+    indptr = graph.indptr
+    targets, edge_way = np.asarray(graph.targets), np.asarray(graph.edge_way)
+    banned = []
+    skipped = 0
+    for feature in features:
+        properties = feature.get('properties') or {}
+        kind = str(properties.get("restriction", ""))
+        if feature['geometry']['type'] != 'Point' or not kind.startswith(("no_", "only_")):
+            continue
+        from_way = ways.get(str(properties.get("from")))
+        to_way = ways.get(str(properties.get("to")))
+        via, offset = graph.nearest_node(*feature['geometry']['coordinates'][:2])
+        if from_way is None or to_way is None or offset > VIA_TOLERANCE_DEG:
+            skipped += 1
+            continue
+
+        into = np.flatnonzero((targets == via) & (edge_way == from_way))
+        out = np.arange(indptr[via], indptr[via + 1])
+        angles = turn_angles(end_bearings[into], start_bearings[out])
+        named = (edge_way[out] == to_way)[None, :] & _matches_turn(kind, angles)
+        # no_*: ban the named turn; only_*: ban every other turn from the same edges
+        pairs = named if kind.startswith("no_") else ~named
+        if kind.startswith("only_"):
+            pairs &= named.any(axis=1)[:, None]
+        rows, cols = np.nonzero(pairs)
+        if len(rows) == 0:
+            skipped += 1
+            continue
+        banned.append(into[rows].astype(np.int64) * graph.num_edges + out[cols])
+
+    keys = np.unique(np.concatenate(banned)) if banned else np.empty(0, dtype=np.int64)
+    return keys.astype(np.int64), skipped
+
+
+def add_turn_tables(graph, features, ways=None):
+    """Store edge bearings and the restriction table in the graph (and so in its snapshot)."""
+    start_bearings, end_bearings = edge_bearings(graph)
+    keys, skipped = restriction_keys(graph, features, start_bearings, end_bearings, ways)
+    graph.arrays["edge_bearing"] = start_bearings
+    graph.arrays["edge_end_bearing"] = end_bearings
+    graph.arrays["turn_restrictions"] = keys
+    graph.meta["turn_restrictions"] = {"banned_turns": int(len(keys)), "skipped": skipped}
+
+
+class TurnModel:
+    """Turn penalties and bans for transitions between consecutive edges."""
+
+    def __init__(self, graph, metric="time", allow_u_turns=False):
+        self.graph = graph
+        self.weights = graph.weights(metric)
+        self.penalize = metric == "time"
+        self.allow_u_turns = allow_u_turns
+        if "edge_end_bearing" in graph.arrays:
+            self.bearings, self.end_bearings = graph.arrays["edge_bearing"], graph.arrays["edge_end_bearing"]
+        else:
+            # Snapshots from before turn tables: compute once per process
+            if "edge_bearing" not in graph._cache:
+                graph._cache["edge_bearing"] = edge_bearings(graph)
+            self.bearings, self.end_bearings = graph._cache["edge_bearing"]
+        self.restrictions = graph.arrays.get("turn_restrictions", np.empty(0, dtype=np.int64))
+        # Twin (the reverse along the same road) of every edge, filled in as edges are reached; -2 is unknown
+        if "edge_twins" not in graph._cache:
+            graph._cache["edge_twins"] = np.full(graph.num_edges, -2, dtype=np.int64)
+        self.twins = graph._cache["edge_twins"]
+
+    def twin(self, edge):
+        """EdgeSnapping.find_twin of `edge`, looked up once per process."""
+        if self.twins[edge] == -2:
+            self.twins[edge] = EdgeSnapping.find_twin(self.graph, edge)
+        return int(self.twins[edge])
+
+    def turn_costs(self, edge, out):
+        """Cost of turning from `edge` onto each edge in `out`; inf where the turn is not allowed."""
+        delta = turn_angles(self.end_bearings[[edge]], self.bearings[out])[0]
+        crossing = delta > 0 if LEFT_HAND_TRAFFIC else delta < 0
+        if self.penalize:
+            costs = np.where(np.abs(delta) < STRAIGHT_DEGREES, 0.0,
+                             np.where(crossing, CROSSING_TURN_S, KERBSIDE_TURN_S))
+        else:
+            costs = np.zeros(len(out))
+
+        # Only the twin turns back: another chain between the same two junctions is a different road
+        u_turn = out == self.twin(edge)
+        if u_turn.any():
+            # Turning back is always allowed at a dead end, otherwise only when enabled
+            if self.allow_u_turns or u_turn.all():
+                costs = np.where(u_turn, U_TURN_S if self.penalize else 0.0, costs)
+            else:
+                costs = np.where(u_turn, np.inf, costs)
+
+        if len(self.restrictions):
+            keys = edge * self.graph.num_edges + out.astype(np.int64)
+            found = np.searchsorted(self.restrictions, keys)
+            banned = self.restrictions[np.minimum(found, len(self.restrictions) - 1)] == keys
+            costs = np.where(banned, np.inf, costs)
+        return costs
+
+
+def shortest_path(graph, source, target, metric="time", allow_u_turns=False):
+    """Turn-aware route between two EdgeSnapping snaps; returns (cost, [[lon, lat], ...]).
+
+    Search states are directed edges ("standing at the end of edge e"); the
+    outgoing edges of e's end node and their turn costs are computed only when
+    e is settled, so no edge-based graph is ever built and memory grows with
+    the edges actually reached.
+    """
+    model = TurnModel(graph, metric, allow_u_turns)
+    weights = model.weights
+    indptr = graph.indptr
+    targets = graph.targets
+    settle = ComputePool.budget().settle
+
+    best, best_edge, best_last, best_direct = math.inf, -1, -1, False
+    if source.edge == target.edge:
+        if target.fraction >= source.fraction:
+            best, best_direct = (target.fraction - source.fraction) * float(weights[source.edge]), True
+        elif source.twin >= 0:
+            best, best_direct = (source.fraction - target.fraction) * float(weights[source.twin]), True
+
+    # Finishing states: driving part of the target edge (or its twin) after a turn onto it
+    finish = {target.edge: target.fraction}
+    if target.twin >= 0:
+        finish[target.twin] = 1 - target.fraction
+
+    dist = {source.edge: (1 - source.fraction) * float(weights[source.edge])}
+    if source.twin >= 0:
+        dist[source.twin] = source.fraction * float(weights[source.twin])
+    parent = {edge: -1 for edge in dist}
+    heap = [(d, edge) for edge, d in dist.items()]
+    heapq.heapify(heap)
+    # Different components: only the direct route along the shared segment can exist
+    if not EdgeSnapping.may_connect(graph, source, target):
+        heap = []
+
+    while heap:
+        d, e = heapq.heappop(heap)
+        if d > dist[e]:
+            continue
+        if d >= best:
+            break
+        settle()
+        node = int(targets[e])
+        out = np.arange(indptr[node], indptr[node + 1])
+        if len(out) == 0:
+            continue
+        turn = model.turn_costs(e, out)
+        for f, cost in zip(out.tolist(), turn.tolist()):
+            if cost == math.inf:
+                continue
+            if f in finish and d + cost + finish[f] * float(weights[f]) < best:
+                best, best_edge, best_last, best_direct = d + cost + finish[f] * float(weights[f]), e, f, False
+            nd = d + cost + float(weights[f])
+            if nd < dist.get(f, math.inf):
+                dist[f] = nd
+                parent[f] = e
+                heapq.heappush(heap, (nd, f))
+
+    if best == math.inf:
+        raise RoutingGraph.NoPathError("No turn-legal path exists between the snapped source and target.")
+    if best_direct:
+        return best, EdgeSnapping.route_coords(graph, source, target, [])
+
+    edges = [best_last]
+    e = best_edge
+    while e != -1:
+        edges.append(e)
+        e = parent[e]
+    edges.reverse()
+    # Nodes passed: the end of every edge but the last, which is left part way
+    nodes = [int(targets[e]) for e in edges[:-1]]
+    return best, EdgeSnapping.route_coords(graph, source, target, nodes, metric, edges[1:-1])
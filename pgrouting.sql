@@ -1,3 +1,6 @@
+-- Fresh loads: `python TopologyLoader.py data/map.geojson --replace` creates and fills
+-- these tables with COPY (geometry, source/target, indexes and ANALYZE included),
+-- so the per-row UPDATEs and pgr_createTopology below are not needed.
 CREATE TABLE nodes (
     id SERIAL PRIMARY KEY,
     lat NUMERIC NOT NULL,